@@ -0,0 +1,30 @@
+CREATE EXTERNAL TABLE IF NOT EXISTS qcdb.fool_call_index_parquet (
+         cid string,
+         call_url string,
+         publication_author string,
+         publication_time_published string,
+         publication_time_updated string,
+         call_title string,
+         call_subtitle string,
+         period_end string,
+         ticker string,
+         ticker_exchange string,
+         company_name string,
+         fool_company_id string,
+         fiscal_period_year string,
+         fiscal_period_qtr string,
+         call_short_title string,
+         call_date string,
+         call_time string,
+         duration_minutes string
+)
+PARTITIONED BY (call_year int, call_quarter int)
+STORED AS PARQUET LOCATION 's3://fool-calls/state=structured-parquet/version=202007.1/table=call_index/'
+TBLPROPERTIES (
+  'projection.enabled' = 'true',
+  'projection.call_year.type' = 'integer',
+  'projection.call_year.range' = '2000,2030',
+  'projection.call_quarter.type' = 'integer',
+  'projection.call_quarter.range' = '1,4',
+  'storage.location.template' = 's3://fool-calls/state=structured-parquet/version=202007.1/table=call_index/call_year=${call_year}/call_quarter=${call_quarter}/'
+)
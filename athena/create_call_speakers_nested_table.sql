@@ -1,3 +1,4 @@
+-- reads per-cid objects (cid=*.json) and compacted packs (pack-*.ndjson.gz) alike; see foolcalls/shards.py
 CREATE EXTERNAL TABLE IF NOT EXISTS qcdb.fool_call_speakers_nested (
   cid string,
   participants struct <
@@ -0,0 +1,17 @@
+CREATE EXTERNAL TABLE IF NOT EXISTS qcdb.fool_call_speakers_parquet (
+         cid string,
+         participant_type string,
+         speaker string,
+         `role` string,
+         affiliation string
+)
+PARTITIONED BY (call_year int, call_quarter int)
+STORED AS PARQUET LOCATION 's3://fool-calls/state=structured-parquet/version=202007.1/table=speakers/'
+TBLPROPERTIES (
+  'projection.enabled' = 'true',
+  'projection.call_year.type' = 'integer',
+  'projection.call_year.range' = '2000,2030',
+  'projection.call_quarter.type' = 'integer',
+  'projection.call_quarter.range' = '1,4',
+  'storage.location.template' = 's3://fool-calls/state=structured-parquet/version=202007.1/table=speakers/call_year=${call_year}/call_quarter=${call_quarter}/'
+)
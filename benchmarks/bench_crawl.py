@@ -0,0 +1,128 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+import tempfile
+import time
+from foolcalls import sync_downloaders, throttle, sessions, runlog, replay_server
+from foolcalls.config import FoolCalls, Local
+
+# ---------------------------------------------------------------------------
+# END-TO-END CRAWL BENCHMARK (OFFLINE)
+# ---------------------------------------------------------------------------
+# runs the full download + scrape sync (sync_downloaders.main with --scraper_callback) against a local fool.com
+# stand-in (foolcalls/replay_server.py) with injected latency/errors/429s, into a temporary local store, and reports:
+#   transcripts/min  downloaded and scraped transcripts per minute of wall time
+#   requests         what the server saw, by kind (listing/transcript) and status
+#   wasted           requests that brought back nothing new (429s, 5xx, 404s, repeat downloads of a page)
+#   raw_store_bytes  size of the downloaded pages as stored (trimmed, unless --keep_full_page)
+# plus the run's span percentiles (request, upload_raw, parse, ...; see runlog.py).
+# the crawler's politeness settings are overridden by --rate/--max_rate/--max_in_flight, so a run doesn't take
+# as long as against the real site; everything else (retries, aimd, Retry-After, the scraper pool) runs as is.
+# results are written to benchmarks/results/crawl_<scraper version>.json
+# usage: python -m benchmarks.bench_crawl [--transcripts 100] [--latency 0.05] [--error_rate 0.02]
+#                                         [--throttle_rate 0.02] [--max_requests_per_second 20] [--concurrent]
+
+
+def point_crawler_at(root: str, cache_dir: str) -> None:
+    # the urls in config.py are built at import, so every one derived from ROOT is replaced
+    FoolCalls.ROOT = root
+    FoolCalls.EARNINGS_LINKS_ROOT = f'{root}/earnings-call-transcripts'
+    FoolCalls.EARNINGS_TRANSCRIPTS_ROOT = f'{root}/earnings/call-transcripts'
+    # a fresh validator cache, so listing pages aren't answered from an earlier run
+    sessions.validator_cache = sessions.ValidatorCache(cache_dir)
+
+
+def crawl(server, outputpath, concurrent, keep_full_page) -> dict:
+    start = time.perf_counter()
+    summary = sync_downloaders.main(outputpath, overwrite=True, scraper_callback=True, concurrent=concurrent,
+                                    keep_full_page=keep_full_page)
+    seconds = time.perf_counter() - start
+
+    stats = server.stats()
+    scraped = summary['scraped']['succeeded']
+    return {'seconds': round(seconds, 2),
+            'downloaded': summary['downloaded'],
+            'scraped': scraped,
+            'failed': summary['failed'],
+            'transcripts_per_min': round(scraped / seconds * 60, 1),
+            'requests': stats['requests'],
+            'requests_per_transcript': round(stats['requests'] / max(1, scraped), 2),
+            'wasted_requests': stats['wasted'],
+            'raw_store_bytes': sum(os.path.getsize(path) for path in
+                                   glob.glob(f'{outputpath}/state=downloaded/**/cid=*', recursive=True)),
+            'by_kind': stats['by_kind']}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='download + scrape sync against a local fool.com stand-in')
+    parser.add_argument('--corpus', default='output/state=downloaded/**/*.gz', help='glob of gzipped fixture pages')
+    parser.add_argument('--transcripts', type=int, default=100, help='number of transcripts the server lists')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every response')
+    parser.add_argument('--latency_jitter', type=float, default=0.05, help='plus up to this many seconds')
+    parser.add_argument('--error_rate', type=float, default=0.02, help='share of requests answered with a 503')
+    parser.add_argument('--throttle_rate', type=float, default=0.02, help='share of requests answered with a 429')
+    parser.add_argument('--max_requests_per_second', type=float, help='server-side limit; requests past it get a 429')
+    parser.add_argument('--retry_after', type=float, default=0.5, help='Retry-After seconds sent with 429s/503s')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the fault injection draws')
+    parser.add_argument('--rate', type=float, default=10, help='crawler\'s initial requests/sec')
+    parser.add_argument('--max_rate', type=float, default=50, help='crawler\'s max requests/sec')
+    parser.add_argument('--max_in_flight', type=int, default=FoolCalls.MAX_CONCURRENT_REQUESTS,
+                        help='crawler\'s concurrent downloads (--concurrent); also past '
+                             'FoolCalls.MAX_CONCURRENT_REQUESTS')
+    parser.add_argument('--concurrent', action='store_true', help='download with sync_downloaders --concurrent')
+    parser.add_argument('--keep_full_page', action='store_true', help='download with --keep_full_page')
+    parser.add_argument('--output', default=f'benchmarks/results/crawl_{FoolCalls.SCRAPER_VERSION}.json',
+                        help='where to write the results')
+    args = parser.parse_args()
+
+    server = replay_server.ReplayServer(('127.0.0.1', 0), replay_server.Corpus(args.corpus, args.transcripts),
+                                        replay_server.Faults(args.latency, args.latency_jitter, args.error_rate,
+                                                             args.throttle_rate, args.max_requests_per_second,
+                                                             args.retry_after, args.seed))
+    server.start()
+
+    tmp_dir = tempfile.mkdtemp(prefix='bench_crawl_')
+    try:
+        point_crawler_at(server.root, f'{tmp_dir}/validators')
+        throttle.limiter = throttle.HostRateLimiter(rate=args.rate, max_rate=args.max_rate,
+                                                    max_in_flight=args.max_in_flight)
+        # keep-alive connections for every download in flight (the session is built on first use, below)
+        FoolCalls.HTTP_POOL_MAXSIZE = max(FoolCalls.HTTP_POOL_MAXSIZE, args.max_in_flight)
+        FoolCalls.RETRY_BACKOFF_BASE_SECONDS = args.retry_after  # 5xx without a Retry-After back off from here
+        Local.MANIFEST_JOURNAL_DIR = f'{tmp_dir}/journal'
+        # the server's transcripts repeat the fixture pages, which the scrape cache would answer without parsing
+        Local.SCRAPE_CACHE_ON = False
+
+        run = runlog.setup(f'{tmp_dir}/logs/bench_crawl.log')
+        results = {}
+        try:
+            results = crawl(server, f'{tmp_dir}/store', args.concurrent, args.keep_full_page)
+        finally:
+            report = run.close(results)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    results.update({'scraper_version': FoolCalls.SCRAPER_VERSION,
+                    'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'concurrent': args.concurrent,
+                    'keep_full_page': args.keep_full_page,
+                    'server': {name: value for name, value in vars(args).items() if name not in ('output', 'corpus')},
+                    'spans': report['spans']})
+
+    print(f'{results["scraped"]} of {args.transcripts} transcripts downloaded + scraped in {results["seconds"]}s '
+          f'({results["transcripts_per_min"]} transcripts/min)')
+    print(f'{results["requests"]} requests ({results["requests_per_transcript"]} per transcript), '
+          f'{results["wasted_requests"]} wasted; raw store {results["raw_store_bytes"] / 2 ** 20:.2f} MB')
+    for kind, statuses in results['by_kind'].items():
+        print(f'  {kind:<12} {", ".join(f"{status}: {count}" for status, count in statuses.items())}')
+    for name, stats in report['spans'].items():
+        print(f'  span {name:<34} n={stats["count"]:<5} p50 {stats["p50_ms"]:>9.2f}ms  p95 {stats["p95_ms"]:>9.2f}ms')
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {args.output}')
@@ -0,0 +1,69 @@
+import argparse
+import glob
+import gzip
+import timeit
+from lxml import html
+from foolcalls import extractors, patterns
+
+# ---------------------------------------------------------------------------
+# STATEMENT SPLITTER / HEADER EXTRACTION BENCHMARK
+# ---------------------------------------------------------------------------
+# per-function timings on the sample corpus (output/state=downloaded), comparing the original
+# serialize/re-parse implementations with the tree-based ones in extractors.py
+# usage: python -m benchmarks.bench_extractors [--corpus <glob>] [--number 20]
+
+
+def get_statement_breakpoints_serialized(transcript_elements):
+    statement_header_locs = [i for i, header in enumerate(transcript_elements)
+                             if '<strong>' in html.tostring(header, encoding='unicode')]
+    return statement_header_locs + [len(transcript_elements) - 1]
+
+
+def concat_header_serialized(header_elements):
+    return html.fromstring(b''.join([html.tostring(el) for el in header_elements]))
+
+
+def get_header_metadata_serialized(header_elements):
+    # the original get_header_metadata ran its xpaths over one re-parsed tree
+    header_element = concat_header_serialized(header_elements)
+    return extractors.get_header_metadata([header_element])
+
+
+def load_corpus(pattern):
+    containers = []
+    for path in sorted(glob.glob(pattern)):
+        with gzip.open(path, 'rb') as f:
+            containers.append(extractors.find_containers(f.read()))
+    return containers
+
+
+def compare(name, before, after, containers, number):
+    for c in containers:
+        assert before(c) == after(c), f'{name}: outputs differ'
+    t_before = timeit.timeit(lambda: [before(c) for c in containers], number=number) / number
+    t_after = timeit.timeit(lambda: [after(c) for c in containers], number=number) / number
+    print(f'{name:<28} {t_before * 1000:>10.2f} {t_after * 1000:>10.2f} {t_before / t_after:>8.1f}x')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='compare serialize/re-parse extractors with tree-based ones')
+    parser.add_argument('--corpus', default='output/state=downloaded/**/*.gz', help='glob of gzipped raw transcripts')
+    parser.add_argument('--number', type=int, default=20, help='timing repetitions')
+    args = parser.parse_args()
+
+    containers = load_corpus(args.corpus)
+    print(f'{len(containers)} transcripts; milliseconds per pass over the corpus')
+    print(f'{"function":<28} {"serialized":>10} {"tree":>10} {"speedup":>9}')
+
+    compare('get_statement_breakpoints',
+            lambda c: [get_statement_breakpoints_serialized(c[s]) for s in ('pres', 'qa')],
+            lambda c: [extractors.get_statement_breakpoints(c[s]) for s in ('pres', 'qa')],
+            containers, args.number)
+    compare('transcript header',
+            lambda c: len(concat_header_serialized(c['transcript_header']).xpath('.//text()')),
+            lambda c: len([t for el in c['transcript_header'] for t in patterns.XPATH_TEXT(el)]),
+            containers, args.number)
+    compare('get_header_metadata',
+            lambda c: get_header_metadata_serialized(c['transcript_header']),
+            lambda c: extractors.get_header_metadata(c['transcript_header']),
+            containers, args.number)
@@ -0,0 +1,89 @@
+import argparse
+import glob
+import gzip
+import re
+import timeit
+from foolcalls import extractors, patterns
+
+# ---------------------------------------------------------------------------
+# PER-STATEMENT EXTRACTION MICRO-BENCHMARK
+# ---------------------------------------------------------------------------
+# cost of extracting one statement (speaker metadata, statement type, text) with xpath/regex strings passed on
+# every call vs the compiled registry in patterns.py, over every statement in the sample corpus
+# usage: python -m benchmarks.bench_patterns [--corpus <glob>] [--number 20]
+
+
+def get_statement_metadata_strings(statement_header_element):
+    speaker = ''.join(statement_header_element.xpath('.//strong/text()'))
+
+    speaker_desc = statement_header_element.xpath('.//em/text()')
+    speaker_desc = speaker_desc[0] if len(speaker_desc) > 0 else None
+
+    affiliation, role = '', ''
+    if speaker_desc is not None:
+        speaker_desc = speaker_desc.split(' -- ')
+        if len(speaker_desc) == 1:
+            role = speaker_desc[0]
+            affiliation = ''
+        elif len(speaker_desc) == 2:
+            affiliation = speaker_desc[0]
+            role = speaker_desc[1]
+
+    return {'speaker': re.sub('(\\-\\-$)|(^\\-\\-)', '', speaker.strip()).strip(),
+            'role': re.sub('(\\-\\-$)|(^\\-\\-)', '', role.strip()).strip(),
+            'affiliation': re.sub('(\\-\\-$)|(^\\-\\-)', '', affiliation.strip()).strip()}
+
+
+def assign_statement_type_strings(statement_metadata, section_name):
+    if re.search('(^anal[a-z]{2,4})|([a-z]{2,4}lyst$)', statement_metadata['role'].lower()) and section_name == 'qa':
+        return {'statement_type': 'Q'}
+    return extractors.assign_statement_type(statement_metadata, section_name)
+
+
+def extract_strings(header, paragraphs, section_name):
+    metadata = get_statement_metadata_strings(header)
+    metadata.update(assign_statement_type_strings(metadata, section_name))
+    metadata['text'] = ''.join([''.join(para.xpath('.//text()')).replace('\xa0', ' ') for para in paragraphs])
+    return metadata
+
+
+def extract_compiled(header, paragraphs, section_name):
+    metadata = extractors.get_statement_metadata(header)
+    metadata.update(extractors.assign_statement_type(metadata, section_name))
+    metadata['text'] = ''.join([''.join(patterns.XPATH_TEXT(para)).replace('\xa0', ' ')
+                                for para in paragraphs])
+    return metadata
+
+
+def load_statements(pattern):
+    # (statement header element, its paragraphs, section name) for every statement in the corpus
+    statements = []
+    for path in sorted(glob.glob(pattern)):
+        with gzip.open(path, 'rb') as f:
+            containers = extractors.find_containers(f.read())
+        for section_name in ('pres', 'qa'):
+            elements = containers[section_name]
+            breakpoints = extractors.get_statement_breakpoints(elements)
+            for i in range(len(breakpoints) - 1):
+                statements.append((elements[breakpoints[i]],
+                                   elements[(breakpoints[i] + 1):breakpoints[i + 1]],
+                                   section_name))
+    return statements
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='per-statement extraction cost: xpath/regex strings vs compiled')
+    parser.add_argument('--corpus', default='output/state=downloaded/**/*.gz', help='glob of gzipped raw transcripts')
+    parser.add_argument('--number', type=int, default=20, help='timing repetitions')
+    args = parser.parse_args()
+
+    statements = load_statements(args.corpus)
+    for statement in statements:
+        assert extract_strings(*statement) == extract_compiled(*statement)
+
+    results = {}
+    for name, extract in [('strings', extract_strings), ('compiled', extract_compiled)]:
+        seconds = timeit.timeit(lambda: [extract(*statement) for statement in statements], number=args.number)
+        results[name] = seconds / args.number / len(statements)
+        print(f'{name:<10} {results[name] * 1e6:>8.1f} us/statement')
+    print(f'{len(statements)} statements; {results["strings"] / results["compiled"]:.2f}x faster compiled')
@@ -0,0 +1,92 @@
+import argparse
+import random
+import re
+import time
+import tracemalloc
+from foolcalls import manifest
+
+# ---------------------------------------------------------------------------
+# SCRAPE QUEUE PLANNING BENCHMARK
+# ---------------------------------------------------------------------------
+# plans a scraper queue from a synthetic store listing: <n> downloaded keys (spread over rundates, with some cids
+# downloaded more than once) and a structured listing covering most of those cids.
+#   list:      the original planner (materialized key lists, regex de-duplication, list membership checks)
+#   streaming: manifest.index_keys over generators + dict membership checks (sync_scrapers.build_scraper_queue)
+# the list planner is O(n*m), so by default it's only timed on the smaller listings
+# usage: python -m benchmarks.bench_planner [--sizes 5000 10000 20000 500000] [--list_max 20000]
+
+
+def synthetic_listing(n: int, duplicate_share: float = 0.05, scraped_share: float = 0.9, seed: int = 0):
+    rng = random.Random(seed)
+    n_cids = int(n / (1 + duplicate_share))
+    cids = [f'2020-07-{rng.randint(1, 28):02d}-company-{i}-q2-2020-earnings-call-transcript' for i in range(n_cids)]
+
+    def downloaded_keys():
+        rng = random.Random(seed)
+        for i in range(n):
+            cid = cids[i % n_cids]
+            rundate = f'2020{rng.randint(7, 12):02d}{rng.randint(1, 28):02d}'
+            yield f'state=downloaded/rundate={rundate}/cid={cid}.gz'
+
+    def structured_keys():
+        for cid in cids[:int(n_cids * scraped_share)]:
+            yield f'state=structured/version=202007.1/cid={cid}.json'
+
+    return downloaded_keys, structured_keys
+
+
+def plan_list(downloaded_keys, structured_keys) -> list:
+    downloaded_paths = list(downloaded_keys())
+    scraper_queue_raw = [{'cid': re.findall('cid=(.*)\\.gz', dl_path)[0], 'key': dl_path}
+                         for dl_path in downloaded_paths]
+
+    def drop_duplicates(scraper_queue):
+        result = {}
+        for sc in scraper_queue:
+            sc.update({'rundate': re.findall('rundate=(\\d{8})', sc['key'])[0]})
+            if (sc['cid'] not in result) or sc['rundate'] >= result[sc['cid']]['rundate']:
+                result[sc['cid']] = sc
+        return [v for k, v in result.items()]
+
+    scraper_queue = drop_duplicates(scraper_queue_raw)
+    previously_scraped_cids = [re.findall('cid=(.*)\\.json', key)[0] for key in list(structured_keys())]
+    return [queue_item for queue_item in scraper_queue if queue_item['cid'] not in previously_scraped_cids]
+
+
+def plan_streaming(downloaded_keys, structured_keys) -> list:
+    downloaded = manifest.index_keys(downloaded_keys(), manifest.KEY_PATTERNS[manifest.DOWNLOADED])
+    scraped = manifest.index_keys(structured_keys(), manifest.DEFAULT_KEY_PATTERN)
+    queue = ({'cid': cid, 'key': key} for cid, key in downloaded.items() if cid not in scraped)
+    return list(queue)
+
+
+def measure(planner, downloaded_keys, structured_keys):
+    # timed and memory-traced in separate runs, since tracemalloc slows allocation-heavy code down a lot.
+    # both include generating the synthetic keys (i.e. the listing itself)
+    start = time.perf_counter()
+    queue = planner(downloaded_keys, structured_keys)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    planner(downloaded_keys, structured_keys)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(queue), seconds, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark scrape queue planning on synthetic store listings')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 10000, 20000, 500000],
+                        help='number of downloaded keys in each synthetic listing')
+    parser.add_argument('--list_max', type=int, default=20000,
+                        help='largest listing to run the (quadratic) list planner on')
+    args = parser.parse_args()
+
+    print(f'{"keys":>8} {"planner":>10} {"queued":>8} {"seconds":>9} {"peak MB":>8}')
+    for n in args.sizes:
+        listings = synthetic_listing(n)
+        for name, planner in [('list', plan_list), ('streaming', plan_streaming)]:
+            if name == 'list' and n > args.list_max:
+                continue
+            queued, seconds, peak = measure(planner, *listings)
+            print(f'{n:>8} {name:>10} {queued:>8} {seconds:>9.3f} {peak / 2 ** 20:>8.1f}')
@@ -0,0 +1,113 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import tempfile
+import time
+from foolcalls import scrapers, rawcodecs
+from foolcalls.config import FoolCalls
+
+# ---------------------------------------------------------------------------
+# RAW STORE CODEC BENCHMARK
+# ---------------------------------------------------------------------------
+# gzip (the current raw store) vs zstd, with and without a dictionary trained on stored pages (see rawcodecs.py).
+# the corpus is split: the dictionary is trained on the first --train pages, and every codec is measured on the rest
+# (pages the dictionary hasn't seen, as new downloads would be). per codec:
+#   ratio         decompressed bytes / compressed bytes, over the test pages
+#   compress      ms per page
+#   decompress    MB/s of decompressed page, read back through scrapers.get_raw_transcript_bytes (the real reader
+#                 path: local file -> chunks -> decompress_chunks), best of --reads
+# results are written to benchmarks/results/rawcodecs_<scraper version>.json
+# usage: python -m benchmarks.bench_rawcodecs [--corpus <glob>] [--train 5] [--level 19] [--reads 20]
+
+
+def load_pages(pattern) -> list:
+    pages = []
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        with gzip.open(path, 'rb') as f:
+            pages.append(f.read())
+    return pages
+
+
+def compressors(outputpath, level) -> dict:
+    # codec name -> (key extension, page -> compressed page)
+    zstd = rawcodecs.zstd
+    plain = zstd.ZstdCompressor(level=level)
+    with_dictionary = zstd.ZstdCompressor(level=level, dict_data=rawcodecs.current_dictionary(outputpath))
+    return {'gzip': ('.gz', gzip.compress),
+            f'zstd-{level}': ('.zst', plain.compress),
+            f'zstd-{level}+dict': ('.zst', with_dictionary.compress)}
+
+
+def bench_codec(outputpath, name, extension, compress, pages, reads) -> dict:
+    keys = []
+    start = time.perf_counter()
+    bodies = [compress(page) for page in pages]
+    compress_seconds = time.perf_counter() - start
+
+    for i, body in enumerate(bodies):
+        key = f'state=downloaded/rundate=bench/cid={name}-{i}{extension}'
+        os.makedirs(os.path.dirname(f'{outputpath}/{key}'), exist_ok=True)
+        with open(f'{outputpath}/{key}', 'wb') as f:
+            f.write(body)
+        keys.append(key)
+
+    best = None
+    for _ in range(reads):
+        start = time.perf_counter()
+        decompressed = [scrapers.get_raw_transcript_bytes(outputpath, key) for key in keys]
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    assert decompressed == pages, f'{name}: pages did not round-trip'
+
+    page_bytes = sum(len(page) for page in pages)
+    compressed_bytes = sum(len(body) for body in bodies)
+    return {'compressed_bytes': compressed_bytes,
+            'ratio': round(page_bytes / compressed_bytes, 2),
+            'compress_ms_per_page': round(compress_seconds / len(pages) * 1000, 2),
+            'decompress_mb_per_s': round(page_bytes / 2 ** 20 / best, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='raw store codecs: gzip vs zstd vs zstd with a trained dictionary')
+    parser.add_argument('--corpus', default='output/state=downloaded/**/*.gz', help='glob of gzipped raw transcripts')
+    parser.add_argument('--train', type=int, default=5, help='pages the dictionary is trained on (the rest are tested)')
+    parser.add_argument('--level', type=int, default=FoolCalls.RAW_ZSTD_LEVEL, help='zstd compression level')
+    parser.add_argument('--dict_size', type=int, default=FoolCalls.RAW_ZSTD_DICT_SIZE, help='dictionary size, bytes')
+    parser.add_argument('--reads', type=int, default=20, help='times the test pages are read back (best is kept)')
+    parser.add_argument('--output', default=f'benchmarks/results/rawcodecs_{FoolCalls.SCRAPER_VERSION}.json',
+                        help='where to write the results')
+    args = parser.parse_args()
+    rawcodecs.require_zstandard()
+
+    pages = load_pages(args.corpus)
+    train_pages, test_pages = pages[:args.train], pages[args.train:]
+    if not train_pages or not test_pages:
+        raise SystemExit(f'{len(pages)} pages in {args.corpus}: need more than --train {args.train}')
+
+    results = {'scraper_version': FoolCalls.SCRAPER_VERSION,
+               'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'train_pages': len(train_pages),
+               'test_pages': len(test_pages),
+               'test_bytes': sum(len(page) for page in test_pages),
+               'codecs': {}}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dictionary = rawcodecs.train(train_pages, args.dict_size)
+        rawcodecs.save_dictionary(tmp_dir, dictionary)
+        results['dict_bytes'] = len(dictionary.as_bytes())
+
+        for name, (extension, compress) in compressors(tmp_dir, args.level).items():
+            results['codecs'][name] = bench_codec(tmp_dir, name, extension, compress, test_pages, args.reads)
+
+    print(f'dictionary: {results["dict_bytes"]} bytes, trained on {len(train_pages)} pages; '
+          f'tested on {len(test_pages)} pages ({results["test_bytes"] / 2 ** 20:.2f} MB)')
+    print(f'{"codec":<16} {"ratio":>6} {"compress ms/page":>17} {"decompress MB/s":>16}')
+    for name, stats in results['codecs'].items():
+        print(f'{name:<16} {stats["ratio"]:>6.2f} {stats["compress_ms_per_page"]:>17.2f} '
+              f'{stats["decompress_mb_per_s"]:>16.1f}')
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results written to {args.output}')
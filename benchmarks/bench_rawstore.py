@@ -0,0 +1,131 @@
+import argparse
+import copy
+import glob
+import gzip
+import multiprocessing as mp
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+from lxml import html
+from foolcalls import scrapers, extractors
+
+# ---------------------------------------------------------------------------
+# RAW STORE READ/WRITE BENCHMARK
+# ---------------------------------------------------------------------------
+# per-page cost of the raw store paths, each measured in a freshly forked worker:
+#   read:  gzip file -> parsed html document
+#          buffered:  the original BytesIO -> copyfileobj -> BytesIO -> getvalue() -> html.fromstring
+#          streaming: scrapers.get_raw_transcript (chunked gunzip into lxml's feed parser)
+#   write: page bytes -> gzip payload
+#          buffered:  the original BytesIO -> GzipFile(fileobj=BytesIO) (Downloader.put_raw_transcript_in_s3)
+#          streaming: gzip.compress
+# rss is the growth of the worker's peak rss; buffers is the peak of python-level allocations (tracemalloc, i.e.
+# excluding lxml's own tree) in multiples of the decompressed page size, so ~1 per full copy of the page in memory.
+# runs on the sample corpus plus one synthetic page enlarged <repeat> times (transcript body repeated)
+# usage: python -m benchmarks.bench_rawstore [--corpus <glob>] [--repeat 50]
+
+
+def read_buffered(outputpath, key):
+    output_file_buffer = BytesIO()
+    with gzip.open(f'{outputpath.rstrip("/")}/{key}', 'rb') as f_in:
+        shutil.copyfileobj(f_in, output_file_buffer)
+    return html.fromstring(output_file_buffer.getvalue())
+
+
+def read_streaming(outputpath, key):
+    return scrapers.get_raw_transcript(outputpath, key)
+
+
+def write_buffered(html_content):
+    input_file_buffer = BytesIO(html_content)
+    compressed_file_buffer = BytesIO()
+    with gzip.GzipFile(fileobj=compressed_file_buffer, mode='wb') as gz:
+        shutil.copyfileobj(input_file_buffer, gz)
+    compressed_file_buffer.seek(0)
+    return compressed_file_buffer
+
+
+def write_streaming(html_content):
+    return gzip.compress(html_content)
+
+
+def max_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # kilobytes on linux
+
+
+def worker(conn, fn, args, traced):
+    if traced:
+        fn(*args)  # warm up first, so one-off allocations (imports, caches) don't count as buffers
+        tracemalloc.start()
+        fn(*args)
+        conn.send(tracemalloc.get_traced_memory()[1])
+    else:
+        rss_before = max_rss_bytes()
+        start = time.perf_counter()
+        fn(*args)
+        conn.send((time.perf_counter() - start, max_rss_bytes() - rss_before))
+
+
+def run_isolated(fn, args, traced=False):
+    ctx = mp.get_context('fork')
+    parent_conn, child_conn = ctx.Pipe()
+    process = ctx.Process(target=worker, args=(child_conn, fn, args, traced))
+    process.start()
+    result = parent_conn.recv()
+    process.join()
+    return result
+
+
+def measure(fn, args, page_size):
+    seconds, rss = run_isolated(fn, args)
+    peak = run_isolated(fn, args, traced=True)
+    return seconds, rss, peak / page_size
+
+
+def enlarged_page(path, repeat) -> bytes:
+    # a valid transcript page whose prepared remarks + q&a are repeated <repeat> times
+    with gzip.open(path, 'rb') as f:
+        containers = extractors.find_containers(f.read())
+    article_body = containers['article_body']
+    children = list(article_body)
+    for _ in range(repeat - 1):
+        for child in children:
+            article_body.append(copy.deepcopy(child))
+    return html.tostring(containers['html_doc'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='raw store read/write paths: buffered copies vs streaming')
+    parser.add_argument('--corpus', default='output/state=downloaded/**/*.gz', help='glob of gzipped raw transcripts')
+    parser.add_argument('--repeat', type=int, default=50, help='size multiplier of the synthetic enlarged page')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.corpus, recursive=True))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        key = f'state=downloaded/rundate=synthetic/cid=synthetic-x{args.repeat}.gz'
+        os.makedirs(os.path.dirname(f'{tmp_dir}/{key}'))
+        with gzip.open(f'{tmp_dir}/{key}', 'wb') as f:
+            f.write(enlarged_page(paths[0], args.repeat))
+
+        cases = [(os.path.basename(path), os.path.dirname(path), os.path.basename(path)) for path in paths]
+        cases.append((f'synthetic x{args.repeat}', tmp_dir, key))
+
+        print(f'{"page":<24} {"MB":>6} {"path":<6} {"buffered ms/rss MB/buffers":>29} '
+              f'{"streaming ms/rss MB/buffers":>29}')
+        for name, outputpath, key in cases:
+            with gzip.open(f'{outputpath}/{key}', 'rb') as f:
+                html_content = f.read()
+            page_size = len(html_content)
+
+            for path_name, buffered, streaming, fn_args in [
+                    ('read', read_buffered, read_streaming, (outputpath, key)),
+                    ('write', write_buffered, write_streaming, (html_content,))]:
+                row = []
+                for fn in (buffered, streaming):
+                    seconds, rss, buffers = measure(fn, fn_args, page_size)
+                    row.append(f'{seconds * 1000:>9.1f} {rss / 2 ** 20:>9.1f} {buffers:>9.2f}')
+                print(f'{name[:24]:<24} {page_size / 2 ** 20:>6.2f} {path_name:<6} {row[0]} {row[1]}')
@@ -0,0 +1,225 @@
+import argparse
+import copy
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import platform
+import re
+import time
+from contextlib import contextmanager
+import lxml
+from lxml import html
+from foolcalls import extractors, scrapers, runlog
+from foolcalls.config import FoolCalls
+from benchmarks.bench_rawstore import measure
+
+# ---------------------------------------------------------------------------
+# OFFLINE SCRAPE BENCHMARK
+# ---------------------------------------------------------------------------
+# scrape_transcript end to end and per extractor, on the sample corpus (output/state=downloaded) plus one synthetic
+# page whose q&a is repeated <repeat> times. per page:
+#   timings   p50/p95/p99 of <number> runs, end to end and per span (parse, extract.find_containers,
+#             extract.get_header_metadata, extract.get_statement_data, ...; see the @runlog.timed extractors)
+#   memory    peak of python-level allocations while scraping (tracemalloc) and peak rss growth, in a forked worker
+#   checks    the output against the committed state=structured json of the same cid (stable fields only, see
+#             below), plus a digest of the full output, so any change in what gets scraped shows up between runs
+# results are written to benchmarks/results/scrape_<scraper version>.json; --compare takes the results file of
+# another version (or an earlier run) and flags spans whose p50 got slower by more than --threshold.
+# usage: python -m benchmarks.bench_scrape [--corpus <glob>] [--number 20] [--repeat 20] [--compare <results.json>]
+
+# fields compared against the committed structured json. statement text isn't: version 202006.1 appended the next
+# statement's header paragraph to each statement, which later versions don't
+CALL_FIELDS = ['ticker', 'ticker_exchange', 'company_name', 'fool_company_id', 'call_title', 'call_subtitle',
+               'call_short_title', 'call_date', 'call_time', 'fiscal_period_year', 'fiscal_period_qtr', 'period_end',
+               'duration_minutes', 'publication_author', 'participants']
+STATEMENT_FIELDS = ['statement_num', 'section', 'statement_type', 'speaker', 'role', 'affiliation']
+RENAMED_FIELDS = {'publication_time': 'publication_time_published'}  # committed name -> current name
+
+RE_CID = re.compile('cid=(.+)\\.(gz|json)$')
+
+
+def load_expected(structured_glob) -> dict:
+    # cid -> committed structured output (the latest version, when a cid was structured more than once)
+    expected = {}
+    for path in sorted(glob.glob(structured_glob, recursive=True)):
+        with open(path) as f:
+            expected[RE_CID.search(path).group(1)] = json.load(f)
+    return expected
+
+
+def check_output(output, expected) -> list:
+    # returns the mismatching fields, e.g. ['call_date', 'call_transcript[3].speaker']
+    mismatches = []
+    for field, current_field in RENAMED_FIELDS.items():
+        if field in expected and output.get(current_field) != expected[field]:
+            mismatches.append(current_field)
+    for field in CALL_FIELDS:
+        if field in expected and output.get(field) != expected[field]:
+            mismatches.append(field)
+
+    statements, expected_statements = output.get('call_transcript', []), expected.get('call_transcript', [])
+    if len(statements) != len(expected_statements):
+        mismatches.append(f'call_transcript (count {len(statements)} != {len(expected_statements)})')
+    for i, (statement, expected_statement) in enumerate(zip(statements, expected_statements)):
+        for field in STATEMENT_FIELDS:
+            if statement.get(field) != expected_statement.get(field):
+                mismatches.append(f'call_transcript[{i}].{field}')
+    return mismatches
+
+
+def digest(output) -> str:
+    return hashlib.sha1(json.dumps(output, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+@contextmanager
+def collecting_spans(*collectors):
+    # switches the spans logger on, into the given collectors only
+    for collector in collectors:
+        runlog.span_log.addHandler(collector)
+    runlog.span_log.setLevel(logging.DEBUG)
+    runlog.span_log.propagate = False
+    try:
+        yield
+    finally:
+        for collector in collectors:
+            runlog.span_log.removeHandler(collector)
+        runlog.span_log.setLevel(logging.WARNING)
+        runlog.span_log.propagate = True
+
+
+def time_page(html_content, number, corpus_spans=None) -> dict:
+    # span percentiles of <number> scrapes of one page; the spans are also added to corpus_spans, when given
+    scrapers.scrape_transcript(html_content)  # warm up (imports, date cache, xpath compilation)
+
+    collector = runlog.SpanCollector()
+    with collecting_spans(collector, *([corpus_spans] if corpus_spans is not None else [])):
+        for _ in range(number):
+            with runlog.span('scrape_transcript'):
+                scrapers.scrape_transcript(html_content)
+    return collector.percentiles()
+
+
+def bench_page(html_content, expected, number, corpus_spans=None) -> dict:
+    output = scrapers.scrape_transcript(html_content)
+    seconds, rss, buffers = measure(scrapers.scrape_transcript, (html_content,), len(html_content))
+    return {'bytes': len(html_content),
+            'statements': len(output['call_transcript']),
+            'digest': digest(output),
+            'mismatches': None if expected is None else check_output(output, expected),
+            'tracemalloc_peak_mb': round(buffers * len(html_content) / 2 ** 20, 2),
+            'rss_growth_mb': round(rss / 2 ** 20, 2),
+            'spans': time_page(html_content, number, corpus_spans)}
+
+
+def enlarged_transcript(path, repeat) -> bytes:
+    # a scrapeable transcript page whose q&a statements are repeated <repeat> times (inserted before the
+    # "Duration:" paragraph, so the section markers stay where the segmenter expects them)
+    with gzip.open(path, 'rb') as f:
+        containers = extractors.find_containers(f.read())
+    for _ in range(repeat - 1):
+        for statement in containers['qa']:
+            containers['duration'].addprevious(copy.deepcopy(statement))
+    return html.tostring(containers['html_doc'])
+
+
+def load_corpus(pattern, repeat) -> list:
+    # [(name, page bytes, cid)]
+    paths = sorted(glob.glob(pattern, recursive=True))
+    pages = []
+    for path in paths:
+        with gzip.open(path, 'rb') as f:
+            cid = RE_CID.search(path).group(1)
+            pages.append((cid, f.read(), cid))
+    if repeat > 1 and paths:
+        pages.append((f'synthetic-x{repeat}', enlarged_transcript(paths[0], repeat), None))
+    return pages
+
+
+def print_results(results) -> None:
+    print(f'{"page":<40} {"MB":>5} {"stmts":>5} {"p50 ms":>8} {"p95 ms":>8} {"peak MB":>8} {"rss MB":>7} '
+          f'{"checks":>8}')
+    for name, page in results['pages'].items():
+        e2e = page['spans']['scrape_transcript']
+        checks = '-' if page['mismatches'] is None else len(page['mismatches']) or 'ok'
+        print(f'{name[:40]:<40} {page["bytes"] / 2 ** 20:>5.2f} {page["statements"]:>5} {e2e["p50_ms"]:>8.2f} '
+              f'{e2e["p95_ms"]:>8.2f} {page["tracemalloc_peak_mb"]:>8.2f} {page["rss_growth_mb"]:>7.1f} '
+              f'{checks:>8}')
+        for mismatch in (page['mismatches'] or [])[:5]:
+            print(f'    mismatch: {mismatch}')
+
+    print(f'\n{"span (all corpus pages)":<40} {"count":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for name, stats in results['spans'].items():
+        print(f'{name:<40} {stats["count"]:>6} {stats["p50_ms"]:>8.3f} {stats["p95_ms"]:>8.3f} '
+              f'{stats["p99_ms"]:>8.3f}')
+
+
+def compare(results, baseline, threshold) -> int:
+    # prints p50 before/after per span and page, returns the number of regressions
+    print(f'\ncompared to {baseline["scraper_version"]} ({baseline["created"]}, python {baseline["python"]})')
+    rows = [(f'span {name}', baseline['spans'].get(name), stats) for name, stats in results['spans'].items()]
+    rows += [(f'page {name}', baseline['pages'].get(name, {}).get('spans', {}).get('scrape_transcript'),
+              page['spans']['scrape_transcript']) for name, page in results['pages'].items()]
+
+    regressions = 0
+    print(f'{"":<50} {"before ms":>10} {"after ms":>10} {"ratio":>7}')
+    for name, before, after in rows:
+        if before is None:
+            print(f'{name[:50]:<50} {"-":>10} {after["p50_ms"]:>10.3f}')
+            continue
+        ratio = after['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  SLOWER'
+            regressions += 1
+        print(f'{name[:50]:<50} {before["p50_ms"]:>10.3f} {after["p50_ms"]:>10.3f} {ratio:>7.2f}{flag}')
+
+    for name, page in results['pages'].items():
+        before = baseline['pages'].get(name)
+        if before and before['digest'] != page['digest']:
+            print(f'output changed: {name} ({before["digest"]} -> {page["digest"]})')
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='scrape_transcript timings, memory and output checks')
+    parser.add_argument('--corpus', default='output/state=downloaded/**/*.gz', help='glob of gzipped raw transcripts')
+    parser.add_argument('--expected', default='output/state=structured/**/*.json',
+                        help='glob of committed structured transcripts to check the output against')
+    parser.add_argument('--number', type=int, default=20, help='scrapes per page')
+    parser.add_argument('--repeat', type=int, default=20, help='size multiplier of the synthetic enlarged page')
+    parser.add_argument('--output', default=f'benchmarks/results/scrape_{FoolCalls.SCRAPER_VERSION}.json',
+                        help='where to write the results')
+    parser.add_argument('--compare', help='results file of an earlier run/scraper version')
+    parser.add_argument('--threshold', type=float, default=0.1, help='p50 slowdown flagged by --compare (0.1 = 10%%)')
+    args = parser.parse_args()
+
+    expected = load_expected(args.expected)
+    results = {'scraper_version': FoolCalls.SCRAPER_VERSION,
+               'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'lxml': lxml.__version__,
+               'machine': platform.machine(),
+               'number': args.number,
+               'pages': {}}
+
+    # corpus-wide spans cover the sample pages only, so the synthetic page doesn't skew them
+    corpus_spans = runlog.SpanCollector()
+    for name, html_content, cid in load_corpus(args.corpus, args.repeat):
+        results['pages'][name] = bench_page(html_content, expected.get(cid), args.number,
+                                            corpus_spans if cid is not None else None)
+    results['spans'] = corpus_spans.percentiles()
+
+    print_results(results)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nresults written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            raise SystemExit(f'{regressions} span(s)/page(s) slower by more than {args.threshold:.0%}')
@@ -1,11 +1,10 @@
-import requests
-import time
 import json
+from foolcalls import throttle
 from foolcalls.scrapers import scrape_transcript_urls_by_page, scrape_transcript
 
 # get one transcript for a known url
 transcript_url = 'https://www.fool.com/earnings/call-transcripts/2020/07/15/kura-sushi-usa-inc-krus-q3-2020-earnings-call-tran.aspx'
-response = requests.get(transcript_url)
+response = throttle.get(transcript_url) # pooled keep-alive session, politely rate limited
 transcript = scrape_transcript(response.text)
 print(json.dumps(transcript, indent=2))
 
@@ -19,8 +18,7 @@ output = []
 for page in range(0, num_of_pages):
     transcript_urls = scrape_transcript_urls_by_page(page)
     for transcript_url in transcript_urls:
-        response = requests.get(transcript_url)
+        response = throttle.get(transcript_url)
         transcript = scrape_transcript(response.text)
         output.append(transcript)
-        time.sleep(5) # sleep 5 seconds between reqeusts
 print(output)
\ No newline at end of file
@@ -0,0 +1,140 @@
+import argparse
+import json
+import logging
+import os
+import posixpath
+from collections import defaultdict
+from datetime import datetime
+from foolcalls.config import Aws, FoolCalls, Local
+from foolcalls import manifest, sessions, shards, runlog
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# COMPACTION: PER-CID OBJECTS -> PACKS
+# ---------------------------------------------------------------------------
+# packs the per-cid objects of each partition (state=downloaded/rundate=*/ or state=structured/version=*/) into
+# shard files of ~Local.PACK_TARGET_BYTES (see shards.py):
+#   downloaded:  the cid=*.gz/.zst objects, copied verbatim as the members of .html.gz/.html.zst packs (nothing is
+#                re-compressed); a partition holding both gets packs of each, as codecs are never mixed in one pack
+#   structured:  the cid=*.json objects, each re-written as one gzipped json line of a .ndjson.gz pack
+# only the keys in the manifest (i.e. the current key of each cid) are packed. once a pack and its index are
+# written, the manifest is pointed at the members and the per-cid objects are deleted (unless --keep_originals),
+# so a crash leaves at worst some transcripts stored twice, never none. run it while no sync is writing to the same
+# state (the manifest is rewritten)
+# usage: python -m foolcalls.compact <outputpath> {downloaded,structured} [--min_objects 100] [--keep_originals]
+STATES = ['downloaded', 'structured']
+
+
+def state_of(state_name: str) -> str:
+    return manifest.DOWNLOADED if state_name == 'downloaded' else manifest.structured()
+
+
+def plan(entries: dict, min_objects: int) -> dict:
+    # {partition: [(cid, key)]} of the per-cid keys worth packing
+    partitions = defaultdict(list)
+    for cid, key in entries.items():
+        if shards.parse_member_key(key) is None:
+            partitions[posixpath.dirname(key)].append((cid, key))
+    return {partition: sorted(items) for partition, items in sorted(partitions.items())
+            if len(items) >= min_objects}
+
+
+def read_object(outputpath: str, key: str) -> bytes:
+    if outputpath == 's3':
+        response = sessions.get_s3_client().get_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=key)
+        return response['Body'].read()
+    with open(f'{outputpath.rstrip("/")}/{key}', 'rb') as f:
+        return f.read()
+
+
+def to_member(state_name: str, body: bytes) -> bytes:
+    if state_name == 'downloaded':
+        return body  # already a gzip stream (or zstd frame, see rawcodecs.py)
+    return shards.ndjson_member(json.loads(body))
+
+
+def pack_extension(state_name: str, member: bytes) -> str:
+    if state_name == 'downloaded':
+        return shards.raw_extension(member)
+    return shards.NDJSON_EXTENSION
+
+
+def delete_objects(outputpath: str, keys: list) -> None:
+    if outputpath == 's3':
+        s3_client = sessions.get_s3_client()
+        for i in range(0, len(keys), 1000):  # delete_objects takes up to 1000 keys
+            s3_client.delete_objects(Bucket=Aws.S3_FOOLCALLS_BUCKET,
+                                     Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True})
+    else:
+        for key in keys:
+            os.remove(f'{outputpath.rstrip("/")}/{key}')
+
+
+def compact_partition(outputpath: str, state_name: str, partition: str, items: list, keep_originals: bool) -> dict:
+    state = state_of(state_name)
+    source_keys = dict(items)
+    stats = {'packed': 0, 'packs': 0, 'failed': 0}
+
+    def packed(members) -> None:
+        # the pack and its index are in the store: point the manifest at them, then drop the per-cid objects
+        manifest.update(outputpath, state, dict(members))
+        if not keep_originals:
+            delete_objects(outputpath, [source_keys[cid] for cid, _ in members])
+        stats['packed'] += len(members)
+        stats['packs'] += 1
+
+    writers = {}  # pack extension -> writer, one per codec
+    for cid, key in items:
+        try:
+            with runlog.span('compact.read'):
+                member = to_member(state_name, read_object(outputpath, key))
+        except Exception as e:
+            log.error(f'error reading {key}: {e}; left as is')
+            stats['failed'] += 1
+            continue
+        extension = pack_extension(state_name, member)
+        if extension not in writers:
+            writers[extension] = shards.PackWriter(outputpath, partition, extension, on_pack=packed)
+        writers[extension].add_member(cid, member)
+    for writer in writers.values():
+        writer.close()
+    log.info(f'compacted {partition}: {stats}')
+    return stats
+
+
+def main(outputpath: str, state_name: str, min_objects: int = None, keep_originals: bool = False) -> dict:
+    min_objects = Local.COMPACT_MIN_OBJECTS if min_objects is None else min_objects
+    state = state_of(state_name)
+    partitions = plan(manifest.load(outputpath, state), min_objects)
+    log.info(f'compacting {sum(len(items) for items in partitions.values())} {state} objects '
+             f'in {len(partitions)} partitions')
+
+    summary = {'partitions': len(partitions), 'packed': 0, 'packs': 0, 'failed': 0}
+    for partition, items in partitions.items():
+        for name, count in compact_partition(outputpath, state_name, partition, items, keep_originals).items():
+            summary[name] += count
+    manifest.flush(outputpath, state)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='pack per-cid transcript objects into large shard files')
+    parser.add_argument('outputpath', help='store to compact; if outputpath==\'s3\', the Aws.S3_FOOLCALLS_BUCKET bucket')
+    parser.add_argument('state', choices=STATES, help='raw (downloaded) or structured transcripts')
+    parser.add_argument('--min_objects', type=int, default=Local.COMPACT_MIN_OBJECTS,
+                        help='leave partitions with fewer per-cid objects than this alone')
+    parser.add_argument('--keep_originals', action='store_true',
+                        help='keep the per-cid objects after packing them (note: athena tables will then read '
+                             'structured transcripts twice)')
+    args = parser.parse_args()
+
+    this_file = os.path.basename(__file__).replace('.py', '')
+    log_id = f'{this_file}_{datetime.now().strftime("%Y%m%dT%H%M%S")}'
+    run = runlog.setup(f'./logs/{log_id}.log')
+    log.info(f'configuration parameters: {FoolCalls.__dict__}')
+    log.info(f'input parameters: {args}')
+
+    summary = main(args.outputpath, args.state, args.min_objects, args.keep_originals)
+    log.info(f'successfully completed script')
+    run.close(summary)
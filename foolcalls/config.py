@@ -6,6 +6,35 @@ load_dotenv()
 class Local:
     MULTIPROCESS_ON = True
     MULTIPROCESS_CPUS = None # None defaults to mp.cpu_count()
+    SCRAPE_CHUNKSIZE = 4 # queue items handed to a scraper pool worker at a time (sync_scrapers --chunksize)
+    PROGRESS_LOG_SECONDS = 30 # how often sync_scrapers logs progress (counts, items/sec)
+
+    # sync_scrapers --pipeline: fetch/upload threads around a parse-only process pool
+    PREFETCH_THREADS = 8 # threads fetching + decompressing raw transcripts
+    PREFETCH_DEPTH = 32 # raw transcripts fetched ahead of the parse pool
+    UPLOAD_THREADS = 8 # threads saving structured transcripts
+    PIPELINE_MAX_IN_FLIGHT = 32 # transcripts handed to the parse pool and not yet uploaded
+
+    # sync_downloaders --scraper_callback: downloaded pages waiting for the scraper pool
+    SCRAPE_QUEUE_SIZE = 64
+
+    # sync_scrapers --output_format parquet (see parquetstore.py)
+    PARQUET_TRANSCRIPTS_PER_FILE = 1000 # transcripts buffered per call year/quarter before a part file is written
+    PARQUET_COMPRESSION = 'snappy'
+
+    # shard files (see shards.py, compact.py)
+    PACK_TARGET_BYTES = 128 * 2 ** 20 # a pack is written once its members add up to this many (compressed) bytes
+    COMPACT_MIN_OBJECTS = 100 # compact.py leaves partitions with fewer per-cid objects than this alone
+
+    # scraped transcripts cached by page content hash + extractor code fingerprint (see scrapecache.py)
+    SCRAPE_CACHE_ON = True
+    SCRAPE_CACHE_DIR = './cache/scrapes'
+
+    # s3 stores: new manifest lines are journaled here, then merged into the s3 manifest at the end of a run
+    MANIFEST_JOURNAL_DIR = './cache'
+
+    # sync_downloaders crawl state (see frontier.py)
+    CRAWL_MAX_ATTEMPTS = 3 # downloads of a cid that may fail before the crawl gives up on it
 
 
 class Aws:
@@ -16,6 +45,9 @@ class Aws:
     S3_REGION_NAME = 'us-west-2'
     S3_FOOLCALLS_BUCKET = 'fool-calls'
     S3_OBJECT_ROOT = 'https://s3.console.aws.amazon.com/s3/object'
+    S3_LIST_MAX_WORKERS = 16 # threads used to list rundate=/version= partitions in parallel
+    S3_MAX_POOL_CONNECTIONS = 32 # per s3 client; enough for the listing/prefetch/upload threads sharing it
+    S3_MANIFEST_WRITE_ATTEMPTS = 10 # conditional manifest writes, redone while other runs keep rewriting it
 
     ATHENA_REGION_NAME = 'us-west-2'
     ATHENA_OUTPUT_BUCKET = 'fool-calls-athena-output'
@@ -29,9 +61,10 @@ class AlphaVantage():
 class FoolCalls:
 
     SCRAPER_VERSION = '202007.1'
+    DATE_PARSE_CACHE_SIZE = 4096 # memoized date strings per process (see dateparsing.py)
 
     # fixed ishares.com values, the rest is derived/scraped
-    ROOT = 'https://www.fool.com'
+    ROOT = os.environ.get('FOOLCALLS_ROOT', 'https://www.fool.com') # e.g. http://127.0.0.1:8000 (see replay_server.py)
     EARNINGS_LINKS_ROOT = f'{ROOT}/earnings-call-transcripts'
     EARNINGS_TRANSCRIPTS_ROOT = f'{ROOT}/earnings/call-transcripts'
 
@@ -42,11 +75,40 @@ class FoolCalls:
     # if False: process looks for unprocessed links until it arrives at a page with no unprocessed links
     # note this only relevant if overwrite=False (because if overwrite=True, you're processing everything over again)
 
-    # throttle requests to fool.com
-    MIN_SLEEP_BETWEEN_REQUESTS = 2
-    MAX_SLEEP_BETWEEN_REQUESTS = 8
     MAX_PAGES = None # should be None unless running quick tests (e.g. get the first 30-50 transcripts)
 
+    # throttle requests to fool.com (see throttle.py)
+    # politeness is enforced by a token bucket per host, whose rate adapts to how fool.com is responding:
+    # it grows additively while responses are fast and healthy, and is cut multiplicatively on 429s/5xx/slow responses
+    INITIAL_REQUESTS_PER_SECOND = 0.2 # starting request rate per host
+    MIN_REQUESTS_PER_SECOND = 0.05
+    MAX_REQUESTS_PER_SECOND = 1
+    RATE_INCREASE = 0.01 # requests/sec added after each healthy response
+    RATE_DECREASE_FACTOR = 0.5 # rate multiplier after a 429, 5xx or slow response
+    SLOW_RESPONSE_SECONDS = 10 # responses slower than this count as a latency spike
+    MAX_REQUEST_BURST = 1 # requests that can go out back-to-back after an idle period
+    MAX_CONCURRENT_REQUESTS = 4 # requests in-flight at once per host (sync_downloaders --concurrent)
+
+    # retries on 429/5xx/connection errors; Retry-After is honored when present, otherwise jittered exponential backoff
+    MAX_RETRIES = 4
+    RETRY_BACKOFF_BASE_SECONDS = 2
+    RETRY_BACKOFF_MAX_SECONDS = 120
+    REQUEST_TIMEOUT_SECONDS = 30
+
+    # pooled keep-alive http sessions (see sessions.py), one per process
+    HTTP_POOL_CONNECTIONS = 4 # number of hosts to keep a connection pool for
+    HTTP_POOL_MAXSIZE = MAX_CONCURRENT_REQUESTS # connections kept alive per host
+    # ETag/Last-Modified of listing pages, so unchanged pages cost a 304 instead of a download + parse
+    VALIDATOR_CACHE_DIR = './cache/validators'
+
+    # raw transcripts are read from the store and fed to the html parser in chunks of this many (compressed) bytes
+    RAW_READ_CHUNK_SIZE = 64 * 1024
+    # how new raw transcripts are compressed: 'gzip', or 'zstd-dict' (zstd with a trained dictionary, see rawcodecs.py)
+    RAW_CODEC = 'gzip'
+    RAW_ZSTD_LEVEL = 19
+    RAW_ZSTD_DICT_SIZE = 112640 # bytes; zstd's default dictionary size
+    RAW_ZSTD_SAMPLE_BYTES = 4096 # pages are cut into samples of this many bytes for dictionary training
+
     # user agents that get randomly cycled through when making ishares.com download requests
     USER_AGENT_LIST = [
         'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/60.0.3112.113 Safari/537.36',
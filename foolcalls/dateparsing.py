@@ -0,0 +1,74 @@
+import logging
+import re
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from dateutil import parser
+from foolcalls.config import FoolCalls
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# FAST-PATH DATE PARSER
+# ---------------------------------------------------------------------------
+# fool.com dates come in a handful of fixed shapes, e.g.
+#   'Jan 27, 2020 at 11:00PM'   publication time
+#   'July 15, 2020'             period end, call date
+#   '2020-07-15 5:00 p.m. ET'   call date + call time
+# these are tried with strptime first; dateutil (slow, but generic) only sees unknown shapes.
+# results are memoized, since the same dates repeat across every call in a quarter.
+# fallback_counts counts dateutil fallbacks by shape (digits -> 9, letters -> a), so format drift on the site
+# shows up in the logs (and in get_stats()) instead of silently slowing the scraper down
+
+FORMATS = ['%b %d, %Y at %I:%M%p',
+           '%B %d, %Y at %I:%M%p',
+           '%b %d, %Y',
+           '%B %d, %Y',
+           '%Y-%m-%d %I:%M %p',
+           '%Y-%m-%d']
+
+RE_MERIDIEM = re.compile('\\b([ap])\\.m\\.')
+RE_EASTERN_TZ = re.compile(' E[SD]?T$')
+RE_DIGITS = re.compile('\\d')
+RE_LETTERS = re.compile('[^\\W\\d_]+')
+
+fallback_counts = Counter()
+
+
+def shape(text: str) -> str:
+    return RE_LETTERS.sub('a', RE_DIGITS.sub('9', text))
+
+
+def normalize(text: str, ignoretz: bool) -> str:
+    text = RE_MERIDIEM.sub(lambda m: f'{m.group(1).upper()}M', text.strip())
+    if ignoretz:
+        text = RE_EASTERN_TZ.sub('', text)
+    return text
+
+
+@lru_cache(maxsize=FoolCalls.DATE_PARSE_CACHE_SIZE)
+def parse(text: str, ignoretz: bool = False) -> datetime:
+    # same results as dateutil.parser.parse(text, ignoretz=ignoretz) for the shapes above
+    normalized = normalize(text, ignoretz)
+    if normalized == '':
+        raise ValueError('String does not contain a date')
+
+    for date_format in FORMATS:
+        try:
+            return datetime.strptime(normalized, date_format)
+        except ValueError:
+            continue
+
+    text_shape = shape(text)
+    if text_shape not in fallback_counts:
+        log.warning(f'unknown date shape "{text_shape}" (e.g. "{text}"); falling back to dateutil')
+    fallback_counts[text_shape] += 1
+    return parser.parse(text, ignoretz=ignoretz)
+
+
+def get_stats() -> dict:
+    cache_info = parse.cache_info()
+    return {'cache_hits': cache_info.hits,
+            'cache_misses': cache_info.misses,
+            'fallbacks': sum(fallback_counts.values()),
+            'fallback_shapes': dict(fallback_counts)}
@@ -3,27 +3,26 @@ from datetime import datetime
 import argparse
 import logging
 from foolcalls.config import Aws, FoolCalls
-import boto3
-from . import scrapers, helpers
-from io import BytesIO
-import gzip
-import shutil
+from . import scrapers, extractors, helpers, throttle, manifest, sessions, runlog, rawcodecs, scrapecache
 import random
-import requests
-from scrapingbee import ScrapingBeeClient
 
 
 log = logging.getLogger(__name__)
 
 class Downloader:
-    def __init__(self, cid: str, outputpath: str):
+    def __init__(self, cid: str, outputpath: str, keep_full_page: bool = False, previous_hash: str = None):
         # downloader
         self.cid = cid
         self.call_url = f'{FoolCalls.EARNINGS_TRANSCRIPTS_ROOT}/{helpers.to_url(cid)}'
 
-        self.key = f'state=downloaded/rundate={datetime.now().strftime("%Y%m%d")}/cid={self.cid}.gz'
+        self.key = f'state=downloaded/rundate={datetime.now().strftime("%Y%m%d")}/cid={self.cid}{rawcodecs.extension()}'
         self.outputpath = outputpath
+        self.keep_full_page = keep_full_page
         self.html_content = bytes()
+        self.raw_content = 'full'
+        self.previous_hash = previous_hash  # content hash of the cid's last stored page, if any (see scrapecache.py)
+        self.html_hash = None
+        self.stored = False
         self.fool_download_ts = str()
 
     def request_transcript_url(self):
@@ -31,51 +30,78 @@ class Downloader:
                        headers={'User-Agent': random.choice(FoolCalls.USER_AGENT_LIST)})
 
         log.info(f'request: {request}')
-        response = requests.get(**request)
-        assert response.status_code == 200
+        with runlog.span('request'):
+            response = throttle.get(**request)
         self.html_content = response.content
         self.fool_download_ts = str(datetime.now())
 
         return self
 
+    def trim_raw_transcript(self):
+        # cuts the page down to the regions the scrapers read (see extractors.trim_page), unless keep_full_page.
+        # a page that can't be trimmed (e.g. an unknown layout) is kept in full, so nothing is lost
+        if self.keep_full_page:
+            return self
+        try:
+            with runlog.span('trim'):
+                html_doc = extractors.to_document(self.html_content)
+                if extractors.is_trimmed(html_doc):
+                    # e.g. a stored page replayed by replay_server.py; trimming it again would only re-serialize it
+                    log.info(f'{self.cid} is already trimmed')
+                    self.raw_content = 'article'
+                    return self
+                trimmed = extractors.trim_page(html_doc)
+        except Exception as e:
+            log.warning(f'could not trim {self.cid} ({e}); storing the full page')
+            return self
+        log.info(f'trimmed {self.cid}: {len(self.html_content)} -> {len(trimmed)} bytes')
+        self.html_content = trimmed
+        self.raw_content = 'article'
+        return self
+
     def save_raw_transcript(self):
-        if self.outputpath.lower() == 's3':
-            self.put_raw_transcript_in_s3()
-        else:
-            self.save_raw_transcript_locally()
+        # a page identical to the one already stored for the cid isn't stored again
+        self.html_hash = scrapecache.content_hash(self.html_content)
+        if self.html_hash == self.previous_hash:
+            log.info(f'{self.cid} is unchanged since its last download (content hash {self.html_hash}); not stored')
+            return self
+
+        with runlog.span('upload_raw'):
+            if self.outputpath.lower() == 's3':
+                self.put_raw_transcript_in_s3()
+            else:
+                self.save_raw_transcript_locally()
+        manifest.record(self.outputpath, manifest.DOWNLOADED, self.cid, self.key)
+        scrapecache.record_hash(self.outputpath, self.cid, self.html_hash, self.key)
+        self.stored = True
         return self
 
     def save_raw_transcript_locally(self):
-        input_file_buffer = BytesIO(self.html_content)
         output_path = f'{self.outputpath.rstrip("/")}/{self.key}'
-        if not os.path.exists(os.path.dirname(output_path)):
-            os.makedirs(os.path.dirname(output_path))
-        with gzip.GzipFile(output_path, mode='wb') as gz_out:
-            shutil.copyfileobj(input_file_buffer, gz_out)
-        print(f'wrote: {self.key} locally to {self.outputpath}')
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)  # several threads/processes may get here at once
+        body, _ = rawcodecs.encode(self.outputpath, self.html_content)
+        with open(output_path, mode='wb') as f_out:
+            f_out.write(body)
+        log.info(f'wrote: {self.key} locally to {self.outputpath}')
 
     def put_raw_transcript_in_s3(self):
-        input_file_buffer = BytesIO(self.html_content)
-        compressed_file_buffer = BytesIO()
-
         metadata = {'cid': self.cid,
                     'call_url': self.call_url,
-                    'fool_download_ts': self.fool_download_ts}
-
-        with gzip.GzipFile(fileobj=compressed_file_buffer, mode='wb') as gz:
-            shutil.copyfileobj(input_file_buffer, gz)
-        compressed_file_buffer.seek(0)
-
-        aws_session = boto3.Session(aws_access_key_id=Aws.AWS_KEY,
-                                    aws_secret_access_key=Aws.AWS_SECRET)
-        s3_client = aws_session.client('s3')
-
-        s3_client.upload_fileobj(Bucket=Aws.S3_FOOLCALLS_BUCKET,
-                                 Key=self.key,
-                                 Fileobj=compressed_file_buffer,
-                                 ExtraArgs={'Metadata': metadata,
-                                            'ContentType': 'text/html',
-                                            'ContentEncoding': 'gzip'})
+                    'fool_download_ts': self.fool_download_ts,
+                    'raw_content': self.raw_content}
+
+        s3_client = sessions.get_s3_client()
+
+        # compressed in one shot, straight from the response body (no intermediate buffers)
+        body, codec_metadata = rawcodecs.encode(self.outputpath, self.html_content)
+        metadata.update(codec_metadata)
+        content_encoding = {'ContentEncoding': 'gzip'} if FoolCalls.RAW_CODEC == rawcodecs.GZIP else {}
+        s3_client.put_object(Bucket=Aws.S3_FOOLCALLS_BUCKET,
+                             Key=self.key,
+                             Body=body,
+                             Metadata=metadata,
+                             ContentType='text/html',
+                             **content_encoding)
 
         s3_output_url = f'{Aws.S3_OBJECT_ROOT}/{Aws.S3_FOOLCALLS_BUCKET}/{self.key}'
         log.info(f's3 upload success: {s3_output_url}')
@@ -84,14 +110,18 @@ class Downloader:
 # ---------------------------------------------------------------------------
 # MAIN
 # ---------------------------------------------------------------------------
-def main(cid, outputpath, scraper_callback):
-    dl = Downloader(cid=cid, outputpath=outputpath)
+def main(cid, outputpath, scraper_callback, keep_full_page=False, previous_hash=None):
+    dl = Downloader(cid=cid, outputpath=outputpath, keep_full_page=keep_full_page, previous_hash=previous_hash)
 
     dl.request_transcript_url(). \
+        trim_raw_transcript(). \
         save_raw_transcript()
 
     if scraper_callback:
-        scrapers.process_transcript(cid=dl.cid, html_content=dl.html_content, outputpath=outputpath)
+        scrapers.process_transcript(cid=dl.cid, html_content=dl.html_content, outputpath=outputpath,
+                                    html_hash=dl.html_hash)
+
+    return dl
 
 
 if __name__ == "__main__":
@@ -103,6 +133,9 @@ if __name__ == "__main__":
     parser.add_argument('--scraper_callback',
                         help='whether to invoke the transcript scraper immediately after a file is downloaded; '
                              'otherwise scraping can be run as a separate batch process', action='store_true')
+    parser.add_argument('--keep_full_page',
+                        help='store the whole page as downloaded (e.g. for audit); otherwise only the regions the '
+                             'scrapers read are stored (see extractors.trim_page)', action='store_true')
     args = parser.parse_args()
 
     # logging (will inherit log calls from utils.pricing and utils.s3_helpers)
@@ -115,5 +148,8 @@ if __name__ == "__main__":
     log.info(f'input parameters: {args}')
 
     # run main
-    main(args.cid, args.outputpath, args.scraper_callback)
+    main(args.cid, args.outputpath, args.scraper_callback, args.keep_full_page)
+    manifest.flush(args.outputpath, manifest.DOWNLOADED)
+    manifest.flush(args.outputpath, manifest.HASHES)
+    manifest.flush(args.outputpath, manifest.structured())
     log.info(f'successfully completed script')
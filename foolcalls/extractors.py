@@ -1,9 +1,9 @@
-import re
-from dateutil import parser
+import bisect
+import copy
 from lxml import html
 import logging
 from foolcalls.decorators import handle_many_elements, handle_one_element
-import multiprocessing as mp
+from foolcalls import patterns, dateparsing, runlog
 
 log = logging.getLogger(__name__)
 
@@ -11,8 +11,7 @@ log = logging.getLogger(__name__)
 # extract the links
 @handle_many_elements(error_on_empty=False)
 def get_call_urls(html_selector):
-    call_urls = html_selector.xpath('.//div[@class = "content-block listed-articles recent-articles m-np"]'
-                                    '//div[@class="list-content"]/a/@href')
+    call_urls = patterns.XPATH_CALL_URLS(html_selector)
     return call_urls
 
 
@@ -20,112 +19,205 @@ def get_call_urls(html_selector):
 # SELECTORS: FIND CONTAINERS FOR THE VARIOUS ITEMS WE WILL EXTRACT
 # ---------------------------------------------------------------------------
 @handle_one_element(error_on_empty=True)
-def find(parent_element, xpath_str):
-    return parent_element.xpath(xpath_str)
+def find(parent_element, xpath):
+    return xpath(parent_element)
 
 
 @handle_many_elements(error_on_empty=True)
-def findall(parent_element, xpath_str, concat_results=False):
-    elements = parent_element.xpath(xpath_str)
-    if concat_results:
-        return html.fromstring(b''.join([html.tostring(el) for el in elements]))
-    return elements
+def findall(parent_element, xpath):
+    return xpath(parent_element)
 
 
-def find_containers(html_text):
-    html_doc = html.fromstring(html_text)
+def to_document(html_text):
+    # html_text is the raw page, or a document that was already parsed (e.g. while streaming it from the raw store)
+    if isinstance(html_text, html.HtmlElement):
+        return html_text
+    with runlog.span('parse'):
+        return html.fromstring(html_text)
 
-    publication_info = find(parent_element=html_doc,
-                            xpath_str='.//div[@class="author-and-date"]')
 
-    article_header = find(parent_element=html_doc,
-                          xpath_str='.//section[@class="usmf-new article-header"]/header')
+@runlog.timed('extract.find_containers')
+def find_containers(html_text):
+    html_doc = to_document(html_text)
 
-    article_body = find(parent_element=html_doc,
-                        xpath_str='.//section[@class="usmf-new article-body"]/span[@class="article-content"]')
+    publication_info = find(parent_element=html_doc, xpath=patterns.XPATH_PUBLICATION_INFO)
 
-    transcript_header = findall(parent_element=article_body,
-                                xpath_str='./h2[text()="Contents:"]/preceding-sibling::p',
-                                concat_results=True)
+    article_header = find(parent_element=html_doc, xpath=patterns.XPATH_ARTICLE_HEADER)
 
-    try:
-        pres_elements = findall(parent_element=article_body,
-                                xpath_str='./h2[text()[contains(.,"Prepared")]]'
-                                          '/following-sibling::h2[text()[contains(.,"Questions")]]'
-                                          '/preceding-sibling::p'
-                                          '[preceding-sibling::h2[text()[contains(.,"Prepared")]]]')
-    except:
-        pres_elements = findall(parent_element=article_body,
-                                xpath_str='./h2[text()[contains(.,"Prepared")]]'
-                                          '/following-sibling::p[strong/text()[contains(.,"Questions")]]'
-                                          '/preceding-sibling::p'
-                                          '[preceding-sibling::h2[text()[contains(.,"Prepared")]]]')
+    article_body = find(parent_element=html_doc, xpath=patterns.XPATH_ARTICLE_BODY)
 
-    try:
-        qa_elements_raw = findall(parent_element=article_body,
-                                  xpath_str='./h2[text()[contains(.,"Questions")]]'
-                                            '/following-sibling::h2[text()[contains(.,"Call")]]'
-                                            '/preceding-sibling::p'
-                                            '[preceding-sibling::h2[text()[contains(.,"Questions")]]]')
-    except:
-        qa_elements_raw = findall(parent_element=article_body,
-                                  xpath_str='./p[strong/text()[contains(.,"Questions")]]'
-                                            '/following-sibling::p[strong/text()[contains(.,"Call")]]'
-                                            '/preceding-sibling::p'
-                                            '[preceding-sibling::p[strong/text()[contains(.,"Questions")]]]')
-    qa_elements = qa_elements_raw[:-1]
-    duration_element = qa_elements_raw[-1]
+    sections = segment_article_body(article_body)
 
     elements = {'html_doc': html_doc,
                 'publication_info': publication_info,
                 'article_header': article_header,
                 'article_body': article_body,
-                'transcript_header': transcript_header,
-                'pres': pres_elements,
-                'qa': qa_elements,
-                'duration': duration_element}
+                'transcript_header': sections['header'],  # list of <p> elements
+                'pres': sections['pres'],
+                'qa': sections['qa'],
+                'duration': sections['duration']}
 
-    log.info(f'pid[{mp.current_process().pid}] successfully identified all {len(elements.keys())} selectors/containers')
-    print(f'pid[{mp.current_process().pid}] successfully identified all {len(elements.keys())} selectors/containers')
+    log.debug('successfully identified all selectors/containers')
     return elements
 
 
+# ---------------------------------------------------------------------------
+# ARTICLE-ONLY PAGES (RAW STORE)
+# ---------------------------------------------------------------------------
+# find_containers only reads three regions of a page: the author-and-date div, the article-header <header> and the
+# article-content <span>. trim_page rebuilds a page out of just those (each inside a copy of its parent section,
+# same tag and classes, so the same xpaths find them), dropping navigation, ads, scripts and styles around them.
+# downloaders store trimmed pages unless --keep_full_page; a trimmed page is marked by a meta tag (TRIMMED_META)
+TRIMMED_META = 'foolcalls-raw-content'
+
+
+def trim_page(html_text) -> bytes:
+    html_doc = to_document(html_text)
+    regions = [find(parent_element=html_doc, xpath=patterns.XPATH_PUBLICATION_INFO),
+               find(parent_element=html_doc, xpath=patterns.XPATH_ARTICLE_HEADER),
+               find(parent_element=html_doc, xpath=patterns.XPATH_ARTICLE_BODY)]
+
+    page = html.Element('html')
+    head = html.Element('head')
+    head.append(html.Element('meta', charset='utf-8'))
+    head.append(html.Element('meta', name=TRIMMED_META, content='article'))
+    title = html_doc.find('.//title')
+    if title is not None:
+        head.append(without_tail(title))
+    page.append(head)
+
+    body = html.Element('body')
+    body.append(without_tail(regions[0]))
+    for region in regions[1:]:
+        section = region.getparent()
+        body.append(html.Element(section.tag, dict(section.attrib)))
+        body[-1].append(without_tail(region))
+    page.append(body)
+    return html.tostring(page, encoding='utf-8', doctype='<!DOCTYPE html>')
+
+
+def without_tail(element):
+    # a copy of element; its tail is text of its parent, which isn't copied along with it
+    element = copy.deepcopy(element)
+    element.tail = None
+    return element
+
+
+def is_trimmed(html_doc) -> bool:
+    return bool(html_doc.xpath(f'/html/head/meta[@name="{TRIMMED_META}"]'))
+
+
+# ---------------------------------------------------------------------------
+# SECTION SEGMENTER
+# ---------------------------------------------------------------------------
+# splits the <p> children of article_body into header / pres / qa / duration in a single pass.
+# section boundaries are marked by <h2> headings (e.g. "Prepared Remarks:", "Questions and Answers:",
+# "Call participants:"); some transcripts mark "Questions"/"Call" with a <p><strong> instead of an <h2>.
+#   header:   <p>s before the (last) "Contents:" h2
+#   pres:     <p>s after the first "Prepared" h2, before the last "Questions" marker that follows it
+#   qa:       <p>s after the first "Questions" marker, before the last "Call" marker that follows it;
+#             the last of these is the "Duration: N minutes" paragraph
+# h2 markers take precedence over <p><strong> markers. these are the same selections the previous
+# (quadratic) following-sibling/preceding-sibling xpaths made
+def direct_text(element) -> list:
+    # text nodes that are direct children of element (i.e. what xpath's text() selects)
+    texts = [element.text] + [child.tail for child in element]
+    return [text for text in texts if text is not None]
+
+
+def segment_article_body(article_body) -> dict:
+    positions, paragraphs = [], []
+    h2_markers = {'Contents:': [], 'Prepared': [], 'Questions': [], 'Call': []}
+    p_markers = {'Questions': [], 'Call': []}
+
+    for position, child in enumerate(article_body):
+        if child.tag == 'p':
+            positions.append(position)
+            paragraphs.append(child)
+            strong_texts = [text for strong in child if strong.tag == 'strong' for text in direct_text(strong)]
+            for marker, marker_positions in p_markers.items():
+                if any(marker in text for text in strong_texts):
+                    marker_positions.append(position)
+
+        elif child.tag == 'h2':
+            h2_texts = direct_text(child)
+            if 'Contents:' in h2_texts:
+                h2_markers['Contents:'].append(position)
+            for marker in ['Prepared', 'Questions', 'Call']:
+                if any(marker in text for text in h2_texts):
+                    h2_markers[marker].append(position)
+
+    def between(start, end):
+        # paragraphs strictly between two child positions
+        return paragraphs[bisect.bisect_right(positions, start):bisect.bisect_left(positions, end)]
+
+    def section(start_markers, end_markers):
+        # paragraphs after the first start marker, up to the last end marker that follows it
+        if len(start_markers) == 0:
+            return []
+        end_markers = [end for end in end_markers if end > start_markers[0]]
+        if len(end_markers) == 0:
+            return []
+        return between(start_markers[0], end_markers[-1])
+
+    header = between(-1, h2_markers['Contents:'][-1]) if h2_markers['Contents:'] else []
+    if len(header) == 0:
+        raise Exception('no transcript header paragraphs found before a "Contents:" heading')
+
+    pres = (section(h2_markers['Prepared'], h2_markers['Questions'])
+            or section(h2_markers['Prepared'], p_markers['Questions']))
+    if len(pres) == 0:
+        raise Exception('no prepared remarks paragraphs found')
+
+    qa = (section(h2_markers['Questions'], h2_markers['Call'])
+          or section(p_markers['Questions'], p_markers['Call']))
+    if len(qa) == 0:
+        raise Exception('no questions and answers paragraphs found')
+
+    return {'header': header,
+            'pres': pres,
+            'qa': qa[:-1],
+            'duration': qa[-1]}
+
+
 # ---------------------------------------------------------------------------
 # EXTRACTORS: PARSE AND STRUCTURE SPECIFIC INFORMATION WITHIN CONTAINERS
 # ---------------------------------------------------------------------------
+@runlog.timed('extract.get_publication_metadata')
 def get_publication_metadata(publisher_metadata):
     # author
-    publication_author = ' '.join(publisher_metadata.xpath('.//div[@class="author-name"]//text()'))
+    publication_author = ' '.join(patterns.XPATH_AUTHOR_TEXT(publisher_metadata))
 
     # publication time(s)
     # if there was no update, there's just a date (eg 'Jan 27, 2020 at 11:00PM')
     # if there was an update, it looks like this: 'Updated: Feb 5, 2020 at 2:30PM Published: Jan 27, 2020 at 11:00PM'
-    pub_time_raw = ' '.join(publisher_metadata.xpath('.//div[@class="publication-date"]//text()'))
-    pub_time_cln = re.sub('\s+', ' ', pub_time_raw).strip()
+    pub_time_raw = ' '.join(patterns.XPATH_PUBLICATION_DATE_TEXT(publisher_metadata))
+    pub_time_cln = patterns.RE_WHITESPACE.sub(' ', pub_time_raw).strip()
 
-    pub_time_updated = ''.join(re.findall('^Updated: (.*) Published:', pub_time_cln))
+    pub_time_updated = ''.join(patterns.RE_PUB_TIME_UPDATED.findall(pub_time_cln))
     if len(pub_time_updated) > 0:
-        pub_time_published = ''.join(re.findall('Published: (.*)$', pub_time_cln))
+        pub_time_published = ''.join(patterns.RE_PUB_TIME_PUBLISHED.findall(pub_time_cln))
 
     else:
         pub_time_published = pub_time_cln
         pub_time_updated = pub_time_published
 
-    metadata = {'publication_author': re.sub('\s+', ' ', publication_author).strip(),
-                'publication_time_published': str(parser.parse(pub_time_published)),
-                'publication_time_updated': str(parser.parse(pub_time_updated))}
+    metadata = {'publication_author': patterns.RE_WHITESPACE.sub(' ', publication_author).strip(),
+                'publication_time_published': str(dateparsing.parse(pub_time_published)),
+                'publication_time_updated': str(dateparsing.parse(pub_time_updated))}
     return metadata
 
 
+@runlog.timed('extract.get_title_metadata')
 def get_title_metadata(article_header):
     # titles
-    call_title = ''.join(article_header.xpath('./h1/text()'))
-    call_subtitle = ''.join(article_header.xpath('./h2/text()'))
+    call_title = ''.join(patterns.XPATH_TITLE_TEXT(article_header))
+    call_subtitle = ''.join(patterns.XPATH_SUBTITLE_TEXT(article_header))
 
     # period end in standard format
-    mmm_d_yyyy = ''.join(re.findall('period ending ([a-zA-z ]+\\d{1,2}, 20\\d\\d)\.$', call_subtitle))
+    mmm_d_yyyy = ''.join(patterns.RE_PERIOD_ENDING.findall(call_subtitle))
     try:
-        period_end = parser.parse(mmm_d_yyyy).strftime('%Y-%m-%d')
+        period_end = dateparsing.parse(mmm_d_yyyy).strftime('%Y-%m-%d')
     except Exception as e:
         period_end = ''
 
@@ -135,42 +227,48 @@ def get_title_metadata(article_header):
     return metadata
 
 
-def get_header_metadata(header_element):
+@runlog.timed('extract.get_header_metadata')
+def get_header_metadata(header_elements):
+    # header_elements are the <p>s before "Contents:"; each xpath is run per element and the results chained,
+    # rather than serializing the elements and re-parsing them as one tree
+    def select(xpath):
+        return [result for header_element in header_elements for result in xpath(header_element)]
+
     # name
-    company_name = ''.join(header_element.xpath('.//strong/text()'))
+    company_name = ''.join(select(patterns.XPATH_STRONG_TEXT))
 
     # company id
-    fool_company_id = ''.join(header_element.xpath('.//span[@class="ticker"]/@data-id'))
+    fool_company_id = ''.join(select(patterns.XPATH_TICKER_ID))
 
     # ticker/exchange
-    tickers = header_element.xpath('.//span[@class="ticker"]/a/text()')
+    tickers = select(patterns.XPATH_TICKER_TEXT)
     ticker = tickers[0].split(':')[1] if len(tickers) > 0 else ''
     exchange = tickers[0].split(':')[0] if len(tickers) > 0 else ''
     if len(tickers) > 1:
         log.warning(f'multiple tickers: {",".join(tickers)}')
 
     # variable length list of metadata
-    header_subtext = header_element.xpath('.//text()')
+    header_subtext = select(patterns.XPATH_TEXT)
     header_subtext = [text.replace('\xa0', ' ') for text in header_subtext
                       if len(text) > 3 and text not in tickers]
 
     # short title
     short_title = ''.join([value for value in header_subtext
-                           if re.search('(earnings call)|(conference call)|(earnings conference)', value.lower())])
+                           if patterns.RE_SHORT_TITLE.search(value.lower())])
 
     # extract qtr and year from title
     fiscal_period_qtr, fiscal_period_year = '', ''
-    q_yyyy = (''.join(re.findall('Q\\d 20\\d\\d', short_title))).split(' ')
+    q_yyyy = (''.join(patterns.RE_QTR_YEAR.findall(short_title))).split(' ')
     if len(q_yyyy) == 2:
         fiscal_period_qtr, fiscal_period_year = q_yyyy
 
     # get date and time in standard format
-    call_date = ''.join([parser.parse(value).strftime('%Y-%m-%d')
-                         for value in header_subtext if re.search('20\\d\\d.{0,3}$', value)])
+    call_date = ''.join([dateparsing.parse(value).strftime('%Y-%m-%d')
+                         for value in header_subtext if patterns.RE_ENDS_WITH_YEAR.search(value)])
     call_time_raw = ''.join([value for value in header_subtext
-                             if re.search('^\\d\\d?:\\d\\d', value)])
+                             if patterns.RE_STARTS_WITH_TIME.search(value)])
     try:
-        call_time = str(parser.parse(f'{call_date} {call_time_raw}', ignoretz=True))
+        call_time = str(dateparsing.parse(f'{call_date} {call_time_raw}', ignoretz=True))
     except Exception as e:
         log.warning(f'{e}')
         call_time = ''
@@ -185,16 +283,17 @@ def get_header_metadata(header_element):
                 'call_date': call_date,
                 'call_time': call_time}
 
-    log.info(f'pid[{mp.current_process().pid}] successfully extracted call-level metadata from transcript')
-    print(f'pid[{mp.current_process().pid}] successfully extracted call-level metadata from transcript')
+    log.debug('successfully extracted call-level metadata from transcript')
     return metadata
 
 
+@runlog.timed('extract.get_duration_metadata')
 def get_duration_metadata(duration_element):
-    duration_text = ''.join(duration_element.xpath('.//text()'))
-    return {'duration_minutes': ''.join(re.findall('Duration: (\\d{1,3}) minutes', duration_text))}
+    duration_text = ''.join(patterns.XPATH_TEXT(duration_element))
+    return {'duration_minutes': ''.join(patterns.RE_DURATION.findall(duration_text))}
 
 
+@runlog.timed('extract.get_participant_metadata')
 def get_participant_metadata(call_statements):
     mgmt_md, mgmt_ids = [], []
     analyst_md, analyst_ids = [], []
@@ -215,6 +314,7 @@ def get_participant_metadata(call_statements):
 
 
 # TRANSCRIPT STATEMENT EXTRACTORS
+@runlog.timed('extract.get_statement_data')
 def get_statement_data(pres_elements, qa_elements):
     pres_statements = get_statements_by_section(pres_elements,
                                                 statement_num_start=1,
@@ -226,10 +326,7 @@ def get_statement_data(pres_elements, qa_elements):
 
     output = pres_statements + qa_statements
 
-    log.info(
-        f'pid[{mp.current_process().pid}] successfully extracted all statements (and statement-level metadata) from the transcript')
-    print(
-        f'pid[{mp.current_process().pid}] successfully extracted all statements (and statement-level metadata) from the transcript')
+    log.debug('successfully extracted all statements (and statement-level metadata) from the transcript')
     return output
 
 
@@ -246,7 +343,7 @@ def get_statements_by_section(transcript_elements, statement_num_start, section_
 
         # speaker dialogue (list of different paragraphs)
         paragraphs = transcript_elements[(statement_breakpoints[i] + 1):statement_breakpoints[i + 1]]  # element
-        statement_text = {'text': ''.join([''.join(para.xpath('.//text()')).replace('\xa0', ' ')
+        statement_text = {'text': ''.join([''.join(patterns.XPATH_TEXT(para)).replace('\xa0', ' ')
                                            for para in paragraphs])}
 
         # combine all dicts, starting with init dict
@@ -263,16 +360,21 @@ def get_statements_by_section(transcript_elements, statement_num_start, section_
 def get_statement_breakpoints(transcript_elements):
     # find headers for each statement block
     # where "statement block" = the beginning of a speaker's dialogue
-    statement_header_locs = [i for i, header in enumerate(transcript_elements)
-                             if '<strong>' in html.tostring(header, encoding='unicode')]
+    # (i.e. a paragraph containing a <strong> element, checked on the tree rather than on its serialized html)
+    statement_header_locs = [i for i, header in enumerate(transcript_elements) if has_strong(header)]
     statement_breakpoints = statement_header_locs + [len(transcript_elements) - 1]
     return statement_breakpoints
 
 
+def has_strong(element) -> bool:
+    # attribute-less <strong> at or below element (what the '<strong>' substring test on the html matched)
+    return any(len(strong.attrib) == 0 for strong in element.iter('strong'))
+
+
 def get_statement_metadata(statement_header_element):
-    speaker = ''.join(statement_header_element.xpath('.//strong/text()'))
+    speaker = ''.join(patterns.XPATH_STRONG_TEXT(statement_header_element))
 
-    speaker_desc = statement_header_element.xpath('.//em/text()')
+    speaker_desc = patterns.XPATH_EM_TEXT(statement_header_element)
     speaker_desc = speaker_desc[0] if len(speaker_desc) > 0 else None
 
     affiliation, role = '', ''
@@ -285,15 +387,15 @@ def get_statement_metadata(statement_header_element):
             affiliation = speaker_desc[0]
             role = speaker_desc[1]
 
-    statement_metadata = {'speaker': re.sub('(\-\-$)|(^\-\-)', '', speaker.strip()).strip(),
-                          'role': re.sub('(\-\-$)|(^\-\-)', '', role.strip()).strip(),
-                          'affiliation': re.sub('(\-\-$)|(^\-\-)', '', affiliation.strip()).strip()}
+    statement_metadata = {'speaker': patterns.RE_EDGE_DASHES.sub('', speaker.strip()).strip(),
+                          'role': patterns.RE_EDGE_DASHES.sub('', role.strip()).strip(),
+                          'affiliation': patterns.RE_EDGE_DASHES.sub('', affiliation.strip()).strip()}
 
     return statement_metadata
 
 
 def assign_statement_type(statement_metadata, section_name):
-    if re.search('(^anal[a-z]{2,4})|([a-z]{2,4}lyst$)', statement_metadata['role'].lower()) and section_name == 'qa':
+    if patterns.RE_ANALYST_ROLE.search(statement_metadata['role'].lower()) and section_name == 'qa':
         statement_type = 'Q'  # question
     elif statement_metadata['speaker'] == 'Operator':
         statement_type = 'O'  # operator
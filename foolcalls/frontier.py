@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from foolcalls.config import Local
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# CRAWL STATE (RESUMABLE FRONTIER)
+# ---------------------------------------------------------------------------
+# sync_downloaders journals its crawl as it goes, one json line per event, so a crash or Ctrl-C loses nothing:
+#   start    the run's parameters (--overwrite, --backfill_*)
+#   plan     which listing pages/dates the crawl reads (see listing.plan_listing)
+#   page     a listing page was read, and the cids on it were added to the frontier
+#   listed   the listing is done
+#   done     a cid was downloaded (stored: whether it was new, see scrapecache.py)
+#   failed   a download failed (with the error); a cid is retried up to Local.CRAWL_MAX_ATTEMPTS times
+# a run started with the same parameters as an unfinished crawl resumes it: the frontier (listed, not done, not
+# given up on) is downloaded first, and the listing is picked up from the page after the last one read, so no page
+# is listed twice. the file is removed once a crawl finishes; its failures end up in the run report.
+#   local store: <outputpath>/manifest/crawl_state.jsonl
+#   s3 store:    <Local.MANIFEST_JOURNAL_DIR>/manifest/crawl_state.jsonl
+STATE_KEY = 'manifest/crawl_state.jsonl'
+
+
+def state_path(outputpath: str) -> str:
+    if outputpath == 's3':
+        return f'{Local.MANIFEST_JOURNAL_DIR.rstrip("/")}/{STATE_KEY}'
+    return f'{outputpath.rstrip("/")}/{STATE_KEY}'
+
+
+class CrawlState:
+    def __init__(self, path: str, params: dict):
+        self.path = path
+        self.params = params
+        self.plan = None
+        self.last_page = None  # last listing page read
+        self.listing_done = False
+        self.queued = {}  # cid -> None, in listing order (a dict, so membership checks are O(1))
+        self.done = set()
+        self.unchanged = set()  # done, but identical to the page already stored
+        self.attempts = {}  # cid -> failed attempts
+        self.errors = {}  # cid -> last error
+        self.resumed = False
+        self.lock = threading.Lock()  # concurrent downloads record from executor threads
+
+    @classmethod
+    def open(cls, outputpath: str, params: dict):
+        # resumes the unfinished crawl of the store if it was started with the same params; otherwise starts anew
+        path = state_path(outputpath)
+        state = cls(path, params)
+        if os.path.exists(path):
+            drop_torn_line(path)
+            with open(path) as f:
+                events = [event for event in map(parse_event, f) if event is not None]
+            if events and events[0]['event'] == 'start' and events[0]['params'] == params:
+                for event in events[1:]:
+                    state.apply(event)
+                state.resumed = True
+                log.info(f'resuming the crawl in {path}: {len(state.queued)} listed ({state.summary()}), '
+                         f'listing {"done" if state.listing_done else f"picks up after page {state.last_page}"}')
+                return state
+            log.warning(f'{path} is a crawl started with other parameters ({events[:1]}); starting a new one')
+            os.remove(path)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        state.record({'event': 'start', 'params': params, 'started': datetime.now().strftime('%Y-%m-%dT%H:%M:%S')})
+        return state
+
+    def apply(self, event: dict) -> None:
+        kind = event['event']
+        if kind == 'plan':
+            self.plan = event['plan']
+        elif kind == 'page':
+            self.last_page = event['page']
+            self.queued.update(dict.fromkeys(event['cids']))
+        elif kind == 'listed':
+            self.listing_done = True
+        elif kind == 'done':
+            self.done.add(event['cid'])
+            if not event['stored']:
+                self.unchanged.add(event['cid'])
+        elif kind == 'failed':
+            self.attempts[event['cid']] = self.attempts.get(event['cid'], 0) + 1
+            self.errors[event['cid']] = event['error']
+
+    def record(self, event: dict) -> None:
+        # one short append per event, as for the manifests
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(f'{json.dumps(event)}\n')
+            self.apply(event)
+
+    # --- listing
+    def set_plan(self, plan: dict) -> None:
+        self.record({'event': 'plan', 'plan': plan})
+
+    def listed(self, page_num: int, cids: list) -> list:
+        # adds a listing page's cids to the frontier; returns the ones that weren't on it yet
+        new_cids = [cid for cid in dict.fromkeys(cids) if cid not in self.queued]
+        self.record({'event': 'page', 'page': page_num, 'cids': new_cids})
+        return new_cids
+
+    def listing_finished(self) -> None:
+        self.record({'event': 'listed'})
+
+    # --- downloads
+    def completed(self, cid: str, stored: bool = True) -> None:
+        self.record({'event': 'done', 'cid': cid, 'stored': stored})
+
+    def failed(self, cid: str, error) -> None:
+        self.record({'event': 'failed', 'cid': cid, 'error': str(error)})
+
+    def pending(self) -> list:
+        # listed cids still to download (not done, not given up on), in listing order
+        with self.lock:
+            return [cid for cid in self.queued
+                    if cid not in self.done and self.attempts.get(cid, 0) < Local.CRAWL_MAX_ATTEMPTS]
+
+    def failures(self) -> dict:
+        # cids not downloaded (yet), with their failed attempts and last error
+        with self.lock:
+            return {cid: {'attempts': attempts, 'error': self.errors[cid]}
+                    for cid, attempts in self.attempts.items() if cid not in self.done}
+
+    def summary(self) -> dict:
+        return {'listed': len(self.queued), 'done': len(self.done), 'failures': len(self.failures())}
+
+    def finish(self) -> None:
+        # the crawl is over: the next run starts a new one
+        os.remove(self.path)
+        log.info(f'crawl finished ({self.summary()}); removed {self.path}')
+
+
+def drop_torn_line(path: str) -> None:
+    # a crash mid-write leaves a last line without its newline; it's cut off, so the next event isn't appended onto it
+    with open(path, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            end = content.rfind(b'\n') + 1
+            f.truncate(end)
+            log.warning(f'dropped a torn last line from {path}: {content[end:][:100]}')
+
+
+def parse_event(line: str):
+    # None for a blank line or a line cut short by a crash
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        return None
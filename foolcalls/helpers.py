@@ -1,9 +1,10 @@
 import boto3
-from foolcalls.config import Aws, FoolCalls
+from foolcalls.config import Aws
 import logging
 import re
-import random
-import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 log = logging.getLogger(__name__)
 
@@ -13,26 +14,101 @@ aws_session = boto3.Session(aws_access_key_id=Aws.AWS_KEY,
 
 s3_client = aws_session.client('s3', region_name=Aws.S3_REGION_NAME)
 
+EXT_PATTERN = re.compile('\\.[^.]+$')
+
 
 def list_keys(Bucket, Prefix='', Suffix='', full_path=True, remove_ext=False):
-    # get pages for bucket and prefix
+    # generator: keys are yielded page by page (1000 per list_objects_v2 call),
+    # so callers can start working before the whole prefix has been listed
     paginator = s3_client.get_paginator('list_objects_v2')
     page_iterator = paginator.paginate(Bucket=Bucket, Prefix=Prefix)
 
-    # iterate through pages and store the keys in a list
-    keys = []
     for page in page_iterator:
-        if 'Contents' in page.keys():
-            for content in page['Contents']:
-                key = content['Key']
-                if not key.endswith('/'):  # ignore directories
-                    if key.endswith(Suffix):
-                        if not full_path:
-                            key = re.sub(Prefix, '', key)
-                        if remove_ext:
-                            key = re.sub('\.[^.]+$','',key)
-                        keys.append(key)
-    return keys
+        for content in page.get('Contents', []):
+            key = content['Key']
+            if not key.endswith('/') and key.endswith(Suffix):  # ignore directories
+                if not full_path:
+                    key = key[len(Prefix):]
+                if remove_ext:
+                    key = EXT_PATTERN.sub('', key)
+                yield key
+
+
+# ---------------------------------------------------------------------------
+# PARALLEL (PREFIX-SHARDED) LISTING
+# ---------------------------------------------------------------------------
+# keys are partitioned by rundate=YYYYMMDD/ (or version=...), so the partitions directly under <Prefix> are
+# discovered with a Delimiter listing and then listed concurrently on a thread pool (boto3 clients are thread-safe).
+# keys are yielded as pages arrive from any partition; total time is roughly that of the slowest partition,
+# instead of serial page latency x number of pages. key order across partitions is not preserved
+def list_partitions(Bucket, Prefix='', Delimiter='/'):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    partitions, root_keys = [], []
+    for page in paginator.paginate(Bucket=Bucket, Prefix=Prefix, Delimiter=Delimiter):
+        partitions.extend(common_prefix['Prefix'] for common_prefix in page.get('CommonPrefixes', []))
+        root_keys.extend(content['Key'] for content in page.get('Contents', []))
+    return partitions, root_keys
+
+
+def list_keys_parallel(Bucket, Prefix='', Suffix='', full_path=True, remove_ext=False,
+                       max_workers=Aws.S3_LIST_MAX_WORKERS):
+    partitions, root_keys = list_partitions(Bucket, Prefix)
+    log.info(f'listing {len(partitions)} partitions of s3://{Bucket}/{Prefix} with {max_workers} threads')
+
+    def format_key(key):
+        if not full_path:
+            key = key[len(Prefix):]
+        if remove_ext:
+            key = EXT_PATTERN.sub('', key)
+        return key
+
+    for key in root_keys:
+        if not key.endswith('/') and key.endswith(Suffix):
+            yield format_key(key)
+
+    # workers hand over one page of keys at a time; the bounded queue keeps them from running far ahead of the
+    # consumer, and <stop> lets them exit if the consumer stops early (e.g. the generator is closed)
+    pages = queue.Queue(maxsize=max_workers * 4)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def list_partition(partition):
+        try:
+            paginator = s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=Bucket, Prefix=partition):
+                put([content['Key'] for content in page.get('Contents', [])])
+                if stop.is_set():
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for partition in partitions:
+            executor.submit(list_partition, partition)
+        try:
+            remaining = len(partitions)
+            while remaining > 0:
+                page = pages.get()
+                if page is done:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for key in page:
+                        if not key.endswith('/') and key.endswith(Suffix):  # ignore directories
+                            yield format_key(key)
+        finally:
+            stop.set()
 
 
 def to_cid(call_url):
@@ -44,9 +120,3 @@ def to_cid(call_url):
 def to_url(cid):
     cid_split = cid.split('-')
     return f'{"/".join(cid_split[0:3])}/{"-".join(cid_split[3:])}/'
-
-def sleep_between_requests():
-    sleep_seconds = random.randint(FoolCalls.MIN_SLEEP_BETWEEN_REQUESTS,
-                                   FoolCalls.MAX_SLEEP_BETWEEN_REQUESTS)
-    log.info(f'post request sleep for {sleep_seconds} seconds ...')
-    time.sleep(sleep_seconds)
\ No newline at end of file
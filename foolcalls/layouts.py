@@ -0,0 +1,124 @@
+import logging
+import time
+from collections import Counter, defaultdict
+from foolcalls import patterns
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# PAGE LAYOUT FINGERPRINTING
+# ---------------------------------------------------------------------------
+# a transcript page is parsed once, classified by cheap structural markers, and handed to the scraper registered
+# for its template (see scrapers.py), instead of trying one scraper and re-parsing with another when it raises.
+# fingerprints are '<template>/<variant>', e.g.
+#   usmf-new/h2-sections       article-content body, section headings are all <h2>s
+#   usmf-new/strong-sections   article-content body, "Questions"/"Call" are marked by a <p><strong> instead
+# the variant doesn't change which scraper runs (the section segmenter handles both); it's there so the counters
+# show the mix of page templates on the site, and what each one costs to scrape
+UNKNOWN = 'unknown'
+
+# (template, xpath of the element that identifies it), tried in order
+TEMPLATES = [('usmf-new', patterns.XPATH_ARTICLE_BODY)]
+
+scrapers = {}  # template -> scrape function(html_doc) -> dict
+
+counts = Counter()
+failures = Counter()
+cache_hits = Counter()  # transcripts served from the scrape cache (see scrapecache.py), not scraped
+seconds = defaultdict(float)
+
+
+def register(template: str):
+    def decorator(func):
+        scrapers[template] = func
+        return func
+    return decorator
+
+
+def section_variant(article_body) -> str:
+    for h2 in article_body.iterchildren('h2'):
+        if any('Questions' in text for text in h2.xpath('text()')):
+            return 'h2-sections'
+    return 'strong-sections'
+
+
+def fingerprint(html_doc) -> str:
+    for template, marker in TEMPLATES:
+        elements = marker(html_doc)
+        if len(elements) == 1:
+            return f'{template}/{section_variant(elements[0])}'
+    return UNKNOWN
+
+
+def template_of(layout: str) -> str:
+    return layout.split('/')[0]
+
+
+class ScrapeError(Exception):
+    # a page that couldn't be scraped, with its layout and the seconds spent on it, so pool workers can report the
+    # failure back to the parent's counters (see failed_result)
+    def __init__(self, message: str, layout: str, elapsed: float):
+        super().__init__(message)
+        self.layout = layout
+        self.seconds = elapsed
+
+
+def scrape(html_doc) -> tuple:
+    # returns (layout fingerprint, scraped transcript, seconds spent fingerprinting + scraping); raises ScrapeError
+    start = time.perf_counter()
+    layout = fingerprint(html_doc)
+    if template_of(layout) not in scrapers:
+        elapsed = time.perf_counter() - start
+        record(layout, elapsed, failed=True)
+        raise ScrapeError(f'no scraper registered for page layout "{layout}"', layout, elapsed)
+
+    try:
+        output = scrapers[template_of(layout)](html_doc)
+    except Exception as e:
+        elapsed = time.perf_counter() - start
+        record(layout, elapsed, failed=True)
+        raise ScrapeError(f'{layout}: {e}', layout, elapsed) from e
+    elapsed = time.perf_counter() - start
+    record(layout, elapsed)
+    return layout, output, elapsed
+
+
+# ---------------------------------------------------------------------------
+# COUNTERS
+# ---------------------------------------------------------------------------
+# per process. pool workers report {'layout', 'seconds'} back with each result ({'layout', 'seconds', 'failed': True}
+# for a page they couldn't scrape, 'cached': True for one served from the scrape cache), and the parent records them
+# with record_result, so the parent's counters cover the whole run (see sync_scrapers.main)
+def record(layout: str, elapsed: float, failed: bool = False, cached: bool = False) -> None:
+    counts[layout] += 1
+    seconds[layout] += elapsed
+    if failed:
+        failures[layout] += 1
+    if cached:
+        cache_hits[layout] += 1
+
+
+def record_result(result) -> None:
+    # None: failed before the page's layout was known (fetch errors); nothing to record
+    if result is not None:
+        record(result['layout'], result['seconds'], failed=result.get('failed', False),
+               cached=result.get('cached', False))
+
+
+def failed_result(e: Exception, layout: str = None, elapsed: float = 0.0):
+    # a pool worker's result for a transcript that failed: its layout, if known (from a ScrapeError), else None
+    if isinstance(e, ScrapeError):
+        layout, elapsed = e.layout, e.seconds
+    if layout is None:
+        return None
+    return {'layout': layout, 'seconds': elapsed, 'failed': True}
+
+
+def get_stats() -> dict:
+    # mean_ms: per page actually scraped (cache hits cost nothing)
+    return {layout: {'count': count,
+                     'failures': failures[layout],
+                     'cached': cache_hits[layout],
+                     'total_seconds': round(seconds[layout], 3),
+                     'mean_ms': round(seconds[layout] / max(1, count - cache_hits[layout]) * 1000, 2)}
+            for layout, count in counts.most_common()}
@@ -0,0 +1,176 @@
+import json
+import logging
+import os
+from datetime import datetime
+import botocore.exceptions
+from foolcalls.config import Aws, FoolCalls
+from foolcalls import scrapers, helpers
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# WATERMARK + SEARCHED LISTING CRAWL
+# ---------------------------------------------------------------------------
+# fool.com's listing (FoolCalls.EARNINGS_LINKS_ROOT?page=N) is ordered by publish date, newest first, and every
+# transcript url carries its publish date (.../call-transcripts/2020/07/10/<slug>.aspx). so the page where a given
+# date ends can be found by exponential + binary search over page numbers (O(log pages) listing requests), instead
+# of walking pages one by one:
+#   new transcripts:  the store's watermark (manifest/watermark.json) is the newest publish date up to which every
+#                     transcript has been downloaded; only pages 1..(first page older than the watermark) are read
+#   backfills:        pages from the first one reaching back to the window's end date, through the first one older
+#                     than its start date (sync_downloaders --backfill_start/--backfill_end)
+# dates are compared by day, inclusively: transcripts published on the watermark date itself are listed again (and
+# filtered against the downloaded manifest), so same-day transcripts published after a run aren't missed.
+# listing pages are requested once per run, however often the search and the walk visit them
+WATERMARK_KEY = 'manifest/watermark.json'
+
+
+def publish_date(call_url: str) -> str:
+    # YYYY-MM-DD, from the url (see helpers.to_cid)
+    return helpers.to_cid(call_url)[:10]
+
+
+class ListingPages:
+    # listing pages of this run, requested on first use: page number -> call urls (newest first), or None past the end
+    def __init__(self):
+        self.pages = {}
+
+    def urls(self, page_num: int):
+        if page_num not in self.pages:
+            urls = scrapers.scrape_transcript_urls_by_page(page_num=page_num)
+            if urls is not None:
+                # dict keeps the page order, drops repeats
+                urls = list(dict.fromkeys(url.replace('.aspx', '/') for url in urls))
+            self.pages[page_num] = urls
+        return self.pages[page_num]
+
+    def oldest_date(self, page_num: int):
+        # publish date of the last transcript on the page, or None past the end of the listing
+        urls = self.urls(page_num)
+        return publish_date(urls[-1]) if urls else None
+
+    def reaches_back_past(self, page_num: int, date: str) -> bool:
+        # True once the page reaches back past <date> (or the listing has ended), i.e. for every later page too
+        oldest = self.oldest_date(page_num)
+        return oldest is None or oldest < date
+
+    def reaches_back_to(self, page_num: int, date: str) -> bool:
+        oldest = self.oldest_date(page_num)
+        return oldest is None or oldest <= date
+
+    def first_page(self, predicate) -> int:
+        # first page number for which predicate(page_num) holds, given it holds for every page after it too:
+        # exponential search for a page where it holds, then binary search back to the first one
+        last_page = FoolCalls.MAX_PAGES or float('inf')
+        lo, hi, step = FoolCalls.START_PAGE - 1, FoolCalls.START_PAGE, 1  # predicate(lo) is taken to be False
+        while hi < last_page and not predicate(hi):
+            lo, hi, step = hi, min(hi + step, last_page), step * 2
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if predicate(mid):
+                hi = mid
+            else:
+                lo = mid
+        return hi
+
+
+# ---------------------------------------------------------------------------
+# PLAN + WALK
+# ---------------------------------------------------------------------------
+# a run's listing is planned first (which pages, which publish dates), then walked page by page. the plan is plain
+# data, so an interrupted crawl can pick the walk up from the page after the last one it read (see frontier.py)
+def plan_listing(pages: ListingPages, watermark: str = None, backfill: tuple = None, every_page: bool = False) -> dict:
+    # every_page (--overwrite, FoolCalls.TRAVERSE_ALL_PAGES_FOR_NEW_URLS): every page, to the end of the listing.
+    # without a watermark or a backfill window: pages until one has nothing new on it (the original crawl)
+    plan = {'first_page': FoolCalls.START_PAGE, 'last_page': None, 'start_date': None, 'end_date': None,
+            'stop_when_processed': not every_page}
+    if backfill is not None:
+        # the window's newest transcripts are on the first page reaching back to its end date; its oldest, on the
+        # first page reaching back past its start date
+        start_date, end_date = backfill
+        plan.update(first_page=pages.first_page(lambda page_num: pages.reaches_back_to(page_num, end_date)),
+                    last_page=pages.first_page(lambda page_num: pages.reaches_back_past(page_num, start_date)),
+                    start_date=start_date, end_date=end_date, stop_when_processed=False)
+    elif watermark is not None and not every_page:
+        plan.update(last_page=pages.first_page(lambda page_num: pages.reaches_back_past(page_num, watermark)),
+                    start_date=watermark, stop_when_processed=False)
+    log.info(f'listing plan: {plan} ({len(pages.pages)} listing pages requested to find it)')
+    return plan
+
+
+def walk(pages: ListingPages, plan: dict, previously_processed_call_urls: set = None, after_page: int = None):
+    # generator: (page number, urls on the page that are within the plan's dates and weren't processed yet)
+    previously_processed_call_urls = previously_processed_call_urls or set()
+    start_date, end_date = plan['start_date'], plan['end_date']
+    page_num = plan['first_page'] if after_page is None else after_page + 1
+    last_page = min(plan['last_page'] or float('inf'), FoolCalls.MAX_PAGES or float('inf'))
+    while page_num <= last_page:
+        urls = pages.urls(page_num)
+        if urls is None:
+            log.info(f'No links found on page {page_num}, indicating no more calls are available')
+            return
+
+        new_urls = [url for url in urls
+                    if (start_date is None or publish_date(url) >= start_date)
+                    and (end_date is None or publish_date(url) <= end_date)
+                    and url not in previously_processed_call_urls]
+        log.info(f'{len(new_urls)} unprocessed urls on page {page_num}')
+        yield page_num, new_urls
+
+        if plan['stop_when_processed'] and len(new_urls) == 0:
+            return
+        page_num += 1
+
+
+# ---------------------------------------------------------------------------
+# WATERMARK
+# ---------------------------------------------------------------------------
+def next_watermark(watermark: str, downloaded_cids, failed_cids) -> str:
+    # the newest publish date downloaded so far, held back to the oldest date that still has a failed download
+    # (so the next run lists it again)
+    dates = [cid[:10] for cid in downloaded_cids]
+    if watermark is not None:
+        dates.append(watermark)
+    if not dates:
+        return None
+    new_watermark = max(dates)
+    failed_dates = [cid[:10] for cid in failed_cids]
+    if failed_dates:
+        new_watermark = min(new_watermark, min(failed_dates))
+    return new_watermark
+
+
+def advance_watermark(outputpath: str, downloaded_cids, failed_cids) -> None:
+    watermark = load_watermark(outputpath)
+    date = next_watermark(watermark and watermark['date'], downloaded_cids, failed_cids)
+    if date is not None and (watermark is None or date != watermark['date']):
+        newest_cid = max([cid for cid in downloaded_cids if cid[:10] <= date], default=watermark and watermark['cid'])
+        save_watermark(outputpath, date, newest_cid)
+
+
+def load_watermark(outputpath: str):
+    # {'date': YYYY-MM-DD, 'cid': newest cid downloaded, 'updated': ...}, or None for a store without one
+    try:
+        if outputpath == 's3':
+            response = helpers.s3_client.get_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=WATERMARK_KEY)
+            return json.loads(response['Body'].read())
+        with open(f'{outputpath.rstrip("/")}/{WATERMARK_KEY}') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+
+def save_watermark(outputpath: str, date: str, cid: str = None) -> None:
+    body = json.dumps({'date': date, 'cid': cid, 'updated': datetime.now().strftime('%Y-%m-%dT%H:%M:%S')})
+    if outputpath == 's3':
+        helpers.s3_client.put_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=WATERMARK_KEY, Body=body.encode())
+    else:
+        path = f'{outputpath.rstrip("/")}/{WATERMARK_KEY}'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(body)
+    log.info(f'watermark of {outputpath} is now {date} ({cid})')
@@ -0,0 +1,236 @@
+import os
+import glob
+import logging
+import random
+import re
+import time
+import botocore.exceptions
+from foolcalls.config import Aws, FoolCalls, Local
+from foolcalls import helpers, shards
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# PROCESSED-CID MANIFEST
+# ---------------------------------------------------------------------------
+# an append-only index of every transcript written to a store, one "<cid>\t<key>" line per write.
+# planning a run reads one small file, instead of listing/globbing every object in the store.
+#   local store: <outputpath>/manifest/<state>.tsv, appended to directly by the writers
+#   s3 store:    s3://<bucket>/manifest/<state>.tsv; writers append to a local journal
+#                (<Local.MANIFEST_JOURNAL_DIR>/manifest/<state>.tsv), which flush() merges into the s3 object.
+#                the merge is a read + conditional put (If-Match on the etag read): if another run (a sync, a
+#                compaction) rewrote the manifest in between, the put fails and the merge is redone on top of it,
+#                so no run's lines are lost
+# if a cid appears more than once, the last line wins (i.e. the most recent download/scrape).
+# rebuild() reconciles the manifest against the real store (e.g. files added/deleted by hand).
+# transcripts compacted into packs are listed under their member keys ("<pack key>#<offset>:<length>", see shards.py)
+
+DOWNLOADED = 'state=downloaded'
+HASHES = 'hashes/state=downloaded'  # "<cid>\t<content hash>:<key>" of downloaded pages (see scrapecache.py)
+
+KEY_PATTERNS = {DOWNLOADED: re.compile('cid=(.*)\\.(?:gz|zst)$')}
+DEFAULT_KEY_PATTERN = re.compile('cid=(.*)\\.json$')
+
+
+def structured(output_format: str = 'json') -> str:
+    if output_format == 'parquet':
+        # see parquetstore.py
+        return f'state=structured-parquet/version={FoolCalls.SCRAPER_VERSION}'
+    return f'state=structured/version={FoolCalls.SCRAPER_VERSION}'
+
+
+def manifest_key(state: str) -> str:
+    return f'manifest/{state}.tsv'
+
+
+def local_path(outputpath: str, state: str) -> str:
+    if outputpath == 's3':
+        return f'{Local.MANIFEST_JOURNAL_DIR.rstrip("/")}/{manifest_key(state)}'
+    return f'{outputpath.rstrip("/")}/{manifest_key(state)}'
+
+
+def parse_lines(lines) -> dict:
+    entries = {}
+    for line in lines:
+        line = line.rstrip('\n')
+        if line:
+            cid, key = line.split('\t')
+            entries[cid] = key
+    return entries
+
+
+def format_lines(entries: dict) -> str:
+    return ''.join(f'{cid}\t{key}\n' for cid, key in entries.items())
+
+
+# ---------------------------------------------------------------------------
+# WRITE
+# ---------------------------------------------------------------------------
+def record(outputpath: str, state: str, cid: str, key: str) -> None:
+    # a single short write to a file opened for appending lands atomically, so pool workers can share the file
+    path = local_path(outputpath, state)
+    if outputpath != 's3' and not os.path.exists(path):
+        # no manifest to keep up to date; the next load() indexes the whole store, this write included
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(f'{cid}\t{key}\n')
+
+
+def flush(outputpath: str, state: str) -> None:
+    # merge the local journal into the s3 manifest (no-op for local stores, which are appended to directly)
+    if outputpath != 's3':
+        return
+
+    path = local_path(outputpath, state)
+    if not os.path.exists(path):
+        return
+
+    with open(path) as f:
+        merge_s3(state, parse_lines(f))
+    os.remove(path)
+    log.info(f'flushed manifest journal {path} to s3://{Aws.S3_FOOLCALLS_BUCKET}/{manifest_key(state)}')
+
+
+def update(outputpath: str, state: str, updates: dict) -> None:
+    # rewrites the manifest with some cids' keys replaced (e.g. by compact.py, once they've been packed)
+    if outputpath == 's3':
+        flush(outputpath, state)
+        merge_s3(state, updates)
+    else:
+        entries = read_local(outputpath, state) or {}
+        entries.update(updates)
+        write_local(outputpath, state, entries)
+
+
+def merge_s3(state: str, updates: dict) -> None:
+    # read + merge + conditional put, redone on conflict (see the top of this file)
+    for attempt in range(Aws.S3_MANIFEST_WRITE_ATTEMPTS):
+        entries, etag = read_s3_with_etag(state)
+        entries = entries or {}
+        entries.update(updates)
+        # If-Match: unchanged since read; If-None-Match: still not there (so a concurrent first write isn't lost)
+        condition = {'IfMatch': etag} if etag is not None else {'IfNoneMatch': '*'}
+        try:
+            write_s3(state, entries, **condition)
+            return
+        except botocore.exceptions.ClientError as e:
+            # NoSuchKey: If-Match on a manifest deleted since the read (e.g. by a rebuild)
+            if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey'):
+                raise
+        log.warning(f'the {state} manifest was rewritten by another run; merging again (attempt {attempt + 1})')
+        time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+    raise Exception(f'could not merge into the {state} manifest: rewritten by other runs '
+                    f'{Aws.S3_MANIFEST_WRITE_ATTEMPTS} times in a row')
+
+
+def write_s3(state: str, entries: dict, **condition) -> None:
+    helpers.s3_client.put_object(Bucket=Aws.S3_FOOLCALLS_BUCKET,
+                                 Key=manifest_key(state),
+                                 Body=format_lines(entries).encode(),
+                                 **condition)
+
+
+def write_local(outputpath: str, state: str, entries: dict) -> None:
+    path = local_path(outputpath, state)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(format_lines(entries))
+    os.replace(f'{path}.tmp', path)
+
+
+# ---------------------------------------------------------------------------
+# READ
+# ---------------------------------------------------------------------------
+def load(outputpath: str, state: str) -> dict:
+    # returns {cid: key}; a store without a manifest yet (e.g. first run) is indexed on the spot
+    if outputpath == 's3':
+        entries = read_s3(state)
+        journal_path = local_path(outputpath, state)
+        if entries is not None and os.path.exists(journal_path):
+            with open(journal_path) as f:
+                entries.update(parse_lines(f))
+    else:
+        entries = read_local(outputpath, state)
+
+    if entries is None:
+        log.warning(f'no manifest found for {state} in {outputpath}; rebuilding it from the store')
+        entries = rebuild(outputpath, state)
+
+    log.info(f'loaded {len(entries)} cids from the {state} manifest')
+    return entries
+
+
+def read_s3(state: str):
+    return read_s3_with_etag(state)[0]
+
+
+def read_s3_with_etag(state: str) -> tuple:
+    # (entries, etag), or (None, None) if there's no manifest yet
+    try:
+        response = helpers.s3_client.get_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=manifest_key(state))
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None, None
+        raise
+    return parse_lines(response['Body'].read().decode().splitlines()), response['ETag']
+
+
+def read_local(outputpath: str, state: str):
+    path = local_path(outputpath, state)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return parse_lines(f)
+
+
+# ---------------------------------------------------------------------------
+# REBUILD
+# ---------------------------------------------------------------------------
+def rebuild(outputpath: str, state: str) -> dict:
+    log.info(f'rebuilding the {state} manifest from {outputpath}')
+    prefix = f'{state}/'
+    if state == HASHES:
+        # content hashes aren't in the keys, so there's nothing to list; they're recorded again as pages are
+        # downloaded/scraped (see scrapecache.py)
+        keys = []
+    elif outputpath == 's3':
+        keys = helpers.list_keys_parallel(Bucket=Aws.S3_FOOLCALLS_BUCKET, Prefix=prefix)
+    else:
+        keys = (path.replace(f'{outputpath.rstrip("/")}/', '')
+                for path in glob.iglob(f'{outputpath.rstrip("/")}/{prefix}**/*', recursive=True)
+                if os.path.isfile(path))
+
+    if state == structured('parquet'):
+        # parquet part files hold many cids each, so they're indexed by reading them
+        from foolcalls import parquetstore
+        entries = parquetstore.index_cids(outputpath, keys)
+    else:
+        entries = index_keys(keys, KEY_PATTERNS.get(state, DEFAULT_KEY_PATTERN), outputpath)
+
+    if outputpath == 's3':
+        write_s3(state, entries)
+        if os.path.exists(local_path(outputpath, state)):
+            os.remove(local_path(outputpath, state))
+    else:
+        write_local(outputpath, state, entries)
+
+    log.info(f'rebuilt the {state} manifest with {len(entries)} cids')
+    return entries
+
+
+def index_keys(keys, key_pattern, outputpath: str = None) -> dict:
+    # single streaming pass over the (possibly still-being-listed) keys, so memory grows with the number of cids,
+    # not keys. for a cid stored under several rundates, the greatest key (i.e. most recent rundate) wins.
+    # pack indexes (read from <outputpath>) contribute the member keys of every cid in their pack
+    entries = {}
+    for key in keys:
+        if shards.is_index(key):
+            cid_keys = shards.read_index(outputpath, key)
+        else:
+            match = key_pattern.search(key)
+            cid_keys = [] if match is None else [(match.group(1), key)]
+        for cid, cid_key in cid_keys:
+            if cid not in entries or cid_key > entries[cid]:
+                entries[cid] = cid_key
+    return entries
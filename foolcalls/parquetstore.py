@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+from datetime import datetime
+from io import BytesIO
+from foolcalls.config import Aws, Local
+from foolcalls import manifest, sessions, runlog
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# PARQUET STRUCTURED STORE (sync_scrapers --output_format parquet)
+# ---------------------------------------------------------------------------
+# structured transcripts, flattened into three tables, written as compressed parquet and partitioned by the
+# calendar year/quarter of the call date (of the publish date, for transcripts without one; see partition()):
+#   state=structured-parquet/version=<v>/table=call_index/call_year=2020/call_quarter=3/part-<run>-<n>.parquet
+#   .../table=statements/...   one row per statement (call_transcript), text included
+#   .../table=speakers/...     one row per participant (participants.management/analysts)
+# a part file holds up to Local.PARQUET_TRANSCRIPTS_PER_FILE transcripts; the three tables of the same transcripts
+# share a part name. columns are the json fields (strings, as in the json tables), so queries carry over; see
+# athena/create_call_*_parquet_table.sql. cids are recorded in the manifest once their part files are written.
+# parquet files can't be appended to: every run adds part files, so re-scraping cids (--overwrite) into an existing
+# version duplicates them; clear the version's prefix first. needs pyarrow (optional, pip install pyarrow)
+TABLE_PREFIX = 'table='
+
+CALL_INDEX_COLUMNS = ['cid', 'call_url', 'publication_author', 'publication_time_published',
+                      'publication_time_updated', 'call_title', 'call_subtitle', 'period_end', 'ticker',
+                      'ticker_exchange', 'company_name', 'fool_company_id', 'fiscal_period_year', 'fiscal_period_qtr',
+                      'call_short_title', 'call_date', 'call_time', 'duration_minutes']
+STATEMENT_COLUMNS = ['statement_num', 'section', 'statement_type', 'speaker', 'role', 'affiliation', 'text']
+SPEAKER_COLUMNS = ['speaker', 'role', 'affiliation']
+
+
+def schemas() -> dict:
+    return {'call_index': pa.schema([(column, pa.string()) for column in CALL_INDEX_COLUMNS]),
+            'statements': pa.schema([('cid', pa.string()), ('statement_num', pa.int32())]
+                                    + [(column, pa.string()) for column in STATEMENT_COLUMNS[1:]]),
+            'speakers': pa.schema([('cid', pa.string()), ('participant_type', pa.string())]
+                                  + [(column, pa.string()) for column in SPEAKER_COLUMNS])}
+
+
+def require_pyarrow() -> None:
+    if pq is None:
+        raise ImportError('parquet output needs pyarrow, which is not installed (pip install pyarrow)')
+
+
+# ---------------------------------------------------------------------------
+# FLATTEN
+# ---------------------------------------------------------------------------
+def flatten(output: dict) -> dict:
+    # one structured transcript -> {table: [rows]}
+    cid = output['cid']
+    call_index = [{column: output.get(column) for column in CALL_INDEX_COLUMNS}]
+    statements = [dict(cid=cid, **{column: statement.get(column) for column in STATEMENT_COLUMNS})
+                  for statement in output.get('call_transcript', [])]
+    speakers = [dict(cid=cid, participant_type=participant_type,
+                     **{column: participant.get(column) for column in SPEAKER_COLUMNS})
+                for participant_type, participants in output.get('participants', {}).items()
+                for participant in participants]
+    return {'call_index': call_index, 'statements': statements, 'speakers': speakers}
+
+
+def partition(output: dict) -> tuple:
+    # (call year, call quarter) of a transcript, from its call_date (YYYY-MM-DD). extractors.get_header_metadata leaves
+    # call_date empty when the header has no date line (or runs two together when it has two); those transcripts are
+    # partitioned by the publish date in their cid instead, rather than failing to upload (the json store takes them)
+    try:
+        call_date = datetime.strptime(output.get('call_date'), '%Y-%m-%d')
+    except (TypeError, ValueError):
+        log.warning(f'{output["cid"]}: no usable call_date ({output.get("call_date")!r}); partitioned by publish date')
+        call_date = datetime.strptime(output['cid'][:10], '%Y-%m-%d')
+    return call_date.year, (call_date.month - 1) // 3 + 1
+
+
+# ---------------------------------------------------------------------------
+# WRITER
+# ---------------------------------------------------------------------------
+class ParquetWriter:
+    # buffers flattened transcripts by partition; add() is thread-safe (the pipeline's uploader threads share one)
+    def __init__(self, outputpath: str):
+        require_pyarrow()
+        self.outputpath = outputpath
+        self.state = manifest.structured('parquet')
+        self.schemas = schemas()
+        self.run_id = f'{datetime.now().strftime("%Y%m%dT%H%M%S")}-{os.getpid()}'
+        self.parts = 0
+        self.buffers = {}  # (call_year, call_quarter) -> {'cids': [...], <table>: [rows]}
+        self.lock = threading.Lock()
+
+    def add(self, output: dict) -> None:
+        with self.lock:
+            buffer = self.buffers.setdefault(partition(output), {'cids': [], **{table: [] for table in self.schemas}})
+            buffer['cids'].append(output['cid'])
+            for table, rows in flatten(output).items():
+                buffer[table].extend(rows)
+            full = [key for key, buffer in self.buffers.items()
+                    if len(buffer['cids']) >= Local.PARQUET_TRANSCRIPTS_PER_FILE]
+            batches = [(key, self.buffers.pop(key), self.next_part()) for key in full]
+        for key, buffer, part in batches:
+            self.write(key, buffer, part)
+
+    def close(self) -> None:
+        # writes whatever is still buffered
+        with self.lock:
+            batches = [(key, buffer, self.next_part()) for key, buffer in self.buffers.items()]
+            self.buffers = {}
+        for key, buffer, part in batches:
+            self.write(key, buffer, part)
+
+    def next_part(self) -> str:
+        self.parts += 1
+        return f'part-{self.run_id}-{self.parts:05d}.parquet'
+
+    def key(self, table: str, partition_key: tuple, part: str) -> str:
+        call_year, call_quarter = partition_key
+        return f'{self.state}/{TABLE_PREFIX}{table}/call_year={call_year}/call_quarter={call_quarter}/{part}'
+
+    def write(self, partition_key: tuple, buffer: dict, part: str) -> None:
+        with runlog.span('upload'):
+            for table, schema in self.schemas.items():
+                key = self.key(table, partition_key, part)
+                arrow_table = pa.Table.from_pylist(buffer[table], schema=schema)
+                if self.outputpath == 's3':
+                    put_table_in_s3(key, arrow_table)
+                else:
+                    save_table_local(self.outputpath, key, arrow_table)
+        log.info(f'wrote {len(buffer["cids"])} transcripts to {self.key("<table>", partition_key, part)}')
+
+        call_index_key = self.key('call_index', partition_key, part)
+        for cid in buffer['cids']:
+            manifest.record(self.outputpath, self.state, cid, call_index_key)
+
+
+def save_table_local(outputpath: str, key: str, arrow_table) -> None:
+    output_path = f'{outputpath.rstrip("/")}/{key}'
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    pq.write_table(arrow_table, output_path, compression=Local.PARQUET_COMPRESSION)
+
+
+def put_table_in_s3(key: str, arrow_table) -> None:
+    body = BytesIO()
+    pq.write_table(arrow_table, body, compression=Local.PARQUET_COMPRESSION)
+    sessions.get_s3_client().put_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=key, Body=body.getvalue())
+    log.info(f's3 upload success: {Aws.S3_OBJECT_ROOT}/{Aws.S3_FOOLCALLS_BUCKET}/{key}')
+
+
+# ---------------------------------------------------------------------------
+# MANIFEST REBUILD
+# ---------------------------------------------------------------------------
+def index_cids(outputpath: str, keys) -> dict:
+    # {cid: call_index part key}, read from the cid column of the call_index part files (their keys carry no cids)
+    require_pyarrow()
+    entries = {}
+    for key in keys:
+        if f'/{TABLE_PREFIX}call_index/' not in key or not key.endswith('.parquet'):
+            continue
+        if outputpath == 's3':
+            response = sessions.get_s3_client().get_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=key)
+            source = BytesIO(response['Body'].read())
+        else:
+            source = f'{outputpath.rstrip("/")}/{key}'
+        for cid in pq.read_table(source, columns=['cid']).column('cid').to_pylist():
+            if cid not in entries or key > entries[cid]:
+                entries[cid] = key
+    return entries
@@ -0,0 +1,51 @@
+import re
+from lxml import etree
+
+# ---------------------------------------------------------------------------
+# COMPILED XPATH + REGEX REGISTRY
+# ---------------------------------------------------------------------------
+# every xpath and regex the extractors use, compiled once at import and shared by all of them.
+# pool workers forked from the parent process inherit the compiled objects (and spawned ones compile them once),
+# so nothing is compiled per statement/transcript.
+# etree.XPath objects are called with the context element, e.g. XPATH_TEXT(element)
+
+# listing pages
+XPATH_CALL_URLS = etree.XPath('.//div[@class = "content-block listed-articles recent-articles m-np"]'
+                              '//div[@class="list-content"]/a/@href')
+
+# containers
+XPATH_PUBLICATION_INFO = etree.XPath('.//div[@class="author-and-date"]')
+XPATH_ARTICLE_HEADER = etree.XPath('.//section[@class="usmf-new article-header"]/header')
+XPATH_ARTICLE_BODY = etree.XPath('.//section[@class="usmf-new article-body"]/span[@class="article-content"]')
+
+# shared
+XPATH_TEXT = etree.XPath('.//text()')
+XPATH_STRONG_TEXT = etree.XPath('.//strong/text()')
+RE_WHITESPACE = re.compile('\\s+')
+
+# publication metadata
+XPATH_AUTHOR_TEXT = etree.XPath('.//div[@class="author-name"]//text()')
+XPATH_PUBLICATION_DATE_TEXT = etree.XPath('.//div[@class="publication-date"]//text()')
+RE_PUB_TIME_UPDATED = re.compile('^Updated: (.*) Published:')
+RE_PUB_TIME_PUBLISHED = re.compile('Published: (.*)$')
+
+# title metadata
+XPATH_TITLE_TEXT = etree.XPath('./h1/text()')
+XPATH_SUBTITLE_TEXT = etree.XPath('./h2/text()')
+RE_PERIOD_ENDING = re.compile('period ending ([a-zA-z ]+\\d{1,2}, 20\\d\\d)\\.$')
+
+# header metadata
+XPATH_TICKER_ID = etree.XPath('.//span[@class="ticker"]/@data-id')
+XPATH_TICKER_TEXT = etree.XPath('.//span[@class="ticker"]/a/text()')
+RE_SHORT_TITLE = re.compile('(earnings call)|(conference call)|(earnings conference)')
+RE_QTR_YEAR = re.compile('Q\\d 20\\d\\d')
+RE_ENDS_WITH_YEAR = re.compile('20\\d\\d.{0,3}$')
+RE_STARTS_WITH_TIME = re.compile('^\\d\\d?:\\d\\d')
+
+# duration metadata
+RE_DURATION = re.compile('Duration: (\\d{1,3}) minutes')
+
+# statement metadata
+XPATH_EM_TEXT = etree.XPath('.//em/text()')
+RE_EDGE_DASHES = re.compile('(\\-\\-$)|(^\\-\\-)')
+RE_ANALYST_ROLE = re.compile('(^anal[a-z]{2,4})|([a-z]{2,4}lyst$)')
@@ -0,0 +1,172 @@
+import argparse
+import gzip
+import logging
+import os
+import random
+import threading
+from itertools import chain
+from foolcalls.config import Aws, FoolCalls
+from foolcalls import sessions
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# RAW STORE CODECS
+# ---------------------------------------------------------------------------
+# how downloaded pages are compressed (FoolCalls.RAW_CODEC):
+#   gzip        cid=*.gz, one gzip stream per page (the default)
+#   zstd-dict   cid=*.zst, one zstd frame per page, compressed with a dictionary trained on stored pages.
+#               fool.com pages share most of their markup (navigation, scripts, boilerplate), which a per-page gzip
+#               has to encode again for every page; the dictionary holds it once. needs zstandard (optional)
+# readers don't need to know which codec wrote a page: scrapers.decompress_chunks tells them apart by their magic
+# bytes, and a zstd frame header carries the id of its dictionary (also stored as s3 object metadata, zstd-dict-id).
+# dictionaries live in the store they were trained on, and are loaded once per process:
+#   dictionaries/zstd/dict=<id>.zdict     trained dictionaries (kept, since older pages still need theirs)
+#   dictionaries/zstd/current.txt         id of the dictionary new pages are compressed with
+# train one with: python -m foolcalls.rawcodecs <outputpath> [--sample 500]
+# see benchmarks/bench_rawcodecs.py for ratios and decompression throughput against gzip
+GZIP = 'gzip'
+ZSTD_DICT = 'zstd-dict'
+EXTENSIONS = {GZIP: '.gz', ZSTD_DICT: '.zst'}
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+METADATA_DICT_ID = 'zstd-dict-id'
+
+DICTIONARY_PREFIX = 'dictionaries/zstd'
+CURRENT_DICTIONARY_KEY = f'{DICTIONARY_PREFIX}/current.txt'
+
+dictionaries = {}  # dictionary id -> zstd.ZstdCompressionDict
+current_dictionary_ids = {}  # outputpath -> dictionary id
+dictionaries_lock = threading.Lock()
+
+
+def require_zstandard() -> None:
+    if zstd is None:
+        raise ImportError('the zstd-dict raw codec needs zstandard, which is not installed (pip install zstandard)')
+
+
+def extension(codec: str = None) -> str:
+    return EXTENSIONS[codec or FoolCalls.RAW_CODEC]
+
+
+def is_zstd(head: bytes) -> bool:
+    return head[:4] == ZSTD_MAGIC
+
+
+# ---------------------------------------------------------------------------
+# COMPRESS / DECOMPRESS
+# ---------------------------------------------------------------------------
+def encode(outputpath: str, html_content: bytes, codec: str = None) -> tuple:
+    # (compressed page, object metadata)
+    if (codec or FoolCalls.RAW_CODEC) == ZSTD_DICT:
+        dictionary = current_dictionary(outputpath)
+        compressor = zstd.ZstdCompressor(level=FoolCalls.RAW_ZSTD_LEVEL, dict_data=dictionary)
+        return compressor.compress(html_content), {METADATA_DICT_ID: str(dictionary.dict_id())}
+
+    return gzip.compress(html_content), {}
+
+
+def unzstd_chunks(outputpath: str, compressed_chunks):
+    # incremental zstd decompression of one frame, with the dictionary named in its header
+    require_zstandard()
+    compressed_chunks = iter(compressed_chunks)
+    first = next(compressed_chunks, b'')
+    dict_id = zstd.get_frame_parameters(first).dict_id
+    if dict_id:
+        decompressor = zstd.ZstdDecompressor(dict_data=load_dictionary(outputpath, dict_id))
+    else:
+        decompressor = zstd.ZstdDecompressor()
+
+    decompressobj = decompressor.decompressobj()
+    for chunk in chain([first], compressed_chunks):
+        decompressed = decompressobj.decompress(chunk)
+        if decompressed:
+            yield decompressed
+    if not decompressobj.eof:
+        raise EOFError('compressed file ended before the end-of-frame marker was reached')
+
+
+# ---------------------------------------------------------------------------
+# DICTIONARIES
+# ---------------------------------------------------------------------------
+def dictionary_key(dict_id: int) -> str:
+    return f'{DICTIONARY_PREFIX}/dict={dict_id}.zdict'
+
+
+def load_dictionary(outputpath: str, dict_id: int):
+    with dictionaries_lock:
+        if dict_id not in dictionaries:
+            dictionaries[dict_id] = zstd.ZstdCompressionDict(read_object(outputpath, dictionary_key(dict_id)))
+            log.info(f'loaded zstd dictionary {dict_id} from {outputpath}')
+        return dictionaries[dict_id]
+
+
+def current_dictionary(outputpath: str):
+    require_zstandard()
+    if outputpath not in current_dictionary_ids:
+        try:
+            current_dictionary_ids[outputpath] = int(read_object(outputpath, CURRENT_DICTIONARY_KEY).decode())
+        except Exception as e:
+            raise Exception(f'no current zstd dictionary in {outputpath} ({e}); train one with '
+                            f'python -m foolcalls.rawcodecs {outputpath}')
+    return load_dictionary(outputpath, current_dictionary_ids[outputpath])
+
+
+def train(pages: list, dict_size: int = None):
+    # zstd's trainer wants many small samples, rather than a few large pages, so pages are cut into slices
+    require_zstandard()
+    sample_bytes = FoolCalls.RAW_ZSTD_SAMPLE_BYTES
+    samples = [page[i:i + sample_bytes] for page in pages for i in range(0, len(page), sample_bytes)]
+    return zstd.train_dictionary(dict_size or FoolCalls.RAW_ZSTD_DICT_SIZE, samples)
+
+
+def save_dictionary(outputpath: str, dictionary, make_current: bool = True) -> None:
+    write_object(outputpath, dictionary_key(dictionary.dict_id()), dictionary.as_bytes())
+    if make_current:
+        write_object(outputpath, CURRENT_DICTIONARY_KEY, str(dictionary.dict_id()).encode())
+        current_dictionary_ids[outputpath] = dictionary.dict_id()
+    with dictionaries_lock:
+        dictionaries[dictionary.dict_id()] = dictionary
+
+
+def read_object(outputpath: str, key: str) -> bytes:
+    if outputpath == 's3':
+        return sessions.get_s3_client().get_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=key)['Body'].read()
+    with open(f'{outputpath.rstrip("/")}/{key}', 'rb') as f:
+        return f.read()
+
+
+def write_object(outputpath: str, key: str, body: bytes) -> None:
+    if outputpath == 's3':
+        sessions.get_s3_client().put_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=key, Body=body)
+        return
+    output_path = f'{outputpath.rstrip("/")}/{key}'
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(body)
+
+
+if __name__ == "__main__":
+    from foolcalls import manifest, scrapers
+
+    parser = argparse.ArgumentParser(description='train a zstd dictionary on a sample of stored raw transcripts, and '
+                                                 'make it the one new pages are compressed with (zstd-dict codec)')
+    parser.add_argument('outputpath', help='store to sample (and to save the dictionary to); if outputpath==\'s3\', '
+                                           'the Aws.S3_FOOLCALLS_BUCKET bucket')
+    parser.add_argument('--sample', type=int, default=500, help='number of stored pages to train on')
+    parser.add_argument('--dict_size', type=int, default=FoolCalls.RAW_ZSTD_DICT_SIZE, help='dictionary size, bytes')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    keys = list(manifest.load(args.outputpath, manifest.DOWNLOADED).values())
+    keys = random.sample(keys, min(args.sample, len(keys)))
+    pages = [scrapers.get_raw_transcript_bytes(args.outputpath, key) for key in keys]
+    trained = train(pages, args.dict_size)
+    save_dictionary(args.outputpath, trained)
+    log.info(f'trained zstd dictionary {trained.dict_id()} ({len(trained.as_bytes())} bytes) on {len(pages)} pages; '
+             f'set FoolCalls.RAW_CODEC = \'{ZSTD_DICT}\' to compress new pages with it')
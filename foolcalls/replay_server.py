@@ -0,0 +1,245 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter, deque
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# LOCAL FOOL.COM STAND-IN
+# ---------------------------------------------------------------------------
+# serves what the crawler asks fool.com for, built from the fixture corpus (output/state=downloaded):
+#   /earnings-call-transcripts?page=N                  listing pages, LINKS_PER_PAGE links each, newest first;
+#                                                      past the last page, a listing with no links (end of crawl)
+#   /earnings/call-transcripts/YYYY/MM/DD/<slug>/      transcript pages (also .aspx), fixture pages cycled
+# with injectable faults: latency (+ jitter), 5xx error rate, 429 rate, and a server-side requests/sec limit
+# (answered with 429 + Retry-After). listing pages carry an ETag, so conditional gets get 304s like on the site.
+# every request is counted by kind and status; "wasted" requests are the ones that brought back nothing new
+# (429s, 5xx, 404s, and 200s for a page that was already served with a 200).
+# point the crawler at it with FOOLCALLS_ROOT=http://127.0.0.1:<port> (see config.py), or use
+# benchmarks/bench_crawl.py, which runs the server and a full download + scrape sync in one process.
+# usage: python -m foolcalls.replay_server [--port 8000] [--transcripts 200] [--latency 0.05] [--error_rate 0.01]
+LINKS_PER_PAGE = 20  # as on fool.com (2020-07-10)
+LAST_CALL_DATE = date(2020, 7, 10)
+CALLS_PER_DAY = 4
+
+LISTING_PATH = '/earnings-call-transcripts'
+TRANSCRIPT_PATH = '/earnings/call-transcripts/'
+
+LISTING_TEMPLATE = ('<html><body><div class="content-block listed-articles recent-articles m-np">{links}</div>'
+                    '</body></html>')
+LINK_TEMPLATE = '<div class="list-content"><a href="{href}">{cid}</a></div>'
+
+
+class Corpus:
+    # <transcripts> synthetic calls, whose pages are the fixture pages, cycled
+    def __init__(self, fixture_glob: str, transcripts: int):
+        self.pages = []
+        slugs = []
+        for path in sorted(glob.glob(fixture_glob, recursive=True)):
+            with gzip.open(path, 'rb') as f:
+                self.pages.append(f.read())
+            # cid=YYYY-MM-DD-<slug>.gz
+            slugs.append(path.rsplit('cid=', 1)[-1][len('YYYY-MM-DD-'):-len('.gz')])
+        if len(self.pages) == 0:
+            raise Exception(f'no fixture pages found in {fixture_glob}')
+
+        self.paths = []  # transcript url paths, newest first (listing order)
+        self.page_of = {}  # transcript url path -> fixture page index
+        for i in range(transcripts):
+            call_date = LAST_CALL_DATE - timedelta(days=i // CALLS_PER_DAY)
+            path = f'{TRANSCRIPT_PATH}{call_date.strftime("%Y/%m/%d")}/{slugs[i % len(slugs)]}-r{i}/'
+            self.paths.append(path)
+            self.page_of[path] = i % len(self.pages)
+
+    @property
+    def listing_pages(self) -> int:
+        return -(-len(self.paths) // LINKS_PER_PAGE)
+
+    def listing(self, page_num: int) -> bytes:
+        start = (page_num - 1) * LINKS_PER_PAGE
+        paths = self.paths[start:start + LINKS_PER_PAGE] if page_num >= 1 else []
+        links = ''.join(LINK_TEMPLATE.format(href=f'{path.rstrip("/")}.aspx', cid=path) for path in paths)
+        return LISTING_TEMPLATE.format(links=links).encode()
+
+    def transcript(self, path: str):
+        # fixture page bytes, or None if there's no such transcript
+        if path.endswith('.aspx'):
+            path = f'{path[:-len(".aspx")]}/'
+        if path in self.page_of:
+            return self.pages[self.page_of[path]]
+        return None
+
+
+class Faults:
+    def __init__(self, latency: float = 0, latency_jitter: float = 0, error_rate: float = 0,
+                 throttle_rate: float = 0, max_requests_per_second: float = None, retry_after: float = 1,
+                 seed: int = None):
+        self.latency = latency  # seconds added to every response
+        self.latency_jitter = latency_jitter  # plus uniform(0, latency_jitter) seconds
+        self.error_rate = error_rate  # share of requests answered with a 503
+        self.throttle_rate = throttle_rate  # share of requests answered with a 429
+        self.max_requests_per_second = max_requests_per_second  # requests past this rate get a 429
+        self.retry_after = retry_after  # Retry-After (seconds) sent with 429s/503s; None to leave it out
+        self.random = random.Random(seed)
+        self.recent = deque()  # arrival times of the requests of the last second
+        self.lock = threading.Lock()
+
+    def delay(self) -> float:
+        with self.lock:
+            return self.latency + self.random.uniform(0, self.latency_jitter)
+
+    def status(self) -> int:
+        # status to answer with instead of the page, or None to serve it
+        with self.lock:
+            if self.max_requests_per_second is not None:
+                now = time.monotonic()
+                while self.recent and now - self.recent[0] >= 1:
+                    self.recent.popleft()
+                if len(self.recent) >= self.max_requests_per_second:
+                    return 429
+                self.recent.append(now)
+
+            draw = self.random.random()
+            if draw < self.throttle_rate:
+                return 429
+            if draw < self.throttle_rate + self.error_rate:
+                return 503
+            return None
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, corpus: Corpus, faults: Faults = None):
+        super().__init__(address, ReplayHandler)
+        self.corpus = corpus
+        self.faults = faults or Faults()
+        self.requests = Counter()  # (kind, status) -> requests
+        self.served = Counter()  # path -> 200s
+        self.wasted = 0
+        self.lock = threading.Lock()
+
+    @property
+    def root(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, kind: str, path: str, status: int) -> None:
+        with self.lock:
+            self.requests[(kind, status)] += 1
+            if status == 200:
+                self.served[path] += 1
+                if self.served[path] > 1:
+                    self.wasted += 1
+            elif status != 304:
+                self.wasted += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            by_kind = {}
+            for (kind, status), requests in sorted(self.requests.items()):
+                by_kind.setdefault(kind, {})[str(status)] = requests
+            return {'requests': sum(self.requests.values()),
+                    'by_kind': by_kind,
+                    'wasted': self.wasted,
+                    'transcripts_served': sum(1 for path in self.served if path.startswith(TRANSCRIPT_PATH))}
+
+    def start(self) -> threading.Thread:
+        # serves on a daemon thread; stop with shutdown()
+        thread = threading.Thread(target=self.serve_forever, name='replay-server', daemon=True)
+        thread.start()
+        log.info(f'replaying {len(self.corpus.paths)} transcripts ({self.corpus.listing_pages} listing pages) '
+                 f'at {self.root}')
+        return thread
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the site
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/_stats':
+            self.respond(200, json.dumps(self.server.stats()).encode(), 'application/json')
+            return
+
+        time.sleep(self.server.faults.delay())
+        kind = 'listing' if url.path.rstrip('/') == LISTING_PATH else 'transcript'
+        status = self.server.faults.status()
+        if status is not None:
+            self.server.count(kind, url.path, status)
+            headers = {}
+            if self.server.faults.retry_after is not None:
+                headers['Retry-After'] = str(self.server.faults.retry_after)
+            self.respond(status, b'', headers=headers)
+            return
+
+        if kind == 'listing':
+            page_num = int(parse_qs(url.query).get('page', ['1'])[0])
+            body = self.server.corpus.listing(page_num)
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.server.count(kind, f'{url.path}?page={page_num}', 304)
+                self.respond(304, b'', headers={'ETag': etag})
+                return
+            self.server.count(kind, f'{url.path}?page={page_num}', 200)
+            self.respond(200, body, headers={'ETag': etag})
+            return
+
+        body = self.server.corpus.transcript(url.path)
+        if body is None:
+            self.server.count(kind, url.path, 404)
+            self.respond(404, b'')
+            return
+        self.server.count(kind, url.path, 200)
+        self.respond(200, body)
+
+    def respond(self, status: int, body: bytes, content_type: str = 'text/html; charset=utf-8',
+                headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug(f'{self.address_string()} - {format % args}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='serve synthetic fool.com listing/transcript pages built from the '
+                                                 'fixture corpus, with injectable latency and errors')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--corpus', default='output/state=downloaded/**/*.gz', help='glob of gzipped fixture pages')
+    parser.add_argument('--transcripts', type=int, default=200, help='number of transcripts to list and serve')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('--latency_jitter', type=float, default=0, help='plus up to this many seconds, at random')
+    parser.add_argument('--error_rate', type=float, default=0, help='share of requests answered with a 503')
+    parser.add_argument('--throttle_rate', type=float, default=0, help='share of requests answered with a 429')
+    parser.add_argument('--max_requests_per_second', type=float, help='requests past this rate get a 429')
+    parser.add_argument('--retry_after', type=float, default=1, help='Retry-After seconds sent with 429s/503s')
+    parser.add_argument('--seed', type=int, help='seed of the fault injection draws')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = ReplayServer((args.host, args.port), Corpus(args.corpus, args.transcripts),
+                          Faults(args.latency, args.latency_jitter, args.error_rate, args.throttle_rate,
+                                 args.max_requests_per_second, args.retry_after, args.seed))
+    log.info(f'serving on {server.root} (request counts at {server.root}/_stats); '
+             f'crawl it with FOOLCALLS_ROOT={server.root}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info(f'stats: {server.stats()}')
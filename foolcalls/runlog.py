@@ -0,0 +1,170 @@
+import json
+import logging
+import logging.handlers
+import multiprocessing as mp
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from foolcalls.config import FoolCalls
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# RUN LOGGING (MULTIPROCESS-SAFE)
+# ---------------------------------------------------------------------------
+# every process (the parent, its threads, and pool workers) logs into one multiprocessing queue through a QueueHandler.
+# a single QueueListener thread in the parent drains the queue into the log file, so pool workers never write to the
+# file (or stdout) themselves and lines don't interleave. set up once per run by the sync_* CLIs:
+#   run = runlog.setup('./logs/sync_scrapers_20200711T120000.log')
+#   ...  (pool initializers call runlog.init_worker(runlog.log_queue))
+#   run.close(summary)  # stops the listener, writes the run report
+#
+# timing spans are log records too (logger foolcalls.spans, level DEBUG), e.g.
+#   with runlog.span('upload'): ...
+#   @runlog.timed('extract.get_header_metadata')
+# the listener hands them to a SpanCollector rather than the log file; at the end of the run, their p50/p95/p99 per
+# span name are written to <log file>.report.json. spans cost next to nothing when logging isn't set up
+# (e.g. when foolcalls is used as a module), since the spans logger is disabled until setup() is called
+LOG_FORMAT = '%(asctime)s - %(processName)s[%(process)d] - %(name)s - %(levelname)s - %(message)s'
+PERCENTILES = [50, 95, 99]
+
+span_log = logging.getLogger('foolcalls.spans')
+span_log.setLevel(logging.WARNING)  # disabled until setup()/init_worker()
+
+log_queue = None
+
+
+def is_span(record) -> bool:
+    return hasattr(record, 'span')
+
+
+# ---------------------------------------------------------------------------
+# SPANS
+# ---------------------------------------------------------------------------
+def spans_enabled() -> bool:
+    return span_log.isEnabledFor(logging.DEBUG)
+
+
+def record_span(name: str, seconds: float) -> None:
+    if spans_enabled():
+        span_log.debug(f'{name} {seconds * 1000:.2f}ms', extra={'span': name, 'seconds': seconds})
+
+
+@contextmanager
+def span(name: str):
+    if not spans_enabled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def timed(name: str):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class SpanCollector(logging.Handler):
+    # keeps the duration of every span record it sees, by span name (runs on the listener thread)
+    def __init__(self):
+        super().__init__()
+        self.seconds = defaultdict(list)
+        self.addFilter(is_span)
+
+    def emit(self, record) -> None:
+        self.seconds[record.span].append(record.seconds)
+
+    def percentiles(self) -> dict:
+        stats = {}
+        for name, seconds in sorted(self.seconds.items()):
+            seconds = sorted(seconds)
+            stats[name] = {'count': len(seconds), 'total_seconds': round(sum(seconds), 3)}
+            for p in PERCENTILES:
+                # nearest rank
+                rank = max(0, -(-p * len(seconds) // 100) - 1)
+                stats[name][f'p{p}_ms'] = round(seconds[rank] * 1000, 3)
+            stats[name]['max_ms'] = round(seconds[-1] * 1000, 3)
+        return stats
+
+
+# ---------------------------------------------------------------------------
+# SETUP
+# ---------------------------------------------------------------------------
+class Run:
+    def __init__(self, log_path: str, listener, collector: SpanCollector):
+        self.log_path = log_path
+        self.report_path = f'{os.path.splitext(log_path)[0]}.report.json'
+        self.listener = listener
+        self.collector = collector
+        self.start = time.time()
+
+    def report(self, summary: dict = None) -> dict:
+        return {'log': self.log_path,
+                'scraper_version': FoolCalls.SCRAPER_VERSION,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.start)),
+                'seconds': round(time.time() - self.start, 1),
+                'summary': summary or {},
+                'spans': self.collector.percentiles()}
+
+    def close(self, summary: dict = None) -> dict:
+        global log_queue
+        log.info(f'writing run report to {self.report_path}')
+        # stopping the listener drains the queue first, so every span logged by the run makes it into the report
+        self.listener.stop()
+        report = self.report(summary)
+        with open(self.report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        # back to how things were before setup()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                root.removeHandler(handler)
+        span_log.setLevel(logging.WARNING)
+        # pools started later (e.g. by the next run in the same process) mustn't log into this run's drained queue
+        log_queue = None
+        for handler in self.listener.handlers:
+            handler.close()
+        return report
+
+
+def setup(log_path: str, level=logging.INFO) -> Run:
+    global log_queue
+    os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+
+    file_handler = logging.FileHandler(log_path)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    file_handler.addFilter(lambda record: not is_span(record))
+    collector = SpanCollector()
+
+    log_queue = mp.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, collector, respect_handler_level=True)
+    listener.start()
+    init_worker(log_queue, level)
+
+    run = Run(log_path, listener, collector)
+    log.info(f'logging to {log_path} (run report: {run.report_path})')
+    return run
+
+
+def init_worker(queue, level=logging.INFO) -> None:
+    # route this process's records into the run's queue. pool initializers call this; forked workers already inherit
+    # the parent's handler, spawned ones don't
+    if queue is None:
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(queue))
+    root.setLevel(level)
+    span_log.setLevel(logging.DEBUG)
@@ -0,0 +1,98 @@
+import gzip
+import hashlib
+import inspect
+import json
+import logging
+import os
+from functools import lru_cache
+from foolcalls.config import Local
+from foolcalls import extractors, patterns, dateparsing, decorators, layouts, manifest
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# CONTENT HASHES + SCRAPE RESULT CACHE
+# ---------------------------------------------------------------------------
+# a raw transcript is identified by the sha1 of its (decompressed) page, its content hash:
+#   - downloaders record it per cid in the hashes manifest (manifest.HASHES, "<cid>\t<hash>:<key>" lines), and skip
+#     storing a re-downloaded page whose hash hasn't changed (no new rundate= copy)
+#   - scraped transcripts are cached by content hash in Local.SCRAPE_CACHE_DIR, along with the page layout and a
+#     fingerprint of the extractor code that scraped it (code_fingerprint). a cached result is reused as long as that
+#     code hasn't changed, so bumping FoolCalls.SCRAPER_VERSION or sync_scrapers --overwrite only re-parses the pages
+#     whose content, or whose extractors, changed
+# the scrapers backfill the hashes of pages downloaded before hashes were recorded as they read them, so from the
+# next run on, cached transcripts aren't even fetched. a hash is tied to the key it was computed from, and ignored
+# once the cid's key changes (a new download, compaction). cache hits are counted under their page layout, as
+# hits (see layouts.get_stats)
+
+# modules every page template's scraper runs through; a template's own scraper function is added to these
+EXTRACTOR_MODULES = [extractors, patterns, dateparsing, decorators, layouts]
+
+
+def content_hash(html_content: bytes) -> str:
+    return hashlib.sha1(html_content).hexdigest()
+
+
+def record_hash(outputpath: str, cid: str, html_hash: str, key: str) -> None:
+    manifest.record(outputpath, manifest.HASHES, cid, f'{html_hash}:{key}')
+
+
+def parse_hash_entry(entry: str) -> tuple:
+    # (content hash, key it was computed from) of a hashes manifest entry; (None, None) if there's none
+    if entry is None:
+        return None, None
+    html_hash, key = entry.split(':', 1)
+    return html_hash, key
+
+
+def hash_of(entry: str, key: str):
+    # the content hash in a hashes manifest entry, if it was computed from <key>; None otherwise
+    html_hash, entry_key = parse_hash_entry(entry)
+    return html_hash if entry_key == key else None
+
+
+@lru_cache(maxsize=None)
+def code_fingerprint(template: str) -> str:
+    sha1 = hashlib.sha1()
+    for module in EXTRACTOR_MODULES:
+        sha1.update(inspect.getsource(module).encode())
+    sha1.update(inspect.getsource(layouts.scrapers[template]).encode())
+    return sha1.hexdigest()
+
+
+class ScrapeCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def path(self, html_hash: str) -> str:
+        return os.path.join(self.cache_dir, html_hash[:2], f'{html_hash}.json.gz')
+
+    def get(self, html_hash: str):
+        # (layout, scraped transcript) cached for this page, or None if there's none, or its extractors have changed
+        if not Local.SCRAPE_CACHE_ON:
+            return None
+        try:
+            with gzip.open(self.path(html_hash), 'rt') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, EOFError, OSError, json.JSONDecodeError):
+            return None
+
+        template = layouts.template_of(entry['layout'])
+        if template not in layouts.scrapers or entry['code'] != code_fingerprint(template):
+            return None
+        return entry['layout'], entry['data']
+
+    def save(self, html_hash: str, layout: str, data: dict) -> None:
+        if not Local.SCRAPE_CACHE_ON:
+            return
+        entry = {'layout': layout, 'code': code_fingerprint(layouts.template_of(layout)), 'data': data}
+        path = self.path(html_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write-then-rename, so a concurrent reader (another pool worker) never sees a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with gzip.open(tmp_path, 'wt') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+
+cache = ScrapeCache(Local.SCRAPE_CACHE_DIR)
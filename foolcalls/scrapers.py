@@ -4,34 +4,40 @@ import argparse
 import logging
 from foolcalls.config import Aws, FoolCalls
 import json
-import boto3
-from foolcalls import helpers, extractors, extractors_v2
-from io import BytesIO
-import gzip
-import shutil
+from foolcalls import helpers, extractors, layouts, throttle, sessions, manifest, runlog, shards, rawcodecs, scrapecache
+import zlib
+import hashlib
+from functools import partial
+from itertools import chain
 from lxml import html
-import multiprocessing as mp
-import requests
 import random
+import time
 
 log = logging.getLogger(__name__)
 
-aws_session = boto3.Session(aws_access_key_id=Aws.AWS_KEY,
-                            aws_secret_access_key=Aws.AWS_SECRET)
+GZIP_WBITS = zlib.MAX_WBITS | 16  # zlib window bits for gzip-wrapped streams
 
 
 # ---------------------------------------------------------------------------
 # SCRAPE LINKS OF OF A GIVEN PAGE
 # ---------------------------------------------------------------------------
-def request_html_w_urls(page_num):
+def listing_url(page_num) -> str:
+    # the validator cache is keyed on the url requested, not response.url (which differs after a redirect)
+    return sessions.validator_cache.request_url(FoolCalls.EARNINGS_LINKS_ROOT, {'page': page_num})
+
+
+def request_html_w_urls(page_num, conditional=True):
     request = dict(url=FoolCalls.EARNINGS_LINKS_ROOT,
                    params={'page': page_num},
                    headers={'User-Agent': random.choice(FoolCalls.USER_AGENT_LIST)})
 
+    # conditional get: if the page hasn't changed since it was last scraped, fool.com responds with a 304
+    if conditional:
+        request['headers'].update(sessions.validator_cache.conditional_headers(listing_url(page_num)))
+
     log.info(f'request: {request}')
 
-    response = requests.get(**request)
-    assert response.status_code == 200
+    response = throttle.get(**request)
     return response
 
 
@@ -43,22 +49,43 @@ def scrape_transcript_urls(html_text):
 
 def scrape_transcript_urls_by_page(page_num):
     response = request_html_w_urls(page_num)
+    if response.status_code == 304:
+        call_urls = sessions.validator_cache.payload(listing_url(page_num))
+        if call_urls is not None:
+            log.info(f'page {page_num} not modified; using cached urls')
+            return call_urls
+        # the cache entry went away after the validators were sent (e.g. cleared by another run)
+        log.info(f'page {page_num} not modified, but its cached urls are gone; requesting it in full')
+        response = request_html_w_urls(page_num, conditional=False)
+
     call_urls_ext = scrape_transcript_urls(response.text)
+    if call_urls_ext is None:
+        # past the last listing page (listing.walk stops here)
+        return None
     call_urls = [f'{FoolCalls.ROOT}{call_url_ext}' for call_url_ext in call_urls_ext]
+    sessions.validator_cache.save(listing_url(page_num), response, call_urls)
     return call_urls
 
 
 # ---------------------------------------------------------------------------
 # SCRAPE TRANSCRIPT
 # ---------------------------------------------------------------------------
-def scrape_transcript(html_text: bytes) -> dict:
+def scrape_transcript(html_text) -> dict:
+    # html_text: raw page, or an already parsed document.
+    # the page is parsed once; layouts.scrape picks the scraper registered for its page template
+    layout, output, scrape_seconds = layouts.scrape(extractors.to_document(html_text))
+    return output
+
+
+@layouts.register('usmf-new')
+def scrape_article_content(html_doc) -> dict:
     # init output
     output = {}
 
     # top level html elements (aka containers)
     # returns a dictionary wherein each key is a different container object
     # no information is being extracted yet; different parts of the page are being isolated here
-    containers = extractors.find_containers(html_text)
+    containers = extractors.find_containers(html_doc)
 
     # extract structured data from elements
     publisher_metadata = extractors.get_publication_metadata(containers['publication_info'])
@@ -80,123 +107,229 @@ def scrape_transcript(html_text: bytes) -> dict:
     output.update({'call_transcript': call_statement_data})
     return output
 
-def scrape_transcript_v2(html_text: bytes) -> dict:
-    # init output
-    output = {}
 
-    # top level html elements (aka containers)
-    # returns a dictionary wherein each key is a different container object
-    # no information is being extracted yet; different parts of the page are being isolated here
-    containers = extractors_v2.find_containers(html_text)
+def process_transcript(cid: str, html_content, outputpath: str, html_hash: str = None) -> dict:
+    # html_content: raw page bytes (straight from the downloader) or a parsed document (from get_raw_transcript)
+    # returns the page layout and how long it took to scrape, so pool results can be tallied by layout
+    structured = structure_transcript(cid, html_content, html_hash)
 
-    # extract structured data from elements
-    call_metadata = extractors_v2.get_publication_metadata(containers['publication_info'])
-    call_header_metadata = extractors_v2.get_header_metadata(containers['article_header'])
-    call_duration_metadata = extractors_v2.get_duration_metadata(containers['duration'])
-    call_statement_data = extractors_v2.get_statement_data(pres_elements=containers['pres'], qa_elements=containers['qa'])
-
-    # metadata for speakers on call (not scraped, derived from statement metadata)
-    call_participant_metadata = extractors_v2.get_participant_metadata(call_statement_data)
+    # upload to s3
+    save_transcript(outputpath, structured['key'], structured['output'])
+    return result_of(structured)
 
-    # format output from extracted data
-    output.update(call_metadata)
-    output.update(call_header_metadata)
-    output.update(call_duration_metadata)
-    output.update({'participants': call_participant_metadata})
-    output.update({'call_transcript': call_statement_data})
-    return output
 
-def process_transcript(cid: str, html_content: bytes, outputpath: str) -> None:
-    call_url = f'{FoolCalls.EARNINGS_TRANSCRIPTS_ROOT}/{helpers.to_url(cid)}'
+def structure_transcript(cid: str, html_content, html_hash: str = None) -> dict:
+    # scrape only (no i/o): returns the structured output, the key to save it under, its page layout and scrape time.
+    # html_hash: content hash of the page (computed here from raw page bytes); pages in the scrape cache aren't parsed
+    if html_hash is None and isinstance(html_content, bytes):
+        html_hash = scrapecache.content_hash(html_content)
+    structured = structure_cached(cid, html_hash)
+    if structured is not None:
+        return structured
 
     # scrape
-    try:
-        log.info(f'pid[{mp.current_process().pid}] scraper version 1a: scraping cid: {cid}; with url: {call_url}')
-        print(f'pid[{mp.current_process().pid}] scraper version 1a: scraping cid: {cid}; with url: {call_url}')
-        call_transcript_data = scrape_transcript(html_content)
-    except:
-        log.info(f'pid[{mp.current_process().pid}] scraper version 1b: scraping cid: {cid}; with url: {call_url}')
-        print(f'pid[{mp.current_process().pid}] scraper version 1b: scraping cid: {cid}; with url: {call_url}')
-        call_transcript_data = scrape_transcript_v2(html_content)
-
+    layout, call_transcript_data, scrape_seconds = layouts.scrape(extractors.to_document(html_content))
+    log.info(f'scraped cid: {cid} (layout: {layout}, {scrape_seconds * 1000:.1f}ms); '
+             f'with url: {FoolCalls.EARNINGS_TRANSCRIPTS_ROOT}/{helpers.to_url(cid)}')
+    if html_hash is not None:
+        scrapecache.cache.save(html_hash, layout, call_transcript_data)
+    return to_structured(cid, call_transcript_data, layout, scrape_seconds)
+
+
+def structure_cached(cid: str, html_hash: str):
+    # structure_transcript's result from the scrape cache (neither fetched nor parsed), or None if it isn't cached
+    cached = scrapecache.cache.get(html_hash) if html_hash is not None else None
+    if cached is None:
+        return None
+    layout, call_transcript_data = cached
+    log.info(f'cached cid: {cid} (layout: {layout}, content hash: {html_hash})')
+    return to_structured(cid, call_transcript_data, layout, 0.0, cached=True)
+
+
+def to_structured(cid: str, call_transcript_data: dict, layout: str, scrape_seconds: float,
+                  cached: bool = False) -> dict:
     # add source_metadata
-    output = {'cid': cid, 'call_url': call_url}
+    output = {'cid': cid, 'call_url': f'{FoolCalls.EARNINGS_TRANSCRIPTS_ROOT}/{helpers.to_url(cid)}'}
     output.update(call_transcript_data)
 
-    # upload to s3
     key = f'state=structured/version={FoolCalls.SCRAPER_VERSION}/cid={cid}.json'
-    save_transcript(outputpath, key, output)
+    return {'key': key, 'output': output, 'layout': layout, 'seconds': scrape_seconds, 'cached': cached}
+
+
+def result_of(structured: dict) -> dict:
+    # what a pool worker reports back for a saved transcript (see layouts.record_result)
+    return {'layout': structured['layout'], 'seconds': structured['seconds'], 'cached': structured['cached']}
 
 
-def get_raw_transcript(outputpath, key):
+# ---------------------------------------------------------------------------
+# READ RAW TRANSCRIPTS
+# ---------------------------------------------------------------------------
+# raw transcripts are streamed: compressed chunks are read from the store, decompressed incrementally and fed straight
+# into lxml's feed parser, so the compressed object and the decompressed page are never held in memory in full.
+# gzip and zstd pages (see rawcodecs.py) are told apart by their first bytes, so readers don't need to know the codec
+def get_raw_transcript(outputpath, key, digest=None) -> html.HtmlElement:
+    # digest: a hashlib object, updated with the decompressed page as it streams by (see scrapecache.content_hash)
+    return consume_raw_transcript(outputpath, key, parse_chunks, consume_stage='parse', digest=digest)
+
+
+def get_raw_transcript_bytes(outputpath, key) -> bytes:
+    # decompressed page, for handing to another process (parsed documents can't be pickled)
+    return consume_raw_transcript(outputpath, key, b''.join, consume_stage='decompress')
+
+
+def consume_raw_transcript(outputpath, key, consume, consume_stage, digest=None):
+    # fetch -> decompress -> consume, streamed. the stages interleave, so when spans are on, the time spent pulling chunks
+    # through each one is added up to log one span per stage (fetch, decompress, and consume_stage)
+    if not runlog.spans_enabled():
+        return consume(hashed_chunks(decompress_chunks(outputpath, read_raw_transcript(outputpath, key)), digest))
+
+    # inclusive: pulling a decompressed chunk includes fetching the compressed chunks it came from
+    seconds = {'fetch': 0.0, 'decompress': 0.0}
+    start = time.perf_counter()
+    compressed_chunks = timed_chunks(read_raw_transcript(outputpath, key), seconds, 'fetch')
+    result = consume(hashed_chunks(timed_chunks(decompress_chunks(outputpath, compressed_chunks), seconds, 'decompress'),
+                                   digest))
+    total = time.perf_counter() - start
+
+    stages = {'fetch': seconds['fetch'], 'decompress': seconds['decompress'] - seconds['fetch']}
+    stages[consume_stage] = stages.get(consume_stage, 0.0) + total - seconds['decompress']
+    for stage, stage_seconds in stages.items():
+        runlog.record_span(stage, stage_seconds)
+    return result
+
+
+def timed_chunks(chunks, seconds: dict, stage: str):
+    # adds the time spent producing each chunk to seconds[stage]
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        seconds[stage] += time.perf_counter() - start
+        if chunk is None:
+            return
+        yield chunk
+
+
+def hashed_chunks(chunks, digest):
+    if digest is None:
+        return chunks
+    return (digest.update(chunk) or chunk for chunk in chunks)
+
+
+def read_raw_transcript(outputpath, key):
+    # compressed chunks of a raw transcript; key is a per-cid object or a member of a pack (see shards.py)
+    if shards.parse_member_key(key) is not None:
+        return shards.read_member_chunks(outputpath, key)
     if outputpath == 's3':
-        html_content = get_raw_transcript_from_s3(key)
+        return get_raw_transcript_from_s3(key)
     else:
-        html_content = get_raw_transcript_from_local(outputpath, key)
-
-    return html_content
+        return get_raw_transcript_from_local(outputpath, key)
 
 
 def get_raw_transcript_from_s3(file_path):
-    input_file_buffer = BytesIO()
-    output_file_buffer = BytesIO()
-
-    s3_client = aws_session.client('s3', region_name=Aws.S3_REGION_NAME)
-    s3_client.download_fileobj(Bucket=Aws.S3_FOOLCALLS_BUCKET,
-                               Key=file_path,
-                               Fileobj=input_file_buffer)
-
-    input_file_buffer.seek(0)
-    with gzip.GzipFile(fileobj=input_file_buffer, mode='rb') as gz:
-        shutil.copyfileobj(gz, output_file_buffer)
-
-    return output_file_buffer.getvalue()
+    s3_client = sessions.get_s3_client()
+    response = s3_client.get_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=file_path)
+    yield from response['Body'].iter_chunks(chunk_size=FoolCalls.RAW_READ_CHUNK_SIZE)
 
 
 def get_raw_transcript_from_local(outputpath, file_path):
-    output_file_buffer = BytesIO()
-    with gzip.open(f'{outputpath.rstrip("/")}/{file_path}', 'rb') as f_in:
-        shutil.copyfileobj(f_in, output_file_buffer)
+    with open(f'{outputpath.rstrip("/")}/{file_path}', 'rb') as f_in:
+        yield from iter(partial(f_in.read, FoolCalls.RAW_READ_CHUNK_SIZE), b'')
 
-    return output_file_buffer.getvalue()
+
+def decompress_chunks(outputpath, compressed_chunks):
+    # dispatches on the magic bytes at the start of the stream: zstd frame, or gzip (the default)
+    compressed_chunks = iter(compressed_chunks)
+    first = next(compressed_chunks, b'')
+    if rawcodecs.is_zstd(first):
+        yield from rawcodecs.unzstd_chunks(outputpath, chain([first], compressed_chunks))
+    else:
+        yield from gunzip_chunks(chain([first], compressed_chunks))
+
+
+def gunzip_chunks(compressed_chunks):
+    # incremental gunzip; handles multi-member gzip streams the same way gzip.open does.
+    # each decompressed chunk is capped at RAW_READ_CHUNK_SIZE, however well the page compresses
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    in_member = False
+    for chunk in compressed_chunks:
+        while chunk:
+            in_member = True
+            decompressed = decompressor.decompress(chunk, FoolCalls.RAW_READ_CHUNK_SIZE)
+            if decompressed:
+                yield decompressed
+            if decompressor.eof:
+                # end of a gzip member: anything left over is the start of the next member (checked first: a member
+                # can end right as the output cap is reached, with the next member's bytes also in unconsumed_tail)
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+                in_member = False
+            elif decompressor.unconsumed_tail:
+                chunk = decompressor.unconsumed_tail
+            else:
+                chunk = b''
+
+    if in_member:
+        raise EOFError('compressed file ended before the end-of-stream marker was reached')
+
+
+def parse_chunks(chunks) -> html.HtmlElement:
+    parser = html.HTMLParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
 
 
 def save_transcript(outputpath: str, key: str, output: dict) -> None:
-    if outputpath == 's3':
-        put_transcript_in_s3(key, output)
-    else:
-        save_transcript_local(outputpath, key, output)
+    with runlog.span('serialize'):
+        body = json.dumps(output)
+
+    with runlog.span('upload'):
+        if outputpath == 's3':
+            put_transcript_in_s3(key, body)
+        else:
+            save_transcript_local(outputpath, key, body)
+    manifest.record(outputpath, manifest.structured(), output['cid'], key)
 
 
-def save_transcript_local(outputpath: str, key: str, output: dict) -> None:
+def save_transcript_local(outputpath: str, key: str, body: str) -> None:
     output_path = f'{outputpath.rstrip("/")}/{key}'
-    if not os.path.exists(os.path.dirname(output_path)):
-        os.makedirs(os.path.dirname(output_path))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)  # several threads/processes may get here at once
     with open(output_path, 'w') as f:
-        json.dump(output, f)
-    print(f'wrote: {key} locally to {outputpath}')
+        f.write(body)
+    log.info(f'wrote: {key} locally to {outputpath}')
 
 
-def put_transcript_in_s3(key: str, output: dict) -> None:
-    s3_client = aws_session.client('s3', region_name=Aws.S3_REGION_NAME)
+def put_transcript_in_s3(key: str, body: str) -> None:
+    s3_client = sessions.get_s3_client()
     s3_client.put_object(Bucket=Aws.S3_FOOLCALLS_BUCKET,
                          Key=key,
-                         Body=json.dumps(output))
+                         Body=body)
 
     s3_output_url = f'{Aws.S3_OBJECT_ROOT}/{Aws.S3_FOOLCALLS_BUCKET}/{key}'
-    log.info(f'pid[{mp.current_process().pid}] s3 upload success: {s3_output_url}')
-    print(f'pid[{mp.current_process().pid}] s3 upload success: {s3_output_url}')
+    log.info(f's3 upload success: {s3_output_url}')
 
 
 # ---------------------------------------------------------------------------
 # MAIN
 # ---------------------------------------------------------------------------
-def main(cid, outputpath, key):
+def main(cid, outputpath, key, html_hash=None):
+    # returns process_transcript's result; if the transcript couldn't be scraped, layouts.failed_result's.
+    # html_hash: the page's content hash, if known (see scrapecache.py); a cached transcript isn't even fetched
     try:
-        html_content = get_raw_transcript(outputpath, key)
-        process_transcript(cid, html_content, outputpath)
+        structured = structure_cached(cid, html_hash)
+        if structured is not None:
+            save_transcript(outputpath, structured['key'], structured['output'])
+            return result_of(structured)
+
+        digest = hashlib.sha1()
+        html_doc = get_raw_transcript(outputpath, key, digest)
+        if html_hash is None:
+            scrapecache.record_hash(outputpath, cid, digest.hexdigest(), key)
+        return process_transcript(cid, html_doc, outputpath, digest.hexdigest())
     except Exception as e:
         log.error(f'error: {e}')
+        return layouts.failed_result(e)
 
 
 # ---------------------------------------------------------------------------
@@ -224,4 +357,5 @@ if __name__ == "__main__":
 
     # run main
     main(args.cid, args.key, args.outputpath)
+    manifest.flush(args.outputpath, manifest.structured())
     log.info(f'successfully completed script')
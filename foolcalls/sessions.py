@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import boto3
+from botocore.config import Config
+import requests
+from requests.adapters import HTTPAdapter
+from foolcalls.config import Aws, FoolCalls
+
+log = logging.getLogger(__name__)
+
+
+# ---------------------------------------------------------------------------
+# POOLED HTTP SESSION
+# ---------------------------------------------------------------------------
+# one keep-alive session per process, shared by its threads. connections can't be shared across processes,
+# so a process forked from the multiprocessing pool notices the pid changed and builds its own session
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=FoolCalls.HTTP_POOL_CONNECTIONS,
+                                  pool_maxsize=FoolCalls.HTTP_POOL_MAXSIZE)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session_pid = os.getpid()
+        return _session
+
+
+# ---------------------------------------------------------------------------
+# S3 CLIENT
+# ---------------------------------------------------------------------------
+# building a client (endpoint resolution, credential loading) costs more than a small get/put, so each process
+# builds one and reuses it for every transcript. same per-pid rule as the http session above
+_s3_client = None
+_s3_client_pid = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    global _s3_client, _s3_client_pid
+    with _s3_client_lock:
+        if _s3_client is None or _s3_client_pid != os.getpid():
+            aws_session = boto3.Session(aws_access_key_id=Aws.AWS_KEY,
+                                        aws_secret_access_key=Aws.AWS_SECRET)
+            _s3_client = aws_session.client('s3', region_name=Aws.S3_REGION_NAME,
+                                            config=Config(max_pool_connections=Aws.S3_MAX_POOL_CONNECTIONS))
+            _s3_client_pid = os.getpid()
+        return _s3_client
+
+
+# ---------------------------------------------------------------------------
+# VALIDATOR CACHE (CONDITIONAL GET)
+# ---------------------------------------------------------------------------
+# stores the ETag/Last-Modified validators of a page, along with whatever was extracted from it (payload).
+# the next request for the page sends them back; a 304 means the cached payload is still good,
+# so the page isn't downloaded or parsed again. one small json file per url
+class ValidatorCache:
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def request_url(url: str, params: dict = None) -> str:
+        return requests.Request('GET', url, params=params).prepare().url
+
+    def path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, f'{hashlib.sha1(url.encode()).hexdigest()}.json')
+
+    def load(self, url: str):
+        try:
+            with open(self.path(url)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def conditional_headers(self, url: str) -> dict:
+        entry = self.load(url)
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def payload(self, url: str):
+        # None if there's no entry (anymore) for the url
+        entry = self.load(url)
+        return None if entry is None else entry['payload']
+
+    def save(self, url: str, response: requests.Response, payload) -> None:
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag is None and last_modified is None:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # write-then-rename, so a concurrent reader never sees a partial file
+        tmp_path = f'{self.path(url)}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'url': url, 'etag': etag, 'last_modified': last_modified, 'payload': payload}, f)
+        os.replace(tmp_path, self.path(url))
+
+
+validator_cache = ValidatorCache(FoolCalls.VALIDATOR_CACHE_DIR)
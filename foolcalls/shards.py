@@ -0,0 +1,191 @@
+import gzip
+import json
+import logging
+import os
+import posixpath
+import re
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+from foolcalls.config import Aws, FoolCalls, Local
+from foolcalls import sessions, rawcodecs
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# SHARD FILES (PACKS)
+# ---------------------------------------------------------------------------
+# many transcripts in one large object, instead of one small object per cid. a pack is a concatenation of
+# compressed members, one per transcript, all of the same codec, so it is itself a valid file of the format its
+# extension names (a multi-member gzip file, or a sequence of zstd frames):
+#   state=downloaded/rundate=20200711/pack-<run>-<n>.html.gz         raw pages (the per-cid .gz objects, verbatim)
+#   state=downloaded/rundate=20200711/pack-<run>-<n>.html.zst        raw pages of the zstd-dict codec (the per-cid .zst
+#                                                                    objects, verbatim; see rawcodecs.py)
+#   state=structured/version=202007.1/pack-<run>-<n>.ndjson.gz       one json line per transcript (gzipped ndjson)
+# next to each pack, a sidecar offset index, one "<cid>\t<offset>\t<length>" line per member:
+#   state=structured/version=202007.1/_pack-<run>-<n>.ndjson.gz.index.tsv
+# (names starting with "_" are skipped by athena, so the json tables read per-cid objects and packs alike).
+# a transcript in a pack is addressed by a member key, "<pack key>#<offset>:<length>", which the manifest stores in
+# place of its per-cid key; readers fetch just that byte range (a ranged get on s3) and gunzip it like any other
+# raw transcript. packs are written by compact.py (existing per-cid objects) and by
+# sync_scrapers --output_format packed (new structured transcripts)
+PACK_PREFIX = 'pack-'
+INDEX_PREFIX = '_'
+INDEX_SUFFIX = '.index.tsv'
+RAW_EXTENSIONS = {rawcodecs.GZIP: '.html.gz', rawcodecs.ZSTD_DICT: '.html.zst'}
+NDJSON_EXTENSION = '.ndjson.gz'
+
+RE_MEMBER_KEY = re.compile('^(.+)#(\\d+):(\\d+)$')
+
+
+def member_key(pack_key: str, offset: int, length: int) -> str:
+    return f'{pack_key}#{offset}:{length}'
+
+
+def parse_member_key(key: str):
+    # (pack key, offset, length), or None for a per-cid key
+    match = RE_MEMBER_KEY.match(key)
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2)), int(match.group(3))
+
+
+def raw_extension(member: bytes) -> str:
+    # extension of the packs a raw page goes in, by the codec it was compressed with (told by its magic bytes)
+    return RAW_EXTENSIONS[rawcodecs.ZSTD_DICT if rawcodecs.is_zstd(member) else rawcodecs.GZIP]
+
+
+def index_key(pack_key: str) -> str:
+    partition, name = posixpath.split(pack_key)
+    return posixpath.join(partition, f'{INDEX_PREFIX}{name}{INDEX_SUFFIX}')
+
+
+def is_index(key: str) -> bool:
+    return posixpath.basename(key).startswith(f'{INDEX_PREFIX}{PACK_PREFIX}') and key.endswith(INDEX_SUFFIX)
+
+
+def pack_key_of_index(key: str) -> str:
+    partition, name = posixpath.split(key)
+    return posixpath.join(partition, name[len(INDEX_PREFIX):-len(INDEX_SUFFIX)])
+
+
+# ---------------------------------------------------------------------------
+# WRITE
+# ---------------------------------------------------------------------------
+class PackWriter:
+    # appends members to a pack until it reaches Local.PACK_TARGET_BYTES, then writes it (and its index) to the store
+    # and calls on_pack([(cid, member key), ...]). members are staged in a local file, never in memory.
+    # thread-safe: the pipeline's uploader threads share one writer
+    def __init__(self, outputpath: str, partition: str, extension: str, on_pack=None,
+                 target_bytes: int = Local.PACK_TARGET_BYTES):
+        self.outputpath = outputpath
+        self.partition = partition.rstrip('/')
+        self.extension = extension
+        self.on_pack = on_pack
+        self.target_bytes = target_bytes
+        self.run_id = f'{datetime.now().strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        self.packs = 0
+        self.pack_key = None
+        self.staging_path = None
+        self.file = None
+        self.members = []
+        self.lock = threading.Lock()
+
+    def add_member(self, cid: str, member: bytes) -> None:
+        # member: one complete gzip stream (or zstd frame), of the codec the writer's extension names
+        with self.lock:
+            if self.file is None:
+                self.open()
+            offset = self.file.tell()
+            self.file.write(member)
+            self.members.append((cid, offset, len(member)))
+            if self.file.tell() >= self.target_bytes:
+                self.finish()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.finish()
+
+    def open(self) -> None:
+        self.packs += 1
+        self.pack_key = f'{self.partition}/{PACK_PREFIX}{self.run_id}-{self.packs:05d}{self.extension}'
+        if self.outputpath == 's3':
+            self.file = tempfile.NamedTemporaryFile(prefix=PACK_PREFIX, suffix=self.extension, delete=False)
+        else:
+            # staged next to its final path, and renamed into place once complete
+            pack_path = f'{self.outputpath.rstrip("/")}/{self.pack_key}'
+            os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+            self.file = open(f'{pack_path}.tmp', 'wb')
+        self.staging_path = self.file.name
+
+    def finish(self) -> None:
+        self.file.close()
+        index_body = ''.join(f'{cid}\t{offset}\t{length}\n' for cid, offset, length in self.members).encode()
+        if self.outputpath == 's3':
+            s3_client = sessions.get_s3_client()
+            s3_client.upload_file(self.staging_path, Aws.S3_FOOLCALLS_BUCKET, self.pack_key)
+            s3_client.put_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=index_key(self.pack_key), Body=index_body)
+            os.remove(self.staging_path)
+        else:
+            with open(f'{self.outputpath.rstrip("/")}/{index_key(self.pack_key)}', 'wb') as f:
+                f.write(index_body)
+            os.replace(self.staging_path, f'{self.outputpath.rstrip("/")}/{self.pack_key}')
+        log.info(f'wrote pack {self.pack_key} ({len(self.members)} transcripts) to {self.outputpath}')
+
+        members = [(cid, member_key(self.pack_key, offset, length)) for cid, offset, length in self.members]
+        self.file, self.staging_path, self.members = None, None, []
+        if self.on_pack is not None:
+            self.on_pack(members)
+
+
+def ndjson_member(output: dict) -> bytes:
+    return gzip.compress(json.dumps(output).encode() + b'\n')
+
+
+class NdjsonPackWriter(PackWriter):
+    # structured transcripts -> gzipped ndjson packs (sync_scrapers --output_format packed)
+    def add(self, output: dict) -> None:
+        self.add_member(output['cid'], ndjson_member(output))
+
+
+# ---------------------------------------------------------------------------
+# READ
+# ---------------------------------------------------------------------------
+def read_member_chunks(outputpath: str, key: str):
+    # compressed chunks of one pack member (a gzip stream or zstd frame, see scrapers.decompress_chunks)
+    pack_key, offset, length = parse_member_key(key)
+    if outputpath == 's3':
+        response = sessions.get_s3_client().get_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=pack_key,
+                                                       Range=f'bytes={offset}-{offset + length - 1}')
+        yield from response['Body'].iter_chunks(chunk_size=FoolCalls.RAW_READ_CHUNK_SIZE)
+        return
+
+    with open(f'{outputpath.rstrip("/")}/{pack_key}', 'rb') as f:
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(FoolCalls.RAW_READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise EOFError(f'pack {pack_key} ended before member {offset}:{length}')
+            remaining -= len(chunk)
+            yield chunk
+
+
+def read_index(outputpath: str, key: str) -> list:
+    # [(cid, member key)] of the pack whose sidecar index is <key>
+    if outputpath == 's3':
+        response = sessions.get_s3_client().get_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=key)
+        lines = response['Body'].read().decode().splitlines()
+    else:
+        with open(f'{outputpath.rstrip("/")}/{key}') as f:
+            lines = f.read().splitlines()
+
+    pack_key = pack_key_of_index(key)
+    members = []
+    for line in lines:
+        if line:
+            cid, offset, length = line.split('\t')
+            members.append((cid, member_key(pack_key, int(offset), int(length))))
+    return members
@@ -2,107 +2,273 @@ import os
 from datetime import datetime
 import argparse
 import logging
-from foolcalls.config import Aws, FoolCalls
-from foolcalls import downloaders, scrapers, helpers
-import re
-import glob
+from foolcalls.config import FoolCalls, Local
+from foolcalls import downloaders, scrapers, sync_scrapers, helpers, throttle, manifest, layouts, runlog, scrapecache, \
+    listing, frontier
+import asyncio
+import multiprocessing as mp
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
 log = logging.getLogger(__name__)
 
 
 # ---------------------------------------------------------------------------
-# BUILD A DOWNLOAD QUEUE
+# CRAWL FRONTIER
 # ---------------------------------------------------------------------------
-def build_download_queue(outputpath: str, overwrite: str) -> list:
+# the listing is read page by page while the transcripts already found are downloaded; every page read, download and
+# failure is journaled in the store's crawl state (see frontier.py), so an interrupted run resumes where it stopped
+def frontier_cids(outputpath: str, state: frontier.CrawlState, overwrite: bool, rebuild_manifest: bool = False,
+                  backfill: tuple = None):
+    # generator: cids to download; first the ones a previous run listed and didn't finish, then new ones, as the
+    # listing finds them. backfill: (start date, end date), YYYY-MM-DD; only transcripts published in that window
+    yield from state.pending()
+    if state.listing_done:
+        return
 
     if overwrite:
-        previously_processed_call_urls = []
+        previously_processed_call_urls = set()
     else:
-        previously_processed_call_urls = get_previously_processed_call_urls(outputpath)
-
-    call_urls = get_call_urls(previously_processed_call_urls)
-
-    download_queue = [helpers.to_cid(call_url) for call_url in call_urls]
-
-    log.info(f'***** {len(call_urls)} transcripts have been queued for downloading ***** ')
-    return download_queue
-
-
-def get_previously_processed_call_urls(outputpath: str) -> list:
-    path_prefix = 'state=downloaded/'
-
-    if outputpath == 's3':
-        previously_processed_paths = helpers.list_keys(Bucket=Aws.S3_FOOLCALLS_BUCKET,
-                                                       Prefix=path_prefix,
-                                                       full_path=False,
-                                                       remove_ext=True)
+        previously_processed_call_urls = get_previously_processed_call_urls(outputpath, rebuild_manifest)
+
+    # the listing pages to read are found by searching the listing by publish date (see listing.py), unless every page
+    # is to be read anyway. a resumed crawl keeps the plan it started with
+    pages = listing.ListingPages()
+    if state.plan is None:
+        watermark = get_watermark(outputpath, previously_processed_call_urls)
+        every_page = overwrite or FoolCalls.TRAVERSE_ALL_PAGES_FOR_NEW_URLS
+        state.set_plan(listing.plan_listing(pages, watermark, backfill, every_page))
+
+    for page_num, call_urls in listing.walk(pages, state.plan, previously_processed_call_urls,
+                                            after_page=state.last_page):
+        new_cids = state.listed(page_num, [helpers.to_cid(call_url) for call_url in call_urls])
+        log.info(f'***** {len(new_cids)} transcripts queued from page {page_num} ({len(state.queued)} in all) *****')
+        yield from new_cids
+    state.listing_finished()
+
+
+def get_previously_processed_call_urls(outputpath: str, rebuild_manifest: bool = False) -> set:
+    # previously downloaded cids come from the manifest (see manifest.py), not from listing the whole store
+    if rebuild_manifest:
+        previously_processed_cids = manifest.rebuild(outputpath, manifest.DOWNLOADED)
     else:
-        previously_processed_paths = [re.sub(path_prefix, '', re.sub('\.[^.]+$', '', os.path.basename(key)))
-                                      for key in
-                                      glob.glob(f'{outputpath.rstrip("/")}/{path_prefix.rstrip("/")}/**/*.gz',
-                                                recursive=True)]
+        previously_processed_cids = manifest.load(outputpath, manifest.DOWNLOADED)
 
-    previously_processed_call_urls = []
-    for pp_path in previously_processed_paths:
-        pp_cid = re.sub('rundate=\\d{8}/cid=', '', pp_path)
-        pp_url = f'{FoolCalls.EARNINGS_TRANSCRIPTS_ROOT}/{helpers.to_url(pp_cid)}'
-        previously_processed_call_urls.append(pp_url)
+    previously_processed_call_urls = {f'{FoolCalls.EARNINGS_TRANSCRIPTS_ROOT}/{helpers.to_url(pp_cid)}'
+                                      for pp_cid in previously_processed_cids}
 
     return previously_processed_call_urls
 
 
-# crawl paginated list of call links/urls (i.e. start at page 1, collect links and move to the next page, and so on)
-# as of 2020-07-10, there are 20 links per page.
-# so as to avoid hitting fool.com unnecessarily, the process stops if it reaches a page whose urls are already downloaded.
-# to turn this setting off, set FoolCalls.TRAVERSE_ALL_PAGES_FOR_NEW_URLS (in config.py) to True
-def get_call_urls(previously_processed_call_urls: list = None) -> list:
+def get_watermark(outputpath: str, previously_processed_call_urls: set):
+    # publish date up to which the store is complete; a store without a watermark yet (i.e. synced before there were
+    # watermarks) is taken to be complete up to its newest download, which is what the page-by-page crawl assumed
+    watermark = listing.load_watermark(outputpath)
+    if watermark is not None:
+        return watermark['date']
+    if previously_processed_call_urls:
+        return max(listing.publish_date(call_url) for call_url in previously_processed_call_urls)
+    return None
 
-    if previously_processed_call_urls is None:
-        previously_processed_call_urls = []
 
-    page_num = FoolCalls.START_PAGE
-    new_call_urls = []
-    while page_num <= (FoolCalls.MAX_PAGES or float('inf')):
-
-        this_page_urls = scrapers.scrape_transcript_urls_by_page(page_num=page_num)
-        helpers.sleep_between_requests()
-
-        if this_page_urls is not None:
-
-            # get new urls on the page that weren't already processed
-            this_page_urls_cln = [this_page_url.replace('.aspx','/') for this_page_url in this_page_urls]
-            new_urls_on_this_page = list(set(this_page_urls_cln) - set(previously_processed_call_urls))
-
-            log.info(f'{len(new_urls_on_this_page)} unprocessed urls on page {page_num}')
-            new_call_urls.extend(new_urls_on_this_page)
-            page_num += 1
+# ---------------------------------------------------------------------------
+# MAIN
+# ---------------------------------------------------------------------------
+def main(outputpath, overwrite, scraper_callback, concurrent=False, rebuild_manifest=False, keep_full_page=False,
+         backfill=None):
+    # a crawl started with the same parameters and interrupted is resumed
+    state = frontier.CrawlState.open(outputpath, {'overwrite': bool(overwrite),
+                                                  'backfill': None if backfill is None else list(backfill)})
+    # pages identical to the last one stored for their cid aren't stored again (see scrapecache.py)
+    content_hashes = manifest.load(outputpath, manifest.HASHES)
+
+    # downloaded pages are scraped by a separate process pool, so parsing never holds up the next download
+    scraper_pool = ScraperPool(outputpath) if scraper_callback else None
+    try:
+        cids = frontier_cids(outputpath, state, overwrite, rebuild_manifest, backfill)
+        download_cids(cids, outputpath, state, scraper_pool, concurrent, keep_full_page, content_hashes)
+
+        # failed downloads are retried once the listing is done, up to Local.CRAWL_MAX_ATTEMPTS times in all
+        retry_cids = state.pending()
+        while retry_cids:
+            log.info(f'***** retrying {len(retry_cids)} failed downloads *****')
+            download_cids(retry_cids, outputpath, state, scraper_pool, concurrent, keep_full_page, content_hashes)
+            retry_cids = state.pending()
+
+        if scraper_pool is not None:
+            scraper_pool.close()
+    except BaseException:
+        if scraper_pool is not None:
+            scraper_pool.terminate()
+        raise
+
+    manifest.flush(outputpath, manifest.DOWNLOADED)
+    manifest.flush(outputpath, manifest.HASHES)
+    if scraper_callback:
+        manifest.flush(outputpath, manifest.structured())
+    failures = state.failures()
+    if backfill is None:
+        # a backfill is behind the watermark, so it can't move it
+        listing.advance_watermark(outputpath, state.done, failures)
+    state.finish()
+
+    summary = {'queued': len(state.queued),
+               'downloaded': len(state.done),
+               'unchanged': len(state.unchanged),
+               'failed': len(failures),
+               'resumed': state.resumed,
+               'failures': failures}
+    if scraper_pool is not None:
+        summary['scraped'] = scraper_pool.progress.summary()
+        summary['layouts'] = layouts.get_stats()
+    return summary
+
+
+def download_cids(cids, outputpath: str, state: frontier.CrawlState, scraper_pool=None, concurrent: bool = False,
+                  keep_full_page: bool = False, content_hashes: dict = None) -> None:
+    # downloads an iterable of cids (a list, or the frontier_cids generator), recording each in the crawl state
+    if concurrent:
+        asyncio.run(download_queue_async(cids, outputpath, state, scraper_pool, keep_full_page, content_hashes))
+        return
+
+    content_hashes = content_hashes or {}
+    for cid in cids:
+
+        log.info(f'now downloading {cid} ({len(state.done) + 1} of {len(state.queued)} listed so far)')
 
-            if not FoolCalls.TRAVERSE_ALL_PAGES_FOR_NEW_URLS:
-                if len(new_urls_on_this_page) == 0:
-                    break
-        else:
-            log.info(f'No links found on page {page_num}, indicating no more calls are available')
-            break
+        try:
+            previous_hash, _ = scrapecache.parse_hash_entry(content_hashes.get(cid))
+            dl = downloaders.main(cid, outputpath, scraper_callback=False, keep_full_page=keep_full_page,
+                                  previous_hash=previous_hash)
+            state.completed(cid, dl.stored)
+            if scraper_pool is not None:
+                scraper_pool.submit(dl.cid, dl.html_content, dl.html_hash)
 
-    return new_call_urls
+        except Exception as e:
+            log.error(f'error: {cid}: {e}')
+            state.failed(cid, e)
 
 
 # ---------------------------------------------------------------------------
-# MAIN
+# SCRAPER POOL (--scraper_callback)
 # ---------------------------------------------------------------------------
-def main(outputpath, overwrite, scraper_callback):
-    cid_download_queue = build_download_queue(outputpath, overwrite)
-    for i, cid in enumerate(cid_download_queue):
+# consumer side of download -> scrape: each downloaded page is handed to a process pool that scrapes and saves it,
+# so structured json shows up as soon as a page lands, and downloads keep going at the throttle's pace regardless of
+# how long parsing takes. at most Local.SCRAPE_QUEUE_SIZE pages wait to be scraped; past that, submit() blocks
+# (backpressure), so a stalled pool can't pile up pages in memory
+def scrape_downloaded(cid: str, html_content: bytes, outputpath: str, html_hash: str = None):
+    # runs in the scraper pool
+    try:
+        return scrapers.process_transcript(cid, html_content, outputpath, html_hash)
+    except Exception as e:
+        log.error(f'error: {cid}: {e}')
+        return layouts.failed_result(e)
+
+
+class ScraperPool:
+    def __init__(self, outputpath: str):
+        self.outputpath = outputpath
+        self.slots = threading.BoundedSemaphore(Local.SCRAPE_QUEUE_SIZE)
+        self.progress = sync_scrapers.Progress()
+        processes = mp.cpu_count() if Local.MULTIPROCESS_CPUS is None else Local.MULTIPROCESS_CPUS
+        self.pool = mp.Pool(processes=processes, initializer=sync_scrapers.init_worker,
+                            initargs=(outputpath, runlog.log_queue))
+
+    def submit(self, cid: str, html_content: bytes, html_hash: str = None) -> None:
+        self.slots.acquire()
+        self.pool.apply_async(scrape_downloaded, (cid, html_content, self.outputpath, html_hash),
+                              callback=self.finished, error_callback=lambda e: self.finished(None))
+
+    def finished(self, result) -> None:
+        # called on the pool's result thread
+        self.progress.update(result)
+        layouts.record_result(result)
+        self.slots.release()
+
+    def close(self) -> None:
+        # waits for every submitted page to be scraped
+        self.pool.close()
+        self.pool.join()
+        self.progress.log()
+
+    def terminate(self) -> None:
+        self.pool.terminate()
+        self.pool.join()
 
-        log.info(f'now downloading/scraping {i + 1} of {len(cid_download_queue)}')
 
-        try:
-            downloaders.main(cid, outputpath, scraper_callback)
-            helpers.sleep_between_requests()
-
-        except Exception as e:
-            log.error(f'error: {e}')
+# ---------------------------------------------------------------------------
+# CONCURRENT MODE
+# ---------------------------------------------------------------------------
+# many downloads are in-flight at once, all paced by the same per-host adaptive token bucket (see throttle.py).
+# blocking work (reading listing pages, requests, file/s3 writes, handing pages to the scraper pool) runs in threads.
+# one task reads cids off the frontier into a bounded queue, for one download task per request the limiter lets
+# in-flight (throttle.limiter.max_in_flight, FoolCalls.MAX_CONCURRENT_REQUESTS unless overridden)
+async def download_queue_async(cids, outputpath: str, state: frontier.CrawlState, scraper_pool: ScraperPool = None,
+                               keep_full_page: bool = False, content_hashes: dict = None) -> None:
+    loop = asyncio.get_running_loop()
+    max_in_flight = throttle.limiter.max_in_flight
+    # one more thread than downloads in-flight, for the listing
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max_in_flight + 1))
+
+    content_hashes = content_hashes or {}
+    queue = asyncio.Queue(maxsize=max_in_flight)
+    workers = [asyncio.create_task(download_worker(queue, outputpath, state, scraper_pool, keep_full_page,
+                                                   content_hashes))
+               for _ in range(max_in_flight)]
+    try:
+        cids = iter(cids)
+        while True:
+            # next() may read a listing page
+            cid = await loop.run_in_executor(None, next, cids, None)
+            if cid is None:
+                break
+            await queue.put(cid)
+
+        # workers stop at None, once the cids before it are downloaded
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        # on an interrupt, downloads in-flight are dropped: they're still on the frontier, for the next run
+        for worker in workers:
+            worker.cancel()
+
+
+async def download_worker(queue: asyncio.Queue, outputpath: str, state: frontier.CrawlState,
+                          scraper_pool: ScraperPool = None, keep_full_page: bool = False,
+                          content_hashes: dict = None) -> None:
+    while True:
+        cid = await queue.get()
+        if cid is None:
+            return
+        previous_hash, _ = scrapecache.parse_hash_entry(content_hashes.get(cid))
+        dl = await download_async(cid, outputpath, state, scraper_pool, keep_full_page, previous_hash)
+        if dl is not None:
+            log.info(f'completed {cid} ({len(state.done)} of {len(state.queued)} listed so far)')
+
+
+async def download_async(cid: str, outputpath: str, state: frontier.CrawlState, scraper_pool: ScraperPool = None,
+                         keep_full_page: bool = False, previous_hash: str = None):
+    # returns the downloader, or None if the transcript couldn't be downloaded
+    loop = asyncio.get_running_loop()
+    dl = downloaders.Downloader(cid=cid, outputpath=outputpath, keep_full_page=keep_full_page,
+                                previous_hash=previous_hash)
+    try:
+        async with throttle.limiter.in_flight(dl.call_url):
+            await loop.run_in_executor(None, dl.request_transcript_url)
+        await loop.run_in_executor(None, dl.trim_raw_transcript)
+        await loop.run_in_executor(None, dl.save_raw_transcript)
+        state.completed(cid, dl.stored)
+
+        if scraper_pool is not None:
+            await loop.run_in_executor(None, scraper_pool.submit, dl.cid, dl.html_content, dl.html_hash)
+        return dl
+
+    except Exception as e:
+        log.error(f'error: {cid}: {e}')
+        state.failed(cid, e)
+        return None
 
 
 if __name__ == "__main__":
@@ -111,22 +277,39 @@ if __name__ == "__main__":
     parser.add_argument('outputpath', help=f'where to send output on local machine; if outputpath==\'s3\', output is '
                                            f'uploaded to the Aws.OUPUT_BUCKET variable defined in config.py')
     parser.add_argument('--scraper_callback',
-                        help='whether to invoke the transcript scraper immediately after a file is downloaded; '
+                        help='scrape each transcript as soon as it is downloaded, in a separate process pool; '
                              'otherwise scraping can be run as a separate batch process', action='store_true')
     parser.add_argument('--overwrite', help=f'overwrite transcripts that have already been downloaded to specified '
                                             f'<outputpath>; otherwise it\'s an update (i.e. only download new transcripts)',
                         action='store_true')
+    parser.add_argument('--concurrent', help='download many transcripts at once, paced by the per-host rate limits '
+                                             'in config.py (FoolCalls.MAX_REQUESTS_PER_SECOND, '
+                                             'FoolCalls.MAX_CONCURRENT_REQUESTS)',
+                        action='store_true')
+    parser.add_argument('--rebuild_manifest', '--rebuild-manifest',
+                        help='re-index previously downloaded transcripts by listing the whole <outputpath> store, '
+                             'instead of reading its manifest', action='store_true')
+    parser.add_argument('--keep_full_page',
+                        help='store whole pages as downloaded (e.g. for audit); otherwise only the regions the '
+                             'scrapers read are stored (see extractors.trim_page)', action='store_true')
+    parser.add_argument('--backfill_start', help='with --backfill_end: only download transcripts published in this '
+                                                 'window (YYYY-MM-DD), reading just the listing pages that cover it')
+    parser.add_argument('--backfill_end', help='last publish date (YYYY-MM-DD) of the --backfill_start window')
     args = parser.parse_args()
+    if (args.backfill_start is None) != (args.backfill_end is None):
+        parser.error('--backfill_start and --backfill_end go together')
+    backfill = None if args.backfill_start is None else (args.backfill_start, args.backfill_end)
 
-    # logging (will inherit log calls from utils.pricing and utils.s3_helpers)
+    # logging: every process logs through one queue (see runlog.py); timing spans end up in <log_id>.report.json
     this_file = os.path.basename(__file__).replace('.py', '')
     log_id = f'{this_file}_{datetime.now().strftime("%Y%m%dT%H%M%S")}'
-    logging.basicConfig(filename=f'../logs/{log_id}.log', level=logging.INFO,
-                        format=f'%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    run = runlog.setup(f'../logs/{log_id}.log')
 
     log.info(f'configuration parameters: {FoolCalls.__dict__}')
     log.info(f'input parameters: {args}')
 
     # run main
-    main(args.outputpath, args.overwrite, args.scraper_callback)
+    summary = main(args.outputpath, args.overwrite, args.scraper_callback, args.concurrent, args.rebuild_manifest,
+                   args.keep_full_page, backfill)
     log.info(f'successfully completed script')
+    run.close(summary)
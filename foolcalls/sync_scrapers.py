@@ -2,74 +2,268 @@ import os
 from datetime import datetime
 import argparse
 import logging
-from foolcalls.config import Aws, FoolCalls, Local
-import boto3
-import re
-import glob
-from foolcalls import scrapers, helpers
+from foolcalls.config import FoolCalls, Local
+from foolcalls import scrapers, manifest, layouts, sessions, runlog, parquetstore, shards, scrapecache
 import multiprocessing as mp
+import threading
+import time
+from concurrent import futures
+from functools import partial
 
 log = logging.getLogger(__name__)
 
-aws_session = boto3.Session(aws_access_key_id=Aws.AWS_KEY,
-                            aws_secret_access_key=Aws.AWS_SECRET)
 
-
-def build_scraper_queue(outputpath: str, overwrite: str) -> list:
+def build_scraper_queue(outputpath: str, overwrite: str, rebuild_manifest: bool = False,
+                        structured_state: str = None):
+    # generator: queue items are yielded as they're planned, so the scraper pool can start right away
     log.info('building scraper queue...')
-    if outputpath == 's3':
-        downloaded_paths = helpers.list_keys(Bucket=Aws.S3_FOOLCALLS_BUCKET,
-                                             Prefix='state=downloaded/')
+    structured_state = structured_state or manifest.structured()
+
+    # downloaded and scraped cids come from the manifests (see manifest.py), not from listing the whole store.
+    # the downloaded manifest already keeps only the most recent rundate of each cid
+    if rebuild_manifest:
+        downloaded_keys = manifest.rebuild(outputpath, manifest.DOWNLOADED)
+    else:
+        downloaded_keys = manifest.load(outputpath, manifest.DOWNLOADED)
+
+    if overwrite:
+        previously_scraped_cids = {}
+    elif rebuild_manifest:
+        previously_scraped_cids = manifest.rebuild(outputpath, structured_state)
     else:
-        downloaded_paths = [dp.replace(f'{outputpath.rstrip("/")}/', '')
-                            for dp in glob.glob(f'{outputpath.rstrip("/")}/state=downloaded/**/*.gz')]
-
-    scraper_queue_raw = [{'cid': re.findall('cid=(.*)\\.gz', dl_path)[0],
-                          'key': dl_path}
-                         for dl_path in downloaded_paths]
-
-    # if two cid's exist, use the most recent rundate
-    def drop_duplicates(scraper_queue):
-        result = {}
-        for sc in scraper_queue:
-            sc.update({'rundate': re.findall('rundate=(\\d{8})', sc['key'])[0]})
-            if (sc['cid'] not in result) or sc['rundate'] >= result[sc['cid']]['rundate']:
-                result[sc['cid']] = sc
-
-        return [v for k, v in result.items()]
-
-    scraper_queue = drop_duplicates(scraper_queue_raw)
-
-    if not overwrite:
-        if outputpath == 's3':
-            previously_scraped_cids = helpers.list_keys(Bucket=Aws.S3_FOOLCALLS_BUCKET,
-                                                        Prefix=f'state=structured/'
-                                                               f'version={FoolCalls.SCRAPER_VERSION}/cid=',
-                                                        full_path=False,
-                                                        remove_ext=True)
+        previously_scraped_cids = manifest.load(outputpath, structured_state)
+
+    # content hashes of downloaded pages, so transcripts in the scrape cache are neither fetched nor parsed
+    # (see scrapecache.py); a hash only counts if it was computed from the cid's current key
+    content_hashes = manifest.load(outputpath, manifest.HASHES)
+
+    # both are dicts keyed by cid, so each membership check is O(1)
+    queued = 0
+    for cid, key in downloaded_keys.items():
+        if cid not in previously_scraped_cids:
+            queued += 1
+            yield {'cid': cid, 'key': key, 'hash': scrapecache.hash_of(content_hashes.get(cid), key)}
+
+    log.info(f'queued {queued} transcripts to scrape from {outputpath}')
+
+
+def init_worker(outputpath: str, log_queue=None) -> None:
+    # runs once in each pool process: logging is routed to the run's log queue (see runlog.py), and storage clients
+    # are built here and reused for every transcript the process scrapes (see sessions.get_s3_client)
+    runlog.init_worker(log_queue)
+    if outputpath == 's3':
+        sessions.get_s3_client()
+
+
+def scrape_queue_item(queue_item: dict, outputpath: str):
+    return scrapers.main(queue_item['cid'], outputpath, queue_item['key'], queue_item.get('hash'))
+
+
+class Progress:
+    # tallies results as they arrive, logging a progress line every Local.PROGRESS_LOG_SECONDS
+    def __init__(self):
+        self.succeeded = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self.last_logged = self.start
+        self.lock = threading.Lock()  # updated from the pipeline's uploader threads (see run_pipeline)
+
+    @property
+    def done(self) -> int:
+        return self.succeeded + self.failed
+
+    def update(self, result) -> None:
+        with self.lock:
+            if result is None or result.get('failed'):
+                self.failed += 1
+            else:
+                self.succeeded += 1
+            if time.monotonic() - self.last_logged >= Local.PROGRESS_LOG_SECONDS:
+                self.log()
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.start
+        return {'scraped': self.done,
+                'succeeded': self.succeeded,
+                'failed': self.failed,
+                'seconds': round(elapsed, 1),
+                'per_second': round(self.done / elapsed, 2) if elapsed > 0 else 0.0}
+
+    def log(self) -> None:
+        summary = self.summary()
+        log.info(f'scraped {summary["scraped"]} transcripts ({summary["succeeded"]} succeeded, '
+                 f'{summary["failed"]} failed) in {summary["seconds"]}s; {summary["per_second"]}/sec')
+        self.last_logged = time.monotonic()
+
+
+# ---------------------------------------------------------------------------
+# PIPELINED SCRAPE (--pipeline)
+# ---------------------------------------------------------------------------
+# overlaps store i/o with parsing, instead of each worker doing fetch -> gunzip -> parse -> upload in sequence:
+#   fetch:   Local.PREFETCH_THREADS threads fetch + gunzip raw transcripts, up to Local.PREFETCH_DEPTH pages ahead;
+#            transcripts in the scrape cache (see scrapecache.py) skip the parse pool, and aren't even fetched if
+#            their content hash is already known
+#   parse:   the process pool only parses (scrapers.structure_transcript), so it never waits on the network
+#   upload:  Local.UPLOAD_THREADS threads save the structured output
+# backpressure: a transcript takes one of Local.PIPELINE_MAX_IN_FLIGHT slots when it's handed to the parse pool and
+# gives it back once uploaded, so a slow stage stalls the ones before it instead of piling pages up in memory.
+# with --output_format parquet/packed, the uploaders hand structured outputs to a writer (parquetstore.ParquetWriter,
+# shards.NdjsonPackWriter) instead of saving one object per transcript
+def fetch_queue_item(queue_item: dict, outputpath: str) -> tuple:
+    # (queue item with its content hash, raw page or None, structured output if it was in the scrape cache or None);
+    # (queue item, None, None) if it couldn't be fetched
+    cid, key, html_hash = queue_item['cid'], queue_item['key'], queue_item.get('hash')
+    try:
+        html_content = None
+        if html_hash is None:
+            html_content = scrapers.get_raw_transcript_bytes(outputpath, key)
+            html_hash = scrapecache.content_hash(html_content)
+            scrapecache.record_hash(outputpath, cid, html_hash, key)
+
+        structured = scrapers.structure_cached(cid, html_hash)
+        if structured is None and html_content is None:
+            html_content = scrapers.get_raw_transcript_bytes(outputpath, key)
+        return dict(queue_item, hash=html_hash), html_content, structured
+    except Exception as e:
+        log.error(f'error fetching {key}: {e}')
+        return queue_item, None, None
+
+
+def structure_queue_item(cid: str, html_content: bytes, html_hash: str = None):
+    # runs in the parse pool
+    try:
+        return scrapers.structure_transcript(cid, html_content, html_hash)
+    except Exception as e:
+        log.error(f'error: {e}')
+        return layouts.failed_result(e)
+
+
+def upload_structured(structured: dict, outputpath: str, writer=None):
+    try:
+        if writer is not None:
+            writer.add(structured['output'])
+        else:
+            scrapers.save_transcript(outputpath, structured['key'], structured['output'])
+        return scrapers.result_of(structured)
+    except Exception as e:
+        log.error(f'error uploading {structured["key"]}: {e}')
+        return layouts.failed_result(e, structured['layout'], structured['seconds'])
+
+
+def prefetch(executor, fn, items, depth: int):
+    # like executor.map, except results are yielded as they complete, and no more than <depth> items are
+    # submitted ahead of the consumer
+    pending = set()
+    for item in items:
+        pending.add(executor.submit(fn, item))
+        if len(pending) >= depth:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    for future in futures.as_completed(pending):
+        yield future.result()
+
+
+def run_pipeline(scraper_queue, outputpath: str, progress: Progress, processes: int, writer=None) -> None:
+    slots = threading.BoundedSemaphore(Local.PIPELINE_MAX_IN_FLIGHT)
+    fetcher = futures.ThreadPoolExecutor(max_workers=Local.PREFETCH_THREADS)
+    uploader = futures.ThreadPoolExecutor(max_workers=Local.UPLOAD_THREADS)
+
+    def finished(result) -> None:
+        progress.update(result)
+        layouts.record_result(result)
+        slots.release()
+
+    def parsed(structured) -> None:
+        # called on the pool's result thread (or the main thread, for cached transcripts): hand off to the uploaders
+        # and return right away
+        if structured is None or structured.get('failed'):
+            finished(structured)
         else:
-            previously_scraped_cids = [re.findall('cid=(.*)\\.json', key)[0]
-                                       for key in glob.glob(f'{outputpath.rstrip("/")}/state=structured/'
-                                                            f'version={FoolCalls.SCRAPER_VERSION}/cid=*.json')]
+            uploader.submit(upload_structured, structured, outputpath, writer) \
+                .add_done_callback(lambda future: finished(future.result()))
+
+    pool = mp.Pool(processes=processes, initializer=runlog.init_worker, initargs=(runlog.log_queue,))
+    try:
+        for queue_item, html_content, structured in prefetch(fetcher, partial(fetch_queue_item, outputpath=outputpath),
+                                                             scraper_queue, Local.PREFETCH_DEPTH):
+            if html_content is None and structured is None:
+                progress.update(None)
+                continue
+            slots.acquire()
+            if structured is not None:
+                parsed(structured)
+                continue
+            pool.apply_async(structure_queue_item, (queue_item['cid'], html_content, queue_item['hash']),
+                             callback=parsed, error_callback=lambda e: finished(None))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        fetcher.shutdown()
+        uploader.shutdown()
 
-        scraper_queue = [queue_item for queue_item in scraper_queue
-                         if queue_item['cid'] not in previously_scraped_cids]
 
-    log.info(f'beginning to scrape {len(scraper_queue)} transcripts from {outputpath}')
-    return scraper_queue
+def make_writer(outputpath: str, output_format: str, structured_state: str):
+    # None: one json object per transcript, saved as it's scraped
+    if output_format == 'parquet':
+        return parquetstore.ParquetWriter(outputpath)
+    if output_format == 'packed':
+        def record(members):
+            for cid, key in members:
+                manifest.record(outputpath, structured_state, cid, key)
+        return shards.NdjsonPackWriter(outputpath, structured_state, shards.NDJSON_EXTENSION, on_pack=record)
+    return None
 
 
-def main(outputpath, overwrite):
-    scraper_queue = build_scraper_queue(outputpath, overwrite)
+def main(outputpath, overwrite, rebuild_manifest=False, chunksize=None, pipeline=False, output_format='json'):
+    structured_state = manifest.structured(output_format)
+    writer = make_writer(outputpath, output_format, structured_state)
+    scraper_queue = build_scraper_queue(outputpath, overwrite, rebuild_manifest, structured_state)
+    chunksize = Local.SCRAPE_CHUNKSIZE if chunksize is None else chunksize
+    cpu_count = mp.cpu_count() if Local.MULTIPROCESS_CPUS is None else Local.MULTIPROCESS_CPUS
+    progress = Progress()
 
-    if Local.MULTIPROCESS_ON:
-        mp_inputs = [(sc['cid'], outputpath, sc['key']) for sc in scraper_queue]
-        cpu_count = mp.cpu_count() if Local.MULTIPROCESS_CPUS is None else Local.MULTIPROCESS_CPUS
-        pool = mp.Pool(processes=cpu_count)
-        pool.starmap(scrapers.main, mp_inputs)
+    if pipeline or writer is not None:
+        # parquet parts and packs hold many transcripts, so structured outputs are collected here rather than saved
+        # by each worker; the pipeline already returns them from the parse pool
+        run_pipeline(scraper_queue, outputpath, progress, processes=cpu_count, writer=writer)
+        if writer is not None:
+            writer.close()
+    elif Local.MULTIPROCESS_ON:
+        pool = mp.Pool(processes=cpu_count, initializer=init_worker, initargs=(outputpath, runlog.log_queue))
+        try:
+            # imap pulls from the queue generator as workers free up, instead of materializing every input up front;
+            # results stream back as they finish
+            for result in pool.imap_unordered(partial(scrape_queue_item, outputpath=outputpath), scraper_queue,
+                                              chunksize=chunksize):
+                progress.update(result)
+                # layout counters live in each worker; tally the workers' results (failures too) here
+                layouts.record_result(result)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
     else:
+        init_worker(outputpath)
         for queue_item in scraper_queue:
-            scrapers.main(queue_item['cid'], outputpath, queue_item['key'])
+            result = scrape_queue_item(queue_item, outputpath)
+            progress.update(result)
+            # scraped pages are counted by layouts.scrape, in this process; cache hits aren't scraped
+            if result is not None and result.get('cached'):
+                layouts.record_result(result)
+
+    manifest.flush(outputpath, structured_state)
+    manifest.flush(outputpath, manifest.HASHES)
+    progress.log()
+    log.info(f'page layouts scraped: {layouts.get_stats()}')
+    summary = progress.summary()
+    summary['layouts'] = layouts.get_stats()
+    return summary
 
 
 if __name__ == "__main__":
@@ -79,14 +273,28 @@ if __name__ == "__main__":
                                            f'uploaded to the Aws.OUPUT_BUCKET variable defined in config.py')
     parser.add_argument('--overwrite', help=f'Overwrite parsed transcripts that have already been downloaded to S3',
                         action='store_true')
+    parser.add_argument('--rebuild_manifest', '--rebuild-manifest',
+                        help='re-index downloaded and scraped transcripts by listing the whole <outputpath> store, '
+                             'instead of reading its manifests', action='store_true')
+    parser.add_argument('--chunksize', type=int, default=Local.SCRAPE_CHUNKSIZE,
+                        help='queue items handed to a pool worker at a time')
+    parser.add_argument('--pipeline', help='overlap fetching, parsing and uploading: threads prefetch raw transcripts '
+                                           'and upload results while the process pool only parses',
+                        action='store_true')
+    parser.add_argument('--output_format', choices=['json', 'packed', 'parquet'], default='json',
+                        help='json: one file per transcript (state=structured/); packed: gzipped ndjson packs of '
+                             'many transcripts (state=structured/, see shards.py); parquet: call index, statements '
+                             'and speakers tables partitioned by call year/quarter (state=structured-parquet/, needs '
+                             'pyarrow); packed/parquet imply --pipeline')
     args = parser.parse_args()
 
-    # logging (will inherit log calls from utils.pricing and utils.s3_helpers)
+    # logging: every process logs through one queue (see runlog.py); timing spans end up in <log_id>.report.json
     this_file = os.path.basename(__file__).replace('.py', '')
     log_id = f'{this_file}_{datetime.now().strftime("%Y%m%dT%H%M%S")}'
-    logging.basicConfig(filename=f'./logs/{log_id}.log', level=logging.INFO,
-                        format=f'%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    run = runlog.setup(f'./logs/{log_id}.log')
 
     # run main
-    main(args.outputpath, args.overwrite)
+    summary = main(args.outputpath, args.overwrite, args.rebuild_manifest, args.chunksize, args.pipeline,
+                   args.output_format)
     log.info(f'successfully completed script')
+    run.close(summary)
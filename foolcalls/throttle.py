@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from foolcalls.config import FoolCalls
+from foolcalls import sessions
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# ---------------------------------------------------------------------------
+# TOKEN BUCKET
+# ---------------------------------------------------------------------------
+# tokens refill continuously at <rate> per second, up to <burst> tokens.
+# each request spends one token; if none is available, the caller waits until one would be.
+# reservations are made under a lock, so one bucket can be shared by threads and by the asyncio loop
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        # take a token (possibly one that hasn't refilled yet) and return how long to wait before using it
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self) -> None:
+        wait_seconds = self.reserve()
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+    async def acquire_async(self) -> None:
+        wait_seconds = self.reserve()
+        if wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+
+    def set_rate(self, rate: float) -> None:
+        with self.lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def pause(self, seconds: float) -> None:
+        # push the bucket into debt, so no request (from any thread) goes out for at least <seconds>
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+# ---------------------------------------------------------------------------
+# ADAPTIVE (AIMD) RATE CONTROL
+# ---------------------------------------------------------------------------
+# additive increase while responses are fast and healthy; multiplicative decrease on 429/5xx/latency spikes.
+# decreases are spaced out by at least one request interval, so a burst of failures from requests that
+# were already in-flight only counts once
+class AimdController:
+    def __init__(self, bucket: TokenBucket,
+                 min_rate: float = FoolCalls.MIN_REQUESTS_PER_SECOND,
+                 max_rate: float = FoolCalls.MAX_REQUESTS_PER_SECOND,
+                 increase: float = FoolCalls.RATE_INCREASE,
+                 decrease_factor: float = FoolCalls.RATE_DECREASE_FACTOR,
+                 slow_response_seconds: float = FoolCalls.SLOW_RESPONSE_SECONDS):
+        self.bucket = bucket
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.slow_response_seconds = slow_response_seconds
+        self.last_decrease = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def on_response(self, status_code: int, latency: float) -> None:
+        if status_code == 429 or status_code >= 500:
+            self.slow_down(f'status code {status_code}')
+        elif latency > self.slow_response_seconds:
+            self.slow_down(f'slow response ({latency:.1f}s)')
+        else:
+            self.speed_up()
+
+    def on_error(self, e: Exception) -> None:
+        self.slow_down(f'{type(e).__name__}')
+
+    def speed_up(self) -> None:
+        with self.lock:
+            self.bucket.set_rate(min(self.max_rate, self.rate + self.increase))
+
+    def slow_down(self, reason: str) -> None:
+        with self.lock:
+            now = time.monotonic()
+            if now - self.last_decrease < 1 / self.rate:
+                return
+            self.last_decrease = now
+            self.bucket.set_rate(max(self.min_rate, self.rate * self.decrease_factor))
+        log.warning(f'{reason}: request rate cut to {self.rate:.3f}/sec')
+
+
+# ---------------------------------------------------------------------------
+# PER-HOST RATE LIMITER
+# ---------------------------------------------------------------------------
+# one token bucket + aimd controller (requests/sec) and one in-flight cap per host
+class HostRateLimiter:
+    def __init__(self,
+                 rate: float = FoolCalls.INITIAL_REQUESTS_PER_SECOND,
+                 burst: int = FoolCalls.MAX_REQUEST_BURST,
+                 max_in_flight: int = FoolCalls.MAX_CONCURRENT_REQUESTS,
+                 min_rate: float = FoolCalls.MIN_REQUESTS_PER_SECOND,
+                 max_rate: float = FoolCalls.MAX_REQUESTS_PER_SECOND):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_in_flight = max_in_flight
+        self.controllers = {}
+        self.semaphores = weakref.WeakKeyDictionary()  # event loop -> host -> semaphore
+        self.lock = threading.Lock()
+
+    def controller(self, url: str) -> AimdController:
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.controllers:
+                self.controllers[host] = AimdController(TokenBucket(rate=self.rate, burst=self.burst),
+                                                        min_rate=self.min_rate, max_rate=self.max_rate)
+            return self.controllers[host]
+
+    def semaphore(self, url: str) -> asyncio.Semaphore:
+        # an asyncio semaphore is bound to the event loop it's first waited on, and every download_cids() call runs
+        # a new one (asyncio.run), so each loop gets its own
+        host = urlsplit(url).netloc
+        semaphores = self.semaphores.setdefault(asyncio.get_running_loop(), {})
+        if host not in semaphores:
+            semaphores[host] = asyncio.Semaphore(self.max_in_flight)
+        return semaphores[host]
+
+    @asynccontextmanager
+    async def in_flight(self, url: str):
+        # caps concurrent requests per host in the asyncio download mode; pacing happens in get()
+        async with self.semaphore(url):
+            yield
+
+
+# process-wide limiter shared by every fetcher (listing pages and transcripts)
+limiter = HostRateLimiter()
+
+
+# ---------------------------------------------------------------------------
+# THROTTLED REQUESTS W/ RETRIES
+# ---------------------------------------------------------------------------
+def get(url: str, **kwargs) -> requests.Response:
+    controller = limiter.controller(url)
+    kwargs.setdefault('timeout', FoolCalls.REQUEST_TIMEOUT_SECONDS)
+
+    for attempt in range(FoolCalls.MAX_RETRIES + 1):
+        controller.bucket.acquire()
+        start = time.monotonic()
+        try:
+            response = sessions.get_session().get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            controller.on_error(e)
+            if attempt == FoolCalls.MAX_RETRIES:
+                raise
+            retry_seconds = backoff_seconds(attempt)
+            log.warning(f'{e}; retry {attempt + 1} of {FoolCalls.MAX_RETRIES} in {retry_seconds:.1f} seconds')
+            time.sleep(retry_seconds)
+            continue
+
+        controller.on_response(response.status_code, time.monotonic() - start)
+
+        if response.status_code in RETRY_STATUS_CODES and attempt < FoolCalls.MAX_RETRIES:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                # the server told us when to come back; hold every request to this host until then
+                controller.bucket.pause(retry_after)
+            retry_seconds = retry_after if retry_after is not None else backoff_seconds(attempt)
+            log.warning(f'status code {response.status_code} from {response.url}; '
+                        f'retry {attempt + 1} of {FoolCalls.MAX_RETRIES} in {retry_seconds:.1f} seconds')
+            time.sleep(retry_seconds)
+            continue
+
+        response.raise_for_status()
+        return response
+
+
+def backoff_seconds(attempt: int) -> float:
+    # exponential backoff with full jitter
+    return random.uniform(0, min(FoolCalls.RETRY_BACKOFF_MAX_SECONDS,
+                                 FoolCalls.RETRY_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def parse_retry_after(retry_after: str):
+    # Retry-After is either a number of seconds or an http date
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        # a -0000 zone parses to a naive datetime; http dates are always utc
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,104 @@
+import contextlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+
+
+# ---------------------------------------------------------------------------
+# STUB HTTP SERVER
+# ---------------------------------------------------------------------------
+# a local stand-in for fool.com that answers each path from a script: a list of (status, headers, delay seconds)
+# or (status, headers, delay seconds, body) responses, served in order (the last one repeats).
+# every request is logged as (path, time.monotonic(), request headers); max_in_flight is the most requests it was
+# answering at once
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.scripts = {}
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def root(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def script(self, path: str, *responses) -> str:
+        self.scripts[path] = list(responses)
+        return f'{self.root}{path}'
+
+    def requested(self, path: str) -> list:
+        return [at for requested_path, at, headers in self.requests if requested_path == path]
+
+    def request_headers(self, path: str) -> list:
+        return [headers for requested_path, at, headers in self.requests if requested_path == path]
+
+    def next_response(self, path: str, headers: dict) -> tuple:
+        with self.lock:
+            self.requests.append((path, time.monotonic(), headers))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            responses = self.scripts.get(path, [(404, {}, 0)])
+            return responses.pop(0) if len(responses) > 1 else responses[0]
+
+    def answered(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status, headers, delay, *body = self.server.next_response(self.path, dict(self.headers))
+        time.sleep(delay)
+        body = body[0] if body else f'<html>{status}</html>'.encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.answered()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# ---------------------------------------------------------------------------
+# MOTO S3
+# ---------------------------------------------------------------------------
+# a local stand-in for the foolcalls bucket; helpers.s3_client was made at import, so it's swapped for one made
+# inside the mock
+@contextlib.contextmanager
+def mocked_s3(monkeypatch):
+    moto = pytest.importorskip('moto')
+    import boto3
+    from foolcalls.config import Aws
+    from foolcalls import helpers
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name=Aws.S3_REGION_NAME)
+        client.create_bucket(Bucket=Aws.S3_FOOLCALLS_BUCKET,
+                             CreateBucketConfiguration={'LocationConstraint': Aws.S3_REGION_NAME})
+        monkeypatch.setattr(helpers, 's3_client', client)
+        yield client
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    with mocked_s3(monkeypatch) as client:
+        yield client
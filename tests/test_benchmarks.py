@@ -0,0 +1,26 @@
+import json
+import subprocess
+import sys
+
+
+def bench_scrape(*args) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, '-m', 'benchmarks.bench_scrape', '--number', '2', '--repeat', '2', *args],
+                          capture_output=True, text=True, timeout=300)
+
+
+def test_bench_scrape(tmp_path):
+    corpus = 'output/state=downloaded/rundate=20200711/cid=2020-07-10-*.gz'
+    results_path = str(tmp_path / 'scrape.json')
+    completed = bench_scrape('--corpus', corpus, '--output', results_path)
+    assert completed.returncode == 0, completed.stderr
+    with open(results_path) as f:
+        results = json.load(f)
+    # three sample pages and the synthetic one, all matching the committed structured json
+    assert len(results['pages']) == 4
+    assert all(not page['mismatches'] for page in results['pages'].values())
+    assert results['spans']['scrape_transcript']['count'] == 3 * 2
+
+    completed = bench_scrape('--corpus', corpus, '--output', str(tmp_path / 'again.json'), '--compare', results_path,
+                             '--threshold', '100')
+    assert completed.returncode == 0, completed.stderr
+    assert 'compared to' in completed.stdout
@@ -0,0 +1,48 @@
+import glob
+import gzip
+import os
+import shutil
+import pytest
+from foolcalls import compact, manifest, scrapers, shards
+
+zstd = pytest.importorskip('zstandard')
+
+FIXTURES = sorted(glob.glob('output/state=downloaded/rundate=*/cid=*.gz'))[:4]
+
+
+@pytest.fixture
+def mixed_store(tmp_path):
+    # one partition holding gzip and zstd raw pages
+    partition = tmp_path / 'state=downloaded' / 'rundate=20200711'
+    partition.mkdir(parents=True)
+    pages = {}
+    for i, path in enumerate(FIXTURES):
+        cid = os.path.basename(path)[len('cid='):-len('.gz')]
+        with gzip.open(path, 'rb') as f:
+            pages[cid] = f.read()
+        if i % 2:
+            (partition / f'cid={cid}.zst').write_bytes(zstd.ZstdCompressor().compress(pages[cid]))
+        else:
+            shutil.copy(path, partition)
+    return str(tmp_path), pages
+
+
+def test_packs_are_named_by_codec_and_never_mixed(mixed_store):
+    outputpath, pages = mixed_store
+    summary = compact.main(outputpath, 'downloaded', min_objects=1)
+    assert (summary['packed'], summary['packs']) == (len(pages), 2)
+
+    gzip_packs = glob.glob(f'{outputpath}/state=downloaded/rundate=20200711/pack-*.html.gz')
+    zstd_packs = glob.glob(f'{outputpath}/state=downloaded/rundate=20200711/pack-*.html.zst')
+    assert len(gzip_packs) == len(zstd_packs) == 1
+    # each pack is a valid file of its extension's format
+    with gzip.open(gzip_packs[0], 'rb') as f:
+        assert len(f.read()) == sum(len(pages[cid]) for i, cid in enumerate(pages) if i % 2 == 0)
+    with open(zstd_packs[0], 'rb') as f:
+        reader = zstd.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        assert len(reader.read()) == sum(len(pages[cid]) for i, cid in enumerate(pages) if i % 2)
+
+    keys = manifest.load(outputpath, manifest.DOWNLOADED)
+    for cid, page in pages.items():
+        assert shards.parse_member_key(keys[cid]) is not None
+        assert scrapers.get_raw_transcript_bytes(outputpath, keys[cid]) == page
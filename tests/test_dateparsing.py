@@ -0,0 +1,27 @@
+import pytest
+from dateutil import parser
+from foolcalls import dateparsing
+
+
+@pytest.mark.parametrize('text, ignoretz', [('Jan 27, 2020 at 11:00PM', False),
+                                            ('July 15, 2020 at 8:30AM', False),
+                                            ('Jul 15, 2020', False),
+                                            ('September 30, 2020', False),
+                                            ('2020-07-15 5:00 p.m. ET', True),
+                                            ('2020-07-15 10:30 a.m. EDT', True),
+                                            ('2020-07-15', False)])
+def test_fast_path_matches_dateutil(text, ignoretz):
+    fallbacks = sum(dateparsing.fallback_counts.values())
+    assert dateparsing.parse(text, ignoretz=ignoretz) == parser.parse(text, ignoretz=ignoretz)
+    assert sum(dateparsing.fallback_counts.values()) == fallbacks
+
+
+def test_unknown_shapes_fall_back_to_dateutil():
+    text = '15th of July 2020'
+    assert dateparsing.parse(text) == parser.parse(text)
+    assert dateparsing.fallback_counts[dateparsing.shape(text)] >= 1
+
+
+def test_empty_text_is_an_error():
+    with pytest.raises(ValueError):
+        dateparsing.parse('  ')
@@ -0,0 +1,84 @@
+import glob
+import gzip
+import pytest
+from lxml import html
+from foolcalls import extractors
+
+FIXTURES = sorted(glob.glob('output/state=downloaded/rundate=*/cid=*.gz'))
+ARTICLE_BODY = './/section[@class="usmf-new article-body"]/span[@class="article-content"]'
+
+
+# ---------------------------------------------------------------------------
+# SECTION SEGMENTER
+# ---------------------------------------------------------------------------
+# the xpaths segment_article_body replaced, as the reference it must agree with
+def findall(article_body, xpath):
+    elements = article_body.xpath(xpath)
+    if len(elements) == 0:
+        raise Exception(f'no elements for {xpath}')
+    return elements
+
+
+def xpath_segments(article_body) -> dict:
+    header = findall(article_body, './h2[text()="Contents:"]/preceding-sibling::p')
+    try:
+        pres = findall(article_body, './h2[text()[contains(.,"Prepared")]]'
+                                     '/following-sibling::h2[text()[contains(.,"Questions")]]'
+                                     '/preceding-sibling::p[preceding-sibling::h2[text()[contains(.,"Prepared")]]]')
+    except Exception:
+        pres = findall(article_body, './h2[text()[contains(.,"Prepared")]]'
+                                     '/following-sibling::p[strong/text()[contains(.,"Questions")]]'
+                                     '/preceding-sibling::p[preceding-sibling::h2[text()[contains(.,"Prepared")]]]')
+    try:
+        qa = findall(article_body, './h2[text()[contains(.,"Questions")]]'
+                                   '/following-sibling::h2[text()[contains(.,"Call")]]'
+                                   '/preceding-sibling::p[preceding-sibling::h2[text()[contains(.,"Questions")]]]')
+    except Exception:
+        qa = findall(article_body, './p[strong/text()[contains(.,"Questions")]]'
+                                   '/following-sibling::p[strong/text()[contains(.,"Call")]]'
+                                   '/preceding-sibling::p[preceding-sibling::p[strong/text()[contains(.,"Questions")]]]')
+    return {'header': header, 'pres': pres, 'qa': qa[:-1], 'duration': qa[-1]}
+
+
+@pytest.mark.parametrize('path', FIXTURES)
+def test_segments_match_the_xpaths_on_fixtures(path):
+    with gzip.open(path, 'rb') as f:
+        article_body = html.fromstring(f.read()).xpath(ARTICLE_BODY)[0]
+    assert extractors.segment_article_body(article_body) == xpath_segments(article_body)
+
+
+H2_QUESTIONS = '<h2>Questions and Answers:</h2>'
+H2_CALL = '<h2>Call participants:</h2>'
+P_QUESTIONS = '<p><strong>Questions and Answers:</strong></p>'
+P_CALL = '<p><strong>Call participants:</strong></p>'
+
+
+@pytest.mark.parametrize('questions, call', [(H2_QUESTIONS, H2_CALL), (P_QUESTIONS, P_CALL), (H2_QUESTIONS, P_CALL),
+                                             (P_QUESTIONS, H2_CALL)])
+@pytest.mark.parametrize('contents', ['<h2>Contents:</h2>', ''])
+def test_segments_match_the_xpaths_on_marker_variants(questions, call, contents):
+    article_body = html.fragment_fromstring(
+        f'<span><p>Company (TICKER) Q2 2020 Earnings Call</p><p>Jul 10, 2020</p>{contents}'
+        f'<h2>Prepared Remarks:</h2><p>Operator</p><p>Welcome.</p>{questions}<p>Operator</p><p>First question.</p>'
+        f'<p>Duration: 30 minutes</p>{call}<p>Operator</p></span>')
+    try:
+        expected = xpath_segments(article_body)
+    except Exception:
+        with pytest.raises(Exception):
+            extractors.segment_article_body(article_body)
+        return
+    assert extractors.segment_article_body(article_body) == expected
+
+
+# ---------------------------------------------------------------------------
+# ARTICLE-ONLY PAGES
+# ---------------------------------------------------------------------------
+@pytest.mark.parametrize('path', FIXTURES[:3])
+def test_trimmed_pages_are_marked(path):
+    with gzip.open(path, 'rb') as f:
+        page = f.read()
+    assert not extractors.is_trimmed(extractors.to_document(page))
+    trimmed = extractors.trim_page(page)
+    assert extractors.is_trimmed(extractors.to_document(trimmed))
+    # trimming is idempotent, so a trimmed page needn't be trimmed again
+    assert extractors.trim_page(trimmed) == trimmed
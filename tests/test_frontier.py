@@ -0,0 +1,61 @@
+from foolcalls import frontier
+from foolcalls.config import Local
+
+PARAMS = {'overwrite': False, 'backfill': None}
+
+
+def test_resume_picks_up_the_frontier(tmp_path):
+    state = frontier.CrawlState.open(str(tmp_path), PARAMS)
+    state.set_plan({'first_page': 1})
+    assert state.listed(1, ['a', 'b', 'c']) == ['a', 'b', 'c']
+    state.completed('a')
+    state.failed('b', 'boom')
+
+    resumed = frontier.CrawlState.open(str(tmp_path), PARAMS)
+    assert resumed.resumed
+    assert resumed.last_page == 1
+    assert resumed.plan == {'first_page': 1}
+    assert resumed.pending() == ['b', 'c']
+    assert resumed.listed(2, ['c', 'd']) == ['d']
+
+
+def test_retries_give_up_after_max_attempts(tmp_path):
+    state = frontier.CrawlState.open(str(tmp_path), PARAMS)
+    state.listed(1, ['a'])
+    for _ in range(Local.CRAWL_MAX_ATTEMPTS):
+        assert state.pending() == ['a']
+        state.failed('a', 'boom')
+    assert state.pending() == []
+    assert state.failures() == {'a': {'attempts': Local.CRAWL_MAX_ATTEMPTS, 'error': 'boom'}}
+
+
+def test_other_params_start_a_new_crawl(tmp_path):
+    state = frontier.CrawlState.open(str(tmp_path), PARAMS)
+    state.listed(1, ['a'])
+
+    other = frontier.CrawlState.open(str(tmp_path), {'overwrite': True, 'backfill': None})
+    assert not other.resumed
+    assert other.pending() == []
+
+
+def test_torn_last_line_does_not_swallow_the_next_event(tmp_path):
+    state = frontier.CrawlState.open(str(tmp_path), PARAMS)
+    state.listed(1, ['x', 'y', 'z'])
+    state.completed('x')
+    with open(state.path, 'a') as f:
+        f.write('{"event": "done", "cid": "z", "st')  # crash mid-write
+
+    resumed = frontier.CrawlState.open(str(tmp_path), PARAMS)
+    assert resumed.pending() == ['y', 'z']
+    resumed.completed('y')
+    resumed.listed(2, ['w'])
+
+    reopened = frontier.CrawlState.open(str(tmp_path), PARAMS)
+    assert reopened.pending() == ['z', 'w']
+    assert reopened.last_page == 2
+
+
+def test_finish_removes_the_journal(tmp_path):
+    state = frontier.CrawlState.open(str(tmp_path), PARAMS)
+    state.finish()
+    assert not frontier.CrawlState.open(str(tmp_path), PARAMS).resumed
@@ -0,0 +1,50 @@
+import threading
+import time
+import pytest
+from foolcalls.config import Aws
+from foolcalls import helpers
+from conftest import mocked_s3
+
+PREFIX = 'state=downloaded/'
+# rundate=20200711/ spans several list_objects_v2 pages; 6,001 keys in all, plus a root key and a directory marker
+PARTITION_SIZES = {'rundate=20200711/': 2500, 'rundate=20200712/': 1001, 'rundate=20200713/': 2499}
+
+
+@pytest.fixture(scope='module')
+def keys():
+    # filled once: putting 6,001 objects into moto takes a while
+    with pytest.MonkeyPatch.context() as monkeypatch, mocked_s3(monkeypatch) as s3:
+        yield fill(s3)
+
+
+def fill(s3) -> list:
+    keys = [f'{PREFIX}{partition}cid={i}.gz' for partition, size in PARTITION_SIZES.items() for i in range(size)]
+    keys.append(f'{PREFIX}cid=root.gz')
+    for key in keys + [f'{PREFIX}rundate=20200711/']:
+        s3.put_object(Bucket=Aws.S3_FOOLCALLS_BUCKET, Key=key, Body=b'')
+    return keys
+
+
+def test_lists_every_key_once(keys):
+    listed = list(helpers.list_keys_parallel(Aws.S3_FOOLCALLS_BUCKET, PREFIX, max_workers=2))
+    assert len(listed) == len(keys) == 6001
+    assert sorted(listed) == sorted(keys)
+    assert sorted(helpers.list_keys_parallel(Aws.S3_FOOLCALLS_BUCKET, PREFIX, Suffix='.gz', full_path=False,
+                                             remove_ext=True)) == \
+        sorted(helpers.list_keys(Aws.S3_FOOLCALLS_BUCKET, PREFIX, Suffix='.gz', full_path=False, remove_ext=True))
+
+
+def test_closing_early_stops_the_workers(keys):
+    # a full listing is 9 list_objects_v2 calls: the partitions, then 3 + 2 + 3 pages
+    calls = []
+    helpers.s3_client.meta.events.register('before-call.s3.ListObjectsV2', lambda **kwargs: calls.append(1))
+    threads = set(threading.enumerate())
+    listed = helpers.list_keys_parallel(Aws.S3_FOOLCALLS_BUCKET, PREFIX, max_workers=1)
+    assert len([next(listed) for _ in range(10)]) == 10
+    listed.close()
+
+    # the worker has exited (after the page it was fetching), and nothing else gets listed
+    assert set(threading.enumerate()) <= threads
+    calls_at_close = len(calls)
+    time.sleep(1.5)
+    assert len(calls) == calls_at_close < 9
@@ -0,0 +1,118 @@
+from datetime import date, timedelta
+import pytest
+from foolcalls.config import FoolCalls
+from foolcalls import listing, scrapers
+
+
+def call_url(day: date, i: int) -> str:
+    return f'{FoolCalls.EARNINGS_TRANSCRIPTS_ROOT}/{day:%Y/%m/%d}/call-{i}.aspx'
+
+
+@pytest.fixture
+def listing_pages(monkeypatch):
+    # a fake listing: <pages> pages of two transcripts a day, three per page, newest (2020-07-31) first.
+    # returns (ListingPages, [page numbers requested])
+    def make(pages: int):
+        urls = [call_url(date(2020, 7, 31) - timedelta(days=i // 2), i) for i in range(3 * pages)]
+        requested = []
+
+        def scrape_transcript_urls_by_page(page_num):
+            requested.append(page_num)
+            return urls[3 * (page_num - 1):3 * page_num] or None
+
+        monkeypatch.setattr(scrapers, 'scrape_transcript_urls_by_page', scrape_transcript_urls_by_page)
+        return listing.ListingPages(), requested
+    return make
+
+
+def walked_dates(pages, plan) -> list:
+    return [listing.publish_date(url) for page_num, urls in listing.walk(pages, plan) for url in urls]
+
+
+def test_empty_listing(listing_pages):
+    pages, requested = listing_pages(0)
+    plan = listing.plan_listing(pages, watermark='2020-07-01')
+    assert plan['last_page'] == 1
+    assert walked_dates(pages, plan) == []
+    assert walked_dates(pages, listing.plan_listing(pages)) == []
+    assert requested == [1]
+
+
+def test_watermark_on_page_1(listing_pages):
+    # page 1: 07-31, 07-31, 07-30; page 2: 07-30, 07-29, 07-29
+    pages, requested = listing_pages(10)
+    plan = listing.plan_listing(pages, watermark='2020-07-31')
+    assert plan['last_page'] == 1
+    assert walked_dates(pages, plan) == ['2020-07-31', '2020-07-31']
+
+    # same-day transcripts on the next page are listed too
+    plan = listing.plan_listing(listing.ListingPages(), watermark='2020-07-30')
+    assert plan['last_page'] == 2
+    assert walked_dates(pages, plan) == ['2020-07-31', '2020-07-31', '2020-07-30', '2020-07-30']
+
+
+@pytest.mark.parametrize('last_page', [1, 2, 5, 16, 17])
+def test_watermark_inside_the_listing(listing_pages, last_page):
+    pages, requested = listing_pages(40)
+    # the oldest transcript of page <last_page> is a day older than the watermark
+    watermark = (date(2020, 7, 31) - timedelta(days=(3 * last_page - 1) // 2 - 1)).isoformat()
+    plan = listing.plan_listing(pages, watermark=watermark)
+    assert plan['last_page'] == last_page
+    assert pages.reaches_back_past(last_page, watermark)
+    assert last_page == 1 or not pages.reaches_back_past(last_page - 1, watermark)
+    assert len(set(requested)) <= 2 * last_page.bit_length() + 1
+
+
+def test_watermark_beyond_the_last_page(listing_pages):
+    # every listed transcript is newer than the watermark: the search runs off the end of the listing
+    pages, requested = listing_pages(5)
+    plan = listing.plan_listing(pages, watermark='2019-01-01')
+    assert plan['last_page'] == 6
+    assert len(walked_dates(pages, plan)) == 15
+    # probes past the end of the listing come back empty; no page is requested twice
+    assert sorted(set(requested)) == sorted(requested)
+
+
+def test_watermark_beyond_the_last_page_stops_at_max_pages(listing_pages, monkeypatch):
+    monkeypatch.setattr(FoolCalls, 'MAX_PAGES', 3)
+    pages, requested = listing_pages(5)
+    plan = listing.plan_listing(pages, watermark='2019-01-01')
+    assert plan['last_page'] == 3
+    assert len(walked_dates(pages, plan)) == 9
+    assert max(requested) == 3
+
+
+def test_missing_watermark(listing_pages, tmp_path):
+    assert listing.load_watermark(str(tmp_path)) is None
+    pages, requested = listing_pages(5)
+    plan = listing.plan_listing(pages, watermark=None)
+    assert (plan['last_page'], plan['start_date'], plan['stop_when_processed']) == (None, None, True)
+    # pages are walked until one has nothing new on it
+    processed = {url.replace('.aspx', '/') for url in pages.urls(3)}
+    walked = [page_num for page_num, urls in listing.walk(pages, plan, processed)]
+    assert walked == [1, 2, 3]
+
+
+def test_next_watermark():
+    assert listing.next_watermark(None, [], []) is None
+    assert listing.next_watermark('2020-07-01', [], []) == '2020-07-01'
+    assert listing.next_watermark(None, ['2020-07-10-a', '2020-07-12-b'], []) == '2020-07-12'
+    assert listing.next_watermark('2020-07-20', ['2020-07-10-a'], []) == '2020-07-20'
+    # held back to the oldest failed download, so the next run lists it again
+    assert listing.next_watermark('2020-07-01', ['2020-07-10-a', '2020-07-12-b'], ['2020-07-11-c']) == '2020-07-11'
+
+
+def test_advance_watermark(tmp_path):
+    outputpath = str(tmp_path)
+    listing.advance_watermark(outputpath, [], [])
+    assert listing.load_watermark(outputpath) is None
+
+    listing.advance_watermark(outputpath, ['2020-07-10-a', '2020-07-12-b'], ['2020-07-11-c'])
+    assert (listing.load_watermark(outputpath)['date'], listing.load_watermark(outputpath)['cid']) == \
+        ('2020-07-11', '2020-07-10-a')
+    listing.advance_watermark(outputpath, ['2020-07-11-c'], [])
+    assert (listing.load_watermark(outputpath)['date'], listing.load_watermark(outputpath)['cid']) == \
+        ('2020-07-11', '2020-07-10-a')
+    listing.advance_watermark(outputpath, ['2020-07-13-d'], [])
+    assert (listing.load_watermark(outputpath)['date'], listing.load_watermark(outputpath)['cid']) == \
+        ('2020-07-13', '2020-07-13-d')
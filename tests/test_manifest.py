@@ -0,0 +1,55 @@
+import pytest
+from foolcalls.config import Local
+from foolcalls import manifest
+
+STATE = manifest.structured()
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(Local, 'MANIFEST_JOURNAL_DIR', str(tmp_path))
+
+
+def test_flush_merges_the_journal_into_s3(s3, journal):
+    manifest.record('s3', STATE, 'cid-a', 'key-a')
+    manifest.record('s3', STATE, 'cid-b', 'key-b')
+    manifest.flush('s3', STATE)
+    manifest.record('s3', STATE, 'cid-b', 'key-b2')
+    manifest.flush('s3', STATE)
+    assert manifest.read_s3(STATE) == {'cid-a': 'key-a', 'cid-b': 'key-b2'}
+
+
+@pytest.mark.parametrize('first_write', [False, True])
+def test_concurrent_writes_keep_both_runs_lines(s3, journal, monkeypatch, first_write):
+    if not first_write:
+        manifest.update('s3', STATE, {'cid-old': 'key-old'})
+    read_s3_with_etag = manifest.read_s3_with_etag
+    reads = []
+
+    def read_then_lose_the_race(state):
+        read = read_s3_with_etag(state)
+        reads.append(read)
+        if len(reads) == 1:
+            # another run (e.g. a compaction) writes between this run's read and put
+            monkeypatch.setattr(manifest, 'read_s3_with_etag', read_s3_with_etag)
+            manifest.merge_s3(state, {'cid-other': 'key-other'})
+            monkeypatch.setattr(manifest, 'read_s3_with_etag', read_then_lose_the_race)
+        return read
+
+    monkeypatch.setattr(manifest, 'read_s3_with_etag', read_then_lose_the_race)
+    manifest.record('s3', STATE, 'cid-mine', 'key-mine')
+    manifest.flush('s3', STATE)
+
+    assert len(reads) == 2
+    expected = {'cid-mine': 'key-mine', 'cid-other': 'key-other'}
+    if not first_write:
+        expected['cid-old'] = 'key-old'
+    assert manifest.read_s3(STATE) == expected
+
+
+def test_gives_up_when_always_rewritten(s3, journal, monkeypatch):
+    monkeypatch.setattr(manifest.Aws, 'S3_MANIFEST_WRITE_ATTEMPTS', 2)
+    monkeypatch.setattr(manifest.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(manifest, 'read_s3_with_etag', lambda state: ({}, '"stale"'))
+    with pytest.raises(Exception, match='rewritten by other runs'):
+        manifest.update('s3', STATE, {'cid-a': 'key-a'})
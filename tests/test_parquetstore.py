@@ -0,0 +1,26 @@
+import pytest
+from foolcalls import parquetstore, manifest
+
+
+def transcript(cid, call_date):
+    return {'cid': cid, 'call_date': call_date, 'call_transcript': [], 'participants': {}}
+
+
+@pytest.mark.parametrize('call_date, expected', [('2020-04-30', (2020, 2)),
+                                                 ('', (2020, 3)),  # no date line in the header
+                                                 ('2020-04-302020-05-01', (2020, 3)),  # two date lines
+                                                 (None, (2020, 3))])
+def test_partition_falls_back_to_the_publish_date(call_date, expected):
+    assert parquetstore.partition(transcript('2020-07-10-acme-q2', call_date)) == expected
+
+
+def test_transcript_without_call_date_is_written_and_recorded(tmp_path):
+    pytest.importorskip('pyarrow')
+    outputpath = str(tmp_path)
+    writer = parquetstore.ParquetWriter(outputpath)
+    writer.add(transcript('2020-07-10-acme-q2', ''))
+    writer.close()
+
+    entries = manifest.load(outputpath, manifest.structured('parquet'))
+    assert '/call_year=2020/call_quarter=3/' in entries['2020-07-10-acme-q2']
+    assert (tmp_path / entries['2020-07-10-acme-q2']).exists()
@@ -0,0 +1,37 @@
+import json
+import logging
+import multiprocessing as mp
+from foolcalls import runlog
+
+
+def work(i: int) -> int:
+    with runlog.span('work'):
+        logging.getLogger('foolcalls.test').info(f'working on {i}')
+    return i
+
+
+def test_pool_workers_log_through_the_run(tmp_path):
+    run = runlog.setup(str(tmp_path / 'logs' / 'run.log'))
+    with runlog.span('parent'):
+        pass
+    with mp.Pool(2, initializer=runlog.init_worker, initargs=(runlog.log_queue,)) as pool:
+        assert pool.map(work, range(10)) == list(range(10))
+    report = run.close({'done': 10})
+
+    assert report['spans']['work']['count'] == 10
+    assert report['spans']['parent']['count'] == 1
+    with open(run.report_path) as f:
+        assert json.load(f)['summary'] == {'done': 10}
+    # span records go to the report, not the log file
+    with open(tmp_path / 'logs' / 'run.log') as f:
+        lines = f.read().splitlines()
+    assert sum('working on' in line for line in lines) == 10
+    assert not any('foolcalls.spans' in line for line in lines)
+    assert not runlog.spans_enabled()
+
+
+def test_percentiles_are_nearest_rank():
+    collector = runlog.SpanCollector()
+    collector.seconds['x'] = [i / 1000 for i in range(1, 101)]
+    stats = collector.percentiles()['x']
+    assert (stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['max_ms']) == (100, 50, 95, 99, 100)
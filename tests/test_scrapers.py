@@ -0,0 +1,107 @@
+import glob
+import gzip
+import json
+import os
+import pytest
+from foolcalls.config import FoolCalls
+from foolcalls import scrapers, sessions, throttle
+
+LISTING_PAGE = (b'<html><body><div class="content-block listed-articles recent-articles m-np">'
+                b'<div class="list-content"><a href="/earnings/call-transcripts/2020/07/10/a.aspx">a</a></div>'
+                b'</div></body></html>')
+CALL_URLS = ['/earnings/call-transcripts/2020/07/10/a.aspx']
+
+
+@pytest.fixture
+def listing(stub_server, tmp_path, monkeypatch):
+    # the listing redirects, as fool.com's does, so response.url isn't the url requested
+    monkeypatch.setattr(throttle, 'limiter', throttle.HostRateLimiter(rate=100))
+    monkeypatch.setattr(sessions, 'validator_cache', sessions.ValidatorCache(str(tmp_path / 'validators')))
+    monkeypatch.setattr(FoolCalls, 'ROOT', stub_server.root)
+    monkeypatch.setattr(FoolCalls, 'EARNINGS_LINKS_ROOT', f'{stub_server.root}/listing')
+    stub_server.script('/listing?page=1', (301, {'Location': '/listing/?page=1'}, 0))
+    return stub_server
+
+
+def expected_urls(stub_server) -> list:
+    return [f'{stub_server.root}{url}' for url in CALL_URLS]
+
+
+def test_validators_are_sent_after_a_redirect(listing):
+    listing.script('/listing/?page=1', (200, {'ETag': '"v1"'}, 0, LISTING_PAGE), (304, {'ETag': '"v1"'}, 0, b''))
+    assert scrapers.scrape_transcript_urls_by_page(1) == expected_urls(listing)
+    assert scrapers.scrape_transcript_urls_by_page(1) == expected_urls(listing)
+
+    first, second = listing.request_headers('/listing?page=1')
+    assert 'If-None-Match' not in first
+    assert second['If-None-Match'] == '"v1"'
+
+
+def test_304_without_a_cache_entry_falls_back_to_a_full_get(listing):
+    listing.script('/listing/?page=1', (200, {'ETag': '"v1"'}, 0, LISTING_PAGE), (304, {'ETag': '"v1"'}, 0, b''),
+                   (200, {'ETag': '"v1"'}, 0, LISTING_PAGE))
+    scrapers.scrape_transcript_urls_by_page(1)
+    # the entry is gone by the time the 304 comes back
+    validators = sessions.validator_cache
+    conditional_headers = validators.conditional_headers
+
+    def send_then_forget(url):
+        headers = conditional_headers(url)
+        validators.cache_dir += '-cleared'
+        return headers
+
+    validators.conditional_headers = send_then_forget
+    assert scrapers.scrape_transcript_urls_by_page(1) == expected_urls(listing)
+    assert 'If-None-Match' not in listing.request_headers('/listing?page=1')[-1]
+
+
+# ---------------------------------------------------------------------------
+# SCRAPE OUTPUT
+# ---------------------------------------------------------------------------
+# tests/fixtures/scraped holds what the original scraper made of each output/state=downloaded page; a faster scraper
+# has to make the same
+RAW_FIXTURES = sorted(glob.glob('output/state=downloaded/rundate=*/cid=*.gz'))
+
+
+def cid_of(path: str) -> str:
+    return os.path.basename(path)[len('cid='):-len('.gz')]
+
+
+def scraped_fixture(cid: str) -> dict:
+    with gzip.open(f'tests/fixtures/scraped/cid={cid}.json.gz') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('path', RAW_FIXTURES)
+def test_scrape_matches_the_original_scraper(path):
+    with gzip.open(path, 'rb') as f:
+        output = scrapers.scrape_transcript(f.read())
+    assert json.loads(json.dumps(output)) == scraped_fixture(cid_of(path))
+
+
+# ---------------------------------------------------------------------------
+# STREAMED RAW TRANSCRIPTS
+# ---------------------------------------------------------------------------
+def test_streamed_page_scrapes_the_same(monkeypatch):
+    monkeypatch.setattr(FoolCalls, 'RAW_READ_CHUNK_SIZE', 4096)
+    path = RAW_FIXTURES[0]
+    outputpath, key = path.split('/state=')[0], 'state=' + path.split('/state=')[1]
+    with gzip.open(path, 'rb') as f:
+        page = f.read()
+    assert scrapers.get_raw_transcript_bytes(outputpath, key) == page
+    output = scrapers.scrape_transcript(scrapers.get_raw_transcript(outputpath, key))
+    assert json.loads(json.dumps(output)) == scraped_fixture(cid_of(path))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 100, 1 << 20])
+def test_gunzip_chunks(chunk_size, monkeypatch):
+    monkeypatch.setattr(FoolCalls, 'RAW_READ_CHUNK_SIZE', 1000)
+    # multi-member, like gzip.open reads it
+    compressed = gzip.compress(b'a' * 50000) + gzip.compress(b'b' * 10)
+    chunks = [compressed[i:i + chunk_size] for i in range(0, len(compressed), chunk_size)]
+    decompressed = list(scrapers.gunzip_chunks(chunks))
+    assert b''.join(decompressed) == b'a' * 50000 + b'b' * 10
+    assert max(len(chunk) for chunk in decompressed) <= 1000
+
+    with pytest.raises(EOFError):
+        list(scrapers.gunzip_chunks([compressed[:-5]]))
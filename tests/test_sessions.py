@@ -0,0 +1,26 @@
+import pytest
+from foolcalls import sessions
+
+
+@pytest.fixture
+def pid(monkeypatch):
+    # the pid sessions sees, e.g. as in a forked pool worker
+    pid = {'now': 1000}
+    monkeypatch.setattr(sessions.os, 'getpid', lambda: pid['now'])
+    return pid
+
+
+def test_one_http_session_per_process(pid, monkeypatch):
+    monkeypatch.setattr(sessions, '_session', None)
+    session = sessions.get_session()
+    assert sessions.get_session() is session
+    pid['now'] += 1
+    assert sessions.get_session() is not session
+
+
+def test_one_s3_client_per_process(pid, monkeypatch):
+    monkeypatch.setattr(sessions, '_s3_client', None)
+    client = sessions.get_s3_client()
+    assert sessions.get_s3_client() is client
+    pid['now'] += 1
+    assert sessions.get_s3_client() is not client
@@ -0,0 +1,86 @@
+import glob
+import gzip
+import json
+import os
+import pytest
+from foolcalls.config import FoolCalls, Local
+from foolcalls import sync_downloaders, extractors, frontier, helpers, manifest, scrapers, sessions, throttle
+
+FIXTURES = sorted(glob.glob('output/state=downloaded/rundate=*/cid=*.gz'))[:4]
+
+
+def listing_page(call_urls: list) -> bytes:
+    links = ''.join(f'<div class="list-content"><a href="{url}">{url}</a></div>' for url in call_urls)
+    return (f'<html><body><div class="content-block listed-articles recent-articles m-np">{links}</div>'
+            f'</body></html>').encode()
+
+
+@pytest.fixture
+def site(stub_server, tmp_path, monkeypatch):
+    # fool.com stand-in: one listing page of FIXTURES' transcripts, then an empty one.
+    # returns {cid: page served}
+    monkeypatch.setattr(throttle, 'limiter', throttle.HostRateLimiter(rate=100, burst=10))
+    monkeypatch.setattr(sessions, 'validator_cache', sessions.ValidatorCache(str(tmp_path / 'validators')))
+    monkeypatch.setattr(FoolCalls, 'ROOT', stub_server.root)
+    monkeypatch.setattr(FoolCalls, 'EARNINGS_LINKS_ROOT', f'{stub_server.root}/earnings-call-transcripts')
+    monkeypatch.setattr(FoolCalls, 'EARNINGS_TRANSCRIPTS_ROOT', f'{stub_server.root}/earnings/call-transcripts')
+    monkeypatch.setattr(Local, 'SCRAPE_CACHE_ON', False)
+    monkeypatch.setattr(Local, 'MULTIPROCESS_CPUS', 2)
+
+    pages = {}
+    for path in FIXTURES:
+        cid = os.path.basename(path)[len('cid='):-len('.gz')]
+        with gzip.open(path, 'rb') as f:
+            pages[cid] = f.read()
+        stub_server.script(f'/earnings/call-transcripts/{helpers.to_url(cid)}', (200, {}, 0, pages[cid]))
+    call_urls = [f'/earnings/call-transcripts/{helpers.to_url(cid).rstrip("/")}.aspx' for cid in sorted(pages)[::-1]]
+    stub_server.script('/earnings-call-transcripts?page=1', (200, {}, 0, listing_page(call_urls)))
+    stub_server.script('/earnings-call-transcripts?page=2', (200, {}, 0, listing_page([])))
+    return pages
+
+
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_downloads_every_listed_transcript(site, tmp_path, concurrent):
+    outputpath = str(tmp_path / 'store')
+    summary = sync_downloaders.main(outputpath, overwrite=False, scraper_callback=False, concurrent=concurrent)
+    assert (summary['downloaded'], summary['failed']) == (len(site), 0)
+
+    keys = manifest.load(outputpath, manifest.DOWNLOADED)
+    assert sorted(keys) == sorted(site)
+    for cid, page in site.items():
+        assert scrapers.get_raw_transcript_bytes(outputpath, keys[cid]) == extractors.trim_page(page)
+
+    # the next run finds nothing new
+    summary = sync_downloaders.main(outputpath, overwrite=False, scraper_callback=False, concurrent=concurrent)
+    assert (summary['queued'], summary['downloaded']) == (0, 0)
+
+
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_scraper_callback_scrapes_every_download(site, tmp_path, concurrent):
+    outputpath = str(tmp_path / 'store')
+    summary = sync_downloaders.main(outputpath, overwrite=False, scraper_callback=True, concurrent=concurrent)
+    assert (summary['scraped']['succeeded'], summary['scraped']['failed']) == (len(site), 0)
+
+    structured = manifest.load(outputpath, manifest.structured())
+    assert sorted(structured) == sorted(site)
+    for cid in site:
+        with open(f'{outputpath}/{structured[cid]}') as f:
+            output = json.load(f)
+        with gzip.open(f'tests/fixtures/scraped/cid={cid}.json.gz') as f:
+            expected = json.load(f)
+        assert {field: output[field] for field in expected} == expected
+
+
+def test_concurrency_follows_the_limiter(site, stub_server, tmp_path, monkeypatch):
+    # more downloads in flight than FoolCalls.MAX_CONCURRENT_REQUESTS, if the limiter allows it
+    monkeypatch.setattr(throttle, 'limiter', throttle.HostRateLimiter(rate=100, burst=20, max_in_flight=8))
+    cids = [f'2020-07-10-transcript-{i}' for i in range(16)]
+    page = next(iter(site.values()))
+    for cid in cids:
+        stub_server.script(f'/earnings/call-transcripts/{helpers.to_url(cid)}', (200, {}, 0.3, page))
+
+    outputpath = str(tmp_path / 'store')
+    state = frontier.CrawlState.open(outputpath, {})
+    sync_downloaders.download_cids(cids, outputpath, state, concurrent=True)
+    assert len(state.done) == len(cids)
+    assert FoolCalls.MAX_CONCURRENT_REQUESTS < stub_server.max_in_flight <= 8
@@ -0,0 +1,81 @@
+import glob
+import gzip
+import os
+import shutil
+import pytest
+from foolcalls.config import FoolCalls, Local
+from foolcalls import sync_scrapers, layouts, scrapecache
+
+FIXTURES = sorted(glob.glob('output/state=downloaded/rundate=*/cid=*.gz'))[:2]
+UNKNOWN_PAGE = b'<html><body><p>not a transcript</p></body></html>'
+# the usmf-new template's marker, without anything its extractors need
+BROKEN_PAGE = (b'<html><body><section class="usmf-new article-body"><span class="article-content">'
+               b'<h2>Questions and Answers:</h2></span></section></body></html>')
+
+
+def clear_layout_counters():
+    for counter in (layouts.counts, layouts.failures, layouts.cache_hits, layouts.seconds):
+        counter.clear()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(Local, 'SCRAPE_CACHE_ON', False)
+    monkeypatch.setattr(Local, 'MULTIPROCESS_CPUS', 2)
+    clear_layout_counters()
+
+    partition = tmp_path / 'state=downloaded' / 'rundate=20200711'
+    partition.mkdir(parents=True)
+    for path in FIXTURES:
+        shutil.copy(path, partition)
+    for cid, page in [('2020-07-10-unknown-layout', UNKNOWN_PAGE), ('2020-07-10-broken-page', BROKEN_PAGE)]:
+        (partition / f'cid={cid}.gz').write_bytes(gzip.compress(page))
+    return str(tmp_path)
+
+
+def test_queue_skips_scraped_transcripts(store):
+    cids = sorted(item['cid'] for item in sync_scrapers.build_scraper_queue(store, overwrite=False))
+    assert len(cids) == len(FIXTURES) + 2
+    sync_scrapers.main(store, overwrite=False)
+    # the failed ones are queued again
+    assert sorted(item['cid'] for item in sync_scrapers.build_scraper_queue(store, overwrite=False)) == \
+        ['2020-07-10-broken-page', '2020-07-10-unknown-layout']
+    assert sorted(item['cid'] for item in sync_scrapers.build_scraper_queue(store, overwrite=True)) == cids
+
+
+MODES = [{}, {'pipeline': True}, {'output_format': 'packed'}, 'in-process']
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_failures_are_counted_by_layout(store, mode, monkeypatch):
+    if mode == 'in-process':
+        monkeypatch.setattr(Local, 'MULTIPROCESS_ON', False)
+        mode = {}
+    summary = sync_scrapers.main(store, overwrite=False, **mode)
+
+    assert (summary['succeeded'], summary['failed']) == (len(FIXTURES), 2)
+    stats = summary['layouts']
+    assert stats[layouts.UNKNOWN] == {**stats[layouts.UNKNOWN], 'count': 1, 'failures': 1}
+    assert stats['usmf-new/h2-sections']['failures'] == 1
+    assert sum(layout['count'] for layout in stats.values()) == len(FIXTURES) + 2
+    assert os.path.isdir(f'{store}/state=structured')
+
+
+@pytest.mark.parametrize('mode', MODES)
+def test_cache_hits_keep_their_layout(store, mode, tmp_path, monkeypatch):
+    if mode == 'in-process':
+        monkeypatch.setattr(Local, 'MULTIPROCESS_ON', False)
+        mode = {}
+    monkeypatch.setattr(Local, 'SCRAPE_CACHE_ON', True)
+    monkeypatch.setattr(scrapecache, 'cache', scrapecache.ScrapeCache(str(tmp_path / 'cache')))
+    scraped = sync_scrapers.main(store, overwrite=False, **mode)['layouts']
+
+    # a new scraper version re-scrapes everything, all from the cache
+    monkeypatch.setattr(FoolCalls, 'SCRAPER_VERSION', 'test.2')
+    clear_layout_counters()
+    cached = sync_scrapers.main(store, overwrite=False, **mode)['layouts']
+
+    scraped_layouts = {layout: stats['count'] - stats['failures'] for layout, stats in scraped.items()
+                       if stats['count'] > stats['failures']}
+    assert {layout: stats['cached'] for layout, stats in cached.items() if stats['cached']} == scraped_layouts
+    assert 'cached' not in cached
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import pytest
+import requests
+from foolcalls.config import FoolCalls
+from foolcalls import throttle
+
+
+def http_date(seconds_from_now: float, zone: str = 'GMT') -> str:
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=seconds_from_now)
+    return retry_at.strftime(f'%a, %d %b %Y %H:%M:%S {zone}')
+
+
+@pytest.mark.parametrize('zone', ['GMT', '+0000', '-0000'])
+def test_parse_retry_after_http_date(zone):
+    # -0000 parses to a naive datetime
+    assert 25 < throttle.parse_retry_after(http_date(30, zone)) <= 30
+
+
+@pytest.mark.parametrize('retry_after, expected', [('7', 7.0), ('0.5', 0.5), ('-3', 0.0), (None, None),
+                                                   ('soon', None)])
+def test_parse_retry_after_seconds(retry_after, expected):
+    assert throttle.parse_retry_after(retry_after) == expected
+
+
+def test_parse_retry_after_date_in_the_past():
+    assert throttle.parse_retry_after(http_date(-60)) == 0.0
+
+
+# ---------------------------------------------------------------------------
+# CONTROL LOOP, AGAINST A STUB SERVER (see conftest.py)
+# ---------------------------------------------------------------------------
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = throttle.HostRateLimiter(rate=20, burst=1, max_in_flight=4, min_rate=1, max_rate=40)
+    monkeypatch.setattr(throttle, 'limiter', limiter)
+    monkeypatch.setattr(FoolCalls, 'RETRY_BACKOFF_BASE_SECONDS', 0.05)
+    monkeypatch.setattr(FoolCalls, 'RETRY_BACKOFF_MAX_SECONDS', 1)
+    return limiter
+
+
+def gaps(times: list) -> list:
+    return [later - earlier for earlier, later in zip(times, times[1:])]
+
+
+def test_429_waits_retry_after_seconds(stub_server, limiter):
+    url = stub_server.script('/t', (429, {'Retry-After': '0.5'}, 0), (200, {}, 0))
+    assert throttle.get(url).status_code == 200
+    assert gaps(stub_server.requested('/t'))[0] >= 0.5
+    assert limiter.controller(url).rate < 20
+
+
+def test_429_waits_until_retry_after_date(stub_server, limiter):
+    # http dates have whole seconds: 2 seconds from now is 1-2 seconds away
+    url = stub_server.script('/t', (429, {'Retry-After': http_date(2)}, 0), (200, {}, 0))
+    assert throttle.get(url).status_code == 200
+    assert gaps(stub_server.requested('/t'))[0] >= 0.9
+
+
+def test_retry_after_holds_every_request_to_the_host(stub_server, limiter):
+    throttled = stub_server.script('/a', (429, {'Retry-After': '0.5'}, 0), (200, {}, 0))
+    other = stub_server.script('/b', (200, {}, 0))
+    thread = threading.Thread(target=throttle.get, args=(throttled,))
+    thread.start()
+    while not stub_server.requested('/a'):
+        time.sleep(0.01)
+    time.sleep(0.05)  # the 429 is in
+    throttle.get(other)
+    thread.join()
+    assert stub_server.requested('/b')[0] - stub_server.requested('/a')[0] >= 0.45
+
+
+def test_503_backs_off_exponentially(stub_server, limiter, monkeypatch):
+    monkeypatch.setattr(throttle.random, 'uniform', lambda low, high: high)  # no jitter
+    url = stub_server.script('/t', (503, {}, 0), (503, {}, 0), (503, {}, 0), (200, {}, 0))
+    assert throttle.get(url).status_code == 200
+    waits = gaps(stub_server.requested('/t'))
+    assert len(waits) == 3
+    assert all(wait >= 0.05 * 2 ** attempt for attempt, wait in enumerate(waits))
+    assert limiter.controller(url).rate <= 10
+
+
+def test_gives_up_after_max_retries(stub_server, limiter, monkeypatch):
+    monkeypatch.setattr(FoolCalls, 'MAX_RETRIES', 2)
+    url = stub_server.script('/t', (503, {}, 0))
+    with pytest.raises(requests.HTTPError):
+        throttle.get(url)
+    assert len(stub_server.requested('/t')) == 3
+
+
+def test_rate_increases_on_healthy_responses(stub_server, limiter):
+    url = stub_server.script('/t', (200, {}, 0))
+    for _ in range(10):
+        throttle.get(url)
+    assert limiter.controller(url).rate == pytest.approx(20 + 10 * FoolCalls.RATE_INCREASE)
+
+
+def test_slow_responses_cut_the_rate(stub_server, limiter):
+    url = stub_server.script('/t', (200, {}, 0.3))
+    limiter.controller(url).slow_response_seconds = 0.2
+    throttle.get(url)
+    assert limiter.controller(url).rate == pytest.approx(10)
+
+
+def test_token_bucket_paces_after_the_burst():
+    bucket = throttle.TokenBucket(rate=20, burst=2)
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09  # 2 back-to-back, then one every 0.05 seconds
+
+
+def test_rate_stays_within_bounds():
+    controller = throttle.AimdController(throttle.TokenBucket(rate=1), min_rate=0.5, max_rate=1.05, increase=0.1)
+    controller.speed_up()
+    assert controller.rate == 1.05
+    for _ in range(3):
+        controller.last_decrease = 0  # as if the last decrease were long ago
+        controller.on_response(429, 0)
+    assert controller.rate == 0.5
+
+
+def test_decreases_from_one_burst_count_once():
+    # failures of requests that were in-flight together only halve the rate once
+    controller = throttle.AimdController(throttle.TokenBucket(rate=4), min_rate=0.1, max_rate=10)
+    for _ in range(4):
+        controller.on_response(503, 0)
+    assert controller.rate == 2
+
+
+def test_in_flight_cap_across_event_loops():
+    # every download_cids() call runs its own event loop (asyncio.run), e.g. sync_downloaders' retry rounds
+    limiter = throttle.HostRateLimiter(max_in_flight=2)
+    in_flight = {'now': 0, 'max': 0}
+
+    async def download():
+        async with limiter.in_flight('http://example.com/a'):
+            in_flight['now'] += 1
+            in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            await asyncio.sleep(0.01)
+            in_flight['now'] -= 1
+
+    async def downloads():
+        await asyncio.gather(*(download() for _ in range(6)))
+
+    for _ in range(2):
+        asyncio.run(downloads())
+    assert in_flight['max'] == 2